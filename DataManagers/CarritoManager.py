@@ -1,49 +1,52 @@
 from flask import redirect, session, jsonify
-import os
-import pymongo
+from pymongo import UpdateOne
 import random
 import string
 import urllib.parse
+import uuid
 from datetime import datetime
-from dotenv import load_dotenv
 from bson.objectid import ObjectId
+from DataManagers.ProductManager import image_url
+from DataManagers.StatsRollup import StatsRollup
+from DataManagers.Database import get_database
 
 class CarritoManager:
-    def __init__(self):
-        """Initialize the connection to the database and ensure 'cart' collection exists."""
-        load_dotenv()
-        MONGO_URI = os.getenv("MONGO_URI")
-        DATABASE_NAME = os.getenv("DATABASE_NAME")
-
-        self.client = pymongo.MongoClient(MONGO_URI)
-        self.db = self.client[DATABASE_NAME]
-
-        # Ensure the 'cart' collection exists
-        if "cart" not in self.db.list_collection_names():
-            self.db.create_collection("cart")
+    def __init__(self, database=None):
+        """Use the shared database connection. Collections and indexes are created by SchemaManager."""
+        self.database = database or get_database()
+
+        # Order statistics, updated in the same transaction as the checkout
+        self.stats = StatsRollup(self.database)
+
+    @property
+    def db(self):
+        """Database of the current process (see DataManagers.Database)."""
+        return self.database.db
+
     def generate_random_id(self, length=10):
         """Generates a random string of uppercase letters and digits."""
         return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
 
     def set_prod_in_cart(self, user_id, product_id, form_data):
         """
-        Inserts a product into the 'cart' collection with a unique identifier.
+        Appends a product to the client's cart document with a unique identifier.
         """
         unique_id = self.generate_random_id()  # Generate a unique 10-character string
         
         cart_entry = {
+            "_id": ObjectId(),  # Line item id, used to remove it from the cart
             "entry_id": unique_id,  # Unique random identifier
-            "client": user_id,
             "model": ObjectId(product_id),  # Ensure product_id is stored as ObjectId
             "forms_lleno": form_data,  # Preserve the original data structure
         }
-        self.db.cart.insert_one(cart_entry)
+        self.db.carts.update_one({"_id": user_id}, {"$push": {"items": cart_entry}}, upsert=True)
 
     def get_carrito_for_client(self, client_id):
         """
-        Retrieves all products in the 'cart' for a specific client.
+        Retrieves all products in the cart for a specific client.
         """
-        carrito_items = list(self.db.cart.find({"client": client_id}))
+        cart = self.db.carts.find_one({"_id": client_id}, {"items": 1})
+        carrito_items = cart.get("items", []) if cart else []
         
         for item in carrito_items:
             item["_id"] = str(item["_id"])
@@ -51,13 +54,26 @@ class CarritoManager:
 
         return carrito_items
 
-    def remove_from_cart(self, cart_item_id):
+    def count_carrito_for_client(self, client_id):
+        """
+        Returns the number of items in the cart for a specific client without loading them.
+        """
+        result = list(self.db.carts.aggregate([
+            {"$match": {"_id": client_id}},
+            {"$project": {"count": {"$size": {"$ifNull": ["$items", []]}}}}
+        ]))
+        return result[0]["count"] if result else 0
+
+    def remove_from_cart(self, client_id, cart_item_id):
         """
-        Removes a product from the 'cart' collection based on its _id.
+        Removes a product from the client's cart based on its line item _id.
         """
         try:
-            result = self.db.cart.delete_one({"_id": ObjectId(cart_item_id)})
-            if result.deleted_count > 0:
+            result = self.db.carts.update_one(
+                {"_id": client_id, "items._id": ObjectId(cart_item_id)},
+                {"$pull": {"items": {"_id": ObjectId(cart_item_id)}}}
+            )
+            if result.modified_count > 0:
                 return {"success": True, "message": "Producto eliminado del carrito."}
             else:
                 return {"success": False, "error": "Producto no encontrado en el carrito."}
@@ -66,33 +82,37 @@ class CarritoManager:
 
     def get_product_details_from_cart(self, client_id):
         """
-        Retrieves product details (modelo and img_2) from the 'prods' collection for all items in the cart.
+        Retrieves product details (modelo and img_2 URL) from the 'prods' collection for all items in the cart.
+        Uses a fixed number of queries regardless of the cart size: products and images are fetched in batches.
         """
         carrito_items = self.get_carrito_for_client(client_id)
-        prods_collection = self.db["prods"]
-        imgs_collection = self.db["imgs"]  # Ensure the image data is correctly fetched
+        if not carrito_items:
+            return []
+
+        # Fetch every distinct product in the cart in a single query
+        product_ids = list({ObjectId(item["model"]) for item in carrito_items})
+        products = {
+            str(product["_id"]): product
+            for product in self.db["prods"].find({"_id": {"$in": product_ids}}, {"modelo": 1, "img_hashes.img_2": 1})
+        }
+
+        # Check which catalog images exist in a single query; their bytes are served by /img/<hash>
+        img_hashes = list({product.get("img_hashes", {}).get("img_2") for product in products.values()} - {None})
+        existing_hashes = {img["_id"] for img in self.db["imgs"].find({"_id": {"$in": img_hashes}}, {"_id": 1})}
 
         cart_details = []
 
         for item in carrito_items:
-            product_id = ObjectId(item["model"])  # Convert back to ObjectId
-            product = prods_collection.find_one({"_id": product_id})
+            product = products.get(item["model"])
 
             if product:
                 model_name = product.get("modelo", "Modelo no encontrado")
                 img_2_hash = product.get("img_hashes", {}).get("img_2", None)
 
-                # Fetch actual image data using img_2 hash
-                img_data = None
-                if img_2_hash:
-                    img_doc = imgs_collection.find_one({"_id": img_2_hash}, {"image_data": 1})
-                    if img_doc:
-                        img_data = img_doc.get("image_data")
-
                 cart_details.append({
                     "_id": item["_id"],
                     "model": model_name,
-                    "img_2": f"data:image/png;base64,{img_data}" if img_data else None,
+                    "img_2": image_url(img_2_hash, "thumb") if img_2_hash in existing_hashes else None,
                     "forms_lleno": item["forms_lleno"]
                 })
 
@@ -102,51 +122,99 @@ class CarritoManager:
         """Generates a random string of uppercase letters and digits."""
         return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
     
-    def finalizar_compra(self, client_id):
+    def finalizar_compra(self, client_id, idempotency_key=None):
         """
         Finalizes the purchase by moving cart items to the orders collection, 
         generating an order summary, and returning a WhatsApp message link.
+        Runs inside a transaction keyed by 'idempotency_key': retrying with the same key
+        returns the order already created instead of creating a new one.
         """
-        carrito_items = list(self.db.cart.find({"client": client_id}))
-        if not carrito_items:
-            return {"success": False, "error": "No hay productos en el carrito."}
+        idempotency_key = idempotency_key or uuid.uuid4().hex
 
-        # Obtener el nombre del cliente
-        usuario_doc = self.db.usuarios.find_one({"_id": ObjectId(client_id)}, {"client_name": 1})
-        usuario = usuario_doc["client_name"] if usuario_doc else "Cliente Desconocido"
+        # Retry of a checkout that already went through
+        existing_order = self.db.orders.find_one({"client_id": client_id, "idempotency_key": idempotency_key})
+        if existing_order:
+            # The first attempt may have stopped before adding the order to the stats; this is a no-op otherwise
+            if self.stats.registrar_pedido(existing_order["_id"]):
+                self.stats.incrementar_version()
+            return self.build_compra_response(existing_order)
 
-        # Contar productos y cantidad total
-        total_cantidad = sum(int(item["forms_lleno"].get("Cantidad", 0)) for item in carrito_items)
-        total_pedidos = len(carrito_items)
-
-        # Generar detalles del pedido
-        time_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        orden_id = self.generate_random_id()
-
-        # Crear la orden con todos los productos
-        order_data = {
-            "orden_id": orden_id,
-            "client_id": client_id,
-            "timestamp": time_stamp,
-            "estado": "Enviado",
-            "total_pedidos": total_pedidos,
-            "total_urnas": total_cantidad,
-            "productos": carrito_items  # Guardamos todos los items del carrito dentro de 'productos'
-        }
+        def crear_orden(session):
+            existing_order = self.db.orders.find_one(
+                {"client_id": client_id, "idempotency_key": idempotency_key}, session=session
+            )
+            if existing_order:
+                return existing_order
+
+            # Take the whole cart: items added after this point start a new cart
+            cart = self.db.carts.find_one_and_delete({"_id": client_id}, session=session)
+            carrito_items = cart.get("items", []) if cart else []
+            if not carrito_items:
+                return None
+
+            # Snapshot of the product name and laser-cut data in effect, so the order never depends on 'prods' again
+            product_ids = list({item["model"] for item in carrito_items})
+            products = {
+                product["_id"]: product
+                for product in self.db.prods.find(
+                    {"_id": {"$in": product_ids}}, {"modelo": 1, "corte_lazer_hash": 1}, session=session
+                )
+            }
+            for item in carrito_items:
+                product = products.get(item["model"], {})
+                item["modelo"] = product.get("modelo", "Modelo Desconocido")
+                item["corte_lazer_hash"] = product.get("corte_lazer_hash")
+
+            # Contar productos y cantidad total
+            total_cantidad = sum(int(item["forms_lleno"].get("Cantidad", 0)) for item in carrito_items)
 
-        # Insertar la orden en la colección 'orders'
-        self.db.orders.insert_one(order_data)
+            # Crear la orden con todos los productos
+            order_data = {
+                "orden_id": self.generate_random_id(),
+                "client_id": client_id,
+                "idempotency_key": idempotency_key,
+                "timestamp": datetime.now().replace(microsecond=0),  # Fecha BSON, indexada junto a client_id y estado
+                "estado": "Enviado",
+                "stats_aplicadas": False,  # Set by StatsRollup.registrar_pedido after the commit
+                "total_pedidos": len(carrito_items),
+                "total_urnas": total_cantidad,
+                "productos": carrito_items  # Guardamos todos los items del carrito dentro de 'productos'
+            }
 
-        # Eliminar los productos del carrito
-        self.db.cart.delete_many({"client": client_id})
+            # Insertar la orden en la colección 'orders'
+            self.db.orders.insert_one(order_data, session=session)
+            return order_data
+
+        # The cart removal and the order insert commit together (or not at all)
+        with self.database.client.start_session() as session:
+            order = session.with_transaction(crear_orden)
+
+        if not order:
+            return {"success": False, "error": "No hay productos en el carrito."}
+
+        # Stats and the cache version are updated after the commit: their documents are shared by every checkout
+        # ('estado:Enviado', 'dia:<today>', the version), so writing them inside the transaction would make
+        # concurrent checkouts conflict. registrar_pedido is keyed by the order id, so a retry never counts it twice.
+        self.stats.registrar_pedido(order["_id"])
+        self.stats.incrementar_version()
+
+        return self.build_compra_response(order)
+
+    def build_compra_response(self, order):
+        """
+        Builds the checkout response (WhatsApp message link) for an order.
+        """
+        # Obtener el nombre del cliente
+        usuario_doc = self.db.usuarios.find_one({"_id": ObjectId(order["client_id"])}, {"client_name": 1})
+        usuario = usuario_doc["client_name"] if usuario_doc else "Cliente Desconocido"
 
         # Crear el mensaje para WhatsApp
         mensaje = (
             f"Hola, soy {usuario}.\n"
-            f"Orden ID: {orden_id}\n"
-            f"Fecha de compra: {time_stamp}\n"
-            f"Cantidad de pedidos: {total_pedidos}\n"
-            f"Total de urnas: {total_cantidad}\n"
+            f"Orden ID: {order['orden_id']}\n"
+            f"Fecha de compra: {order['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}\n"
+            f"Cantidad de pedidos: {order['total_pedidos']}\n"
+            f"Total de urnas: {order['total_urnas']}\n"
             f"Estado: Enviado\n"
         )
 
@@ -154,4 +222,41 @@ class CarritoManager:
         mensaje_codificado = urllib.parse.quote(mensaje)
         whatsapp_link = f"https://api.whatsapp.com/send?phone=3325648862&text={mensaje_codificado}"
 
-        return {"success": True, "whatsapp_link": whatsapp_link}
\ No newline at end of file
+        return {"success": True, "orden_id": order["orden_id"], "whatsapp_link": whatsapp_link}
+
+    def migrate_cart_to_single_document(self, batch_size=500):
+        """
+        Moves line items from the legacy 'cart' collection (one document per item) into 'carts'
+        (one document per client). Reads the old collection with a batched cursor and can be re-run safely:
+        items keep their _id, so $addToSet ignores the ones already moved.
+        """
+        migrated = 0
+
+        def flush(items_by_client, item_ids):
+            operations = [
+                UpdateOne({"_id": client_id}, {"$addToSet": {"items": {"$each": items}}}, upsert=True)
+                for client_id, items in items_by_client.items()
+            ]
+            self.db.carts.bulk_write(operations, ordered=False)
+            self.db.cart.delete_many({"_id": {"$in": item_ids}})
+            return len(item_ids)
+
+        items_by_client = {}
+        item_ids = []
+        for doc in self.db.cart.find({}).batch_size(batch_size):
+            items_by_client.setdefault(doc["client"], []).append({
+                "_id": doc["_id"],
+                "entry_id": doc.get("entry_id"),
+                "model": doc["model"],
+                "forms_lleno": doc.get("forms_lleno", {}),
+            })
+            item_ids.append(doc["_id"])
+
+            if len(item_ids) >= batch_size:
+                migrated += flush(items_by_client, item_ids)
+                items_by_client, item_ids = {}, []
+
+        if item_ids:
+            migrated += flush(items_by_client, item_ids)
+
+        return {"success": True, "migrated": migrated}
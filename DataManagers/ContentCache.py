@@ -0,0 +1,59 @@
+import os
+import bson
+from DataManagers.LRUCache import LRUCache
+
+# Memoria máxima (en bytes) para los documentos de 'forms' y 'corte_lazer' cacheados en cada proceso
+CONTENT_CACHE_MAX_BYTES = int(os.getenv("CONTENT_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+
+
+class ContentCache:
+    def __init__(self, max_bytes=CONTENT_CACHE_MAX_BYTES):
+        """
+        Caché de documentos direccionados por contenido ('forms', 'corte_lazer').
+        Su _id es el hash de su contenido, así que un documento nunca cambia y no hace falta invalidarlo.
+        Los documentos devueltos se comparten entre llamadas: no deben modificarse.
+        """
+        self.cache = LRUCache(max_size=max_bytes, sizeof=lambda doc: len(bson.encode(doc)), name="contenido")
+
+    def get(self, collection, content_hash):
+        """Devuelve el documento con _id 'content_hash' de la colección, o None si no existe."""
+        if not content_hash:
+            return None
+
+        key = (collection.name, content_hash)
+        doc = self.cache.get(key)
+        if doc is None:
+            doc = collection.find_one({"_id": content_hash})
+            if doc is not None:
+                self.cache.set(key, doc)
+        return doc
+
+    def get_many(self, collection, content_hashes):
+        """Devuelve un diccionario hash -> documento, pidiendo a la BD en una sola consulta los que falten."""
+        docs = {}
+        missing = []
+        for content_hash in set(filter(None, content_hashes)):
+            doc = self.cache.get((collection.name, content_hash))
+            if doc is None:
+                missing.append(content_hash)
+            else:
+                docs[content_hash] = doc
+
+        if missing:
+            for doc in collection.find({"_id": {"$in": missing}}):
+                self.cache.set((collection.name, doc["_id"]), doc)
+                docs[doc["_id"]] = doc
+
+        return docs
+
+    def pop(self, collection, content_hash):
+        """Olvida un documento (cuando se elimina de la BD)."""
+        self.cache.pop((collection.name, content_hash))
+
+    def stats(self):
+        """Devuelve las estadísticas de la caché."""
+        return self.cache.stats()
+
+
+# Instancia compartida por todos los managers del proceso
+content_cache = ContentCache()
@@ -0,0 +1,96 @@
+import os
+import threading
+import pymongo
+from dotenv import load_dotenv
+
+# Opciones del MongoClient que se pueden ajustar con variables de entorno (las que no estén definidas
+# usan el valor por defecto de pymongo)
+CLIENT_OPTIONS_ENV = {
+    "maxPoolSize": ("MONGO_MAX_POOL_SIZE", int),
+    "minPoolSize": ("MONGO_MIN_POOL_SIZE", int),
+    "maxIdleTimeMS": ("MONGO_MAX_IDLE_TIME_MS", int),
+    "waitQueueTimeoutMS": ("MONGO_WAIT_QUEUE_TIMEOUT_MS", int),
+    "connectTimeoutMS": ("MONGO_CONNECT_TIMEOUT_MS", int),
+    "socketTimeoutMS": ("MONGO_SOCKET_TIMEOUT_MS", int),
+    "serverSelectionTimeoutMS": ("MONGO_SERVER_SELECTION_TIMEOUT_MS", int),
+    "w": ("MONGO_WRITE_CONCERN", lambda value: int(value) if value.isdigit() else value),
+    "readConcernLevel": ("MONGO_READ_CONCERN", str),
+    "readPreference": ("MONGO_READ_PREFERENCE", str),
+    "appname": ("MONGO_APP_NAME", str),
+}
+
+
+def client_options_from_env():
+    """Lee de las variables de entorno las opciones del MongoClient (tamaño del pool, timeouts, concerns)."""
+    options = {}
+    for option, (env_name, convert) in CLIENT_OPTIONS_ENV.items():
+        value = os.getenv(env_name)
+        if value:
+            options[option] = convert(value)
+    return options
+
+
+class Database:
+    def __init__(self, uri=None, database_name=None, **client_options):
+        """
+        Conexión a MongoDB compartida por todos los managers del proceso: un único MongoClient (y un único pool
+        de conexiones) por proceso. Se crea al primer uso y se vuelve a crear en el proceso hijo después de un
+        fork (gunicorn --preload), porque un MongoClient no debe usarse a ambos lados de un fork.
+        Los managers la reciben en su constructor, así que se puede sustituir (por ejemplo, en pruebas).
+        """
+        load_dotenv()
+        self.uri = uri or os.getenv("MONGO_URI")
+        self.database_name = database_name or os.getenv("DATABASE_NAME")
+        self.client_options = {**client_options_from_env(), **client_options}
+
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+        # Olvidar el cliente del padre en el hijo recién creado; el hijo abre el suyo al primer uso
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    @property
+    def client(self):
+        """MongoClient de este proceso (se crea la primera vez que se usa)."""
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    self._client = pymongo.MongoClient(self.uri, **self.client_options)
+                    self._pid = os.getpid()
+        return self._client
+
+    @property
+    def db(self):
+        """Base de datos de la aplicación."""
+        return self.client[self.database_name]
+
+    def __getitem__(self, name):
+        """Devuelve una colección de la base de datos."""
+        return self.db[name]
+
+    def close(self):
+        """Cierra el cliente de este proceso (se vuelve a crear si se usa otra vez)."""
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = None
+            self._pid = None
+
+    def _reset(self):
+        """Descarta el cliente heredado del proceso padre sin cerrarlo (sus conexiones son del padre)."""
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+
+_database = None
+
+
+def get_database():
+    """Devuelve la conexión compartida del proceso, creándola la primera vez."""
+    global _database
+    if _database is None:
+        _database = Database()
+    return _database
@@ -0,0 +1,127 @@
+import io
+
+# A partir de este número de filas el libro se escribe en modo constant_memory (fila a fila, a disco)
+CONSTANT_MEMORY_ROWS = 1000
+
+# Colores de título y encabezado de cada tabla, en orden
+TITLE_COLORS = ["#2F5597", "#009688", "#795548"]
+HEADER_COLORS = ["#D9E1F2", "#B2DFDB", "#D7CCC8"]
+
+
+class ExcelExporter:
+    def __init__(self, sheet_name="Resumen Pedido"):
+        """
+        Exporta tablas a una sola hoja de Excel con el formato de los pedidos (títulos fusionados con color,
+        encabezados y celdas con borde, números centrados y columnas ajustadas al contenido).
+        Cada tabla es un diccionario {"title": str, "columns": [str], "rows": [[valor, ...]]}.
+        """
+        self.sheet_name = sheet_name
+
+    def export(self, tables, output=None):
+        """Escribe las tablas (una debajo de otra) y devuelve el buffer con el archivo .xlsx."""
+        import xlsxwriter  # Se importa al exportar, no al arrancar la aplicación
+
+        output = output or io.BytesIO()
+        total_rows = sum(len(table["rows"]) for table in tables)
+
+        workbook = xlsxwriter.Workbook(output, {"constant_memory": total_rows > CONSTANT_MEMORY_ROWS})
+        worksheet = workbook.add_worksheet(self.sheet_name)
+        title_formats, header_formats, cell_format, cell_center_format = self._formats(workbook)
+
+        widths = {}  # Ancho máximo de cada columna, calculado mientras se escriben las filas
+        row = 0
+
+        for index, table in enumerate(tables):
+            columns = table["columns"]
+            if not table["rows"] or not columns:
+                continue  # Si está vacía, no escribirla
+
+            row = self._write_header(worksheet, row, table["title"], columns, widths,
+                                     title_formats[index % len(title_formats)], header_formats[index % len(header_formats)])
+
+            # Datos: números centrados, todo lo demás como texto
+            for values in table["rows"]:
+                self._write_values(worksheet, row, values, widths, cell_format, cell_center_format)
+                row += 1
+
+            row += 2  # Dejar espacio entre tablas
+
+        for col, width in widths.items():
+            worksheet.set_column(col, col, width + 2)
+
+        workbook.close()
+        output.seek(0)
+        return output
+
+    def export_sheets(self, sheets, rows, output=None):
+        """
+        Escribe una hoja por tabla a partir de un iterable de filas, sin tenerlas todas en memoria
+        (el libro se escribe siempre en modo constant_memory).
+        sheets: lista de {"name": str, "title": str, "columns": [str]}.
+        rows: iterable de (índice de la hoja, [valor, ...]); las filas de cada hoja llegan en orden.
+        """
+        import xlsxwriter  # Se importa al exportar, no al arrancar la aplicación
+
+        output = output or io.BytesIO()
+        workbook = xlsxwriter.Workbook(output, {"constant_memory": True})
+        title_formats, header_formats, cell_format, cell_center_format = self._formats(workbook)
+
+        worksheets = []
+        for index, sheet in enumerate(sheets):
+            worksheet = workbook.add_worksheet(sheet["name"])
+            widths = {}
+            next_row = self._write_header(worksheet, 0, sheet["title"], sheet["columns"], widths,
+                                          title_formats[index % len(title_formats)], header_formats[index % len(header_formats)])
+            worksheets.append({"worksheet": worksheet, "widths": widths, "row": next_row})
+
+        for index, values in rows:
+            state = worksheets[index]
+            self._write_values(state["worksheet"], state["row"], values, state["widths"], cell_format, cell_center_format)
+            state["row"] += 1
+
+        for state in worksheets:
+            for col, width in state["widths"].items():
+                state["worksheet"].set_column(col, col, width + 2)
+
+        workbook.close()
+        output.seek(0)
+        return output
+
+    def _formats(self, workbook):
+        """Crea los formatos de títulos, encabezados y celdas del libro."""
+        title_formats = [
+            workbook.add_format({"bold": True, "font_size": 16, "align": "center", "valign": "vcenter", "bg_color": color, "font_color": "white"})
+            for color in TITLE_COLORS
+        ]
+        header_formats = [
+            workbook.add_format({"bold": True, "font_size": 12, "bg_color": color, "align": "center", "border": 1})
+            for color in HEADER_COLORS
+        ]
+        cell_format = workbook.add_format({"font_size": 11, "border": 1})
+        cell_center_format = workbook.add_format({"font_size": 11, "border": 1, "align": "center"})
+        return title_formats, header_formats, cell_format, cell_center_format
+
+    def _write_header(self, worksheet, row, title, columns, widths, title_format, header_format):
+        """Escribe el título fusionado y los encabezados de una tabla. Devuelve la fila siguiente."""
+        if len(columns) > 1:
+            worksheet.merge_range(row, 0, row, len(columns) - 1, title, title_format)
+        else:
+            worksheet.write_string(row, 0, title, title_format)
+        row += 1
+
+        worksheet.write_row(row, 0, columns, header_format)
+        for col, name in enumerate(columns):
+            widths[col] = max(widths.get(col, 0), len(str(name)))
+        return row + 1
+
+    def _write_values(self, worksheet, row, values, widths, cell_format, cell_center_format):
+        """Escribe una fila de datos (números centrados, todo lo demás como texto) y actualiza los anchos."""
+        for col, value in enumerate(values):
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and value == value:
+                worksheet.write_number(row, col, value, cell_center_format)
+                text = str(value)
+            else:
+                text = "" if value is None else str(value)
+                worksheet.write_string(row, col, text, cell_format)
+            if len(text) > widths.get(col, 0):
+                widths[col] = len(text)
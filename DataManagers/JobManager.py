@@ -0,0 +1,219 @@
+import io
+import os
+import time
+import logging
+import pymongo
+import gridfs
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from DataManagers.Database import get_database
+
+# Segundos que se conservan los trabajos terminados (y sus archivos) antes de borrarlos
+JOBS_RETENTION_SECONDS = int(os.getenv("JOBS_RETENTION_SECONDS", 3600))
+
+# Un trabajo "en_proceso" durante más de estos segundos se considera abandonado (el worker murió) y se reintenta
+JOBS_TIMEOUT_SECONDS = int(os.getenv("JOBS_TIMEOUT_SECONDS", 600))
+
+# Veces que se intenta un trabajo abandonado antes de marcarlo como error
+JOBS_MAX_INTENTOS = int(os.getenv("JOBS_MAX_INTENTOS", 3))
+
+# Segundos que espera el worker cuando no hay trabajos pendientes
+JOBS_POLL_SECONDS = float(os.getenv("JOBS_POLL_SECONDS", 1))
+
+# Cada cuántos segundos el worker borra los trabajos expirados
+JOBS_PURGE_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+
+class JobManager:
+    def __init__(self, database=None):
+        """
+        Cola de trabajos en la colección 'jobs' para exportaciones e informes pesados, que así no ocupan
+        un worker web. Las rutas encolan un trabajo y devuelven su id; un proceso aparte (flask jobs-worker)
+        los ejecuta y guarda el resultado. Los archivos generados se guardan en GridFS ('jobs_fs').
+        Estados de un trabajo: pendiente → en_proceso → terminado | error, o pendiente → cancelado.
+        """
+        self.database = database or get_database()
+        self.tareas = {}  # tipo -> función que ejecuta el trabajo
+
+    @property
+    def db(self):
+        """Base de datos del proceso actual (ver DataManagers.Database)."""
+        return self.database.db
+
+    @property
+    def jobs_col(self):
+        return self.db["jobs"]
+
+    @property
+    def jobs_fs(self):
+        return gridfs.GridFSBucket(self.db, bucket_name="jobs_fs")
+
+    def register(self, tipo, funcion):
+        """
+        Registra la función que ejecuta los trabajos de un tipo. Recibe los parámetros del trabajo como
+        argumentos con nombre y devuelve un diccionario; si incluye "archivo" (bytes o buffer), se guarda
+        en GridFS junto con "filename" y "mimetype" y el resto del diccionario queda como resultado.
+        """
+        self.tareas[tipo] = funcion
+
+    def encolar(self, tipo, params=None, user=None):
+        """Crea un trabajo pendiente y devuelve su id."""
+        if tipo not in self.tareas:
+            return {"success": False, "error": f"Tipo de trabajo desconocido: {tipo}"}
+
+        result = self.jobs_col.insert_one({
+            "tipo": tipo,
+            "params": params or {},
+            "user": user,
+            "estado": "pendiente",
+            "intentos": 0,
+            "created_at": datetime.now(),
+        })
+        return {"success": True, "job_id": str(result.inserted_id)}
+
+    def get_job(self, job_id):
+        """Devuelve el estado de un trabajo (sin el archivo), o None si no existe o ya expiró."""
+        if not ObjectId.is_valid(job_id):
+            return None
+
+        job = self.jobs_col.find_one({"_id": ObjectId(job_id)})
+        if not job:
+            return None
+
+        return {
+            "job_id": str(job["_id"]),
+            "tipo": job["tipo"],
+            "estado": job["estado"],
+            "resultado": job.get("resultado"),
+            "error": job.get("error"),
+            "archivo": job.get("archivo_id") is not None,
+            "created_at": job["created_at"].isoformat(),
+            "finished_at": job["finished_at"].isoformat() if job.get("finished_at") else None,
+        }
+
+    def cancelar(self, job_id):
+        """Cancela un trabajo que todavía no tomó ningún worker. Devuelve True si se canceló."""
+        if not ObjectId.is_valid(job_id):
+            return False
+
+        ahora = datetime.now()
+        result = self.jobs_col.update_one(
+            {"_id": ObjectId(job_id), "estado": "pendiente"},
+            {"$set": {"estado": "cancelado", "finished_at": ahora, "expires_at": ahora + timedelta(seconds=JOBS_RETENTION_SECONDS)}}
+        )
+        return result.modified_count == 1
+
+    def get_archivo(self, job_id):
+        """
+        Devuelve {"stream", "filename", "mimetype"} con el archivo generado por un trabajo, o None. 'stream' se lee
+        de GridFS por fragmentos a medida que se envía (quien lo usa debe cerrarlo; send_file lo hace).
+        """
+        if not ObjectId.is_valid(job_id):
+            return None
+
+        job = self.jobs_col.find_one({"_id": ObjectId(job_id), "estado": "terminado"}, {"archivo_id": 1})
+        if not job or job.get("archivo_id") is None:
+            return None
+
+        try:
+            stream = self.jobs_fs.open_download_stream(job["archivo_id"])
+        except gridfs.errors.NoFile:
+            return None
+
+        metadata = stream.metadata or {}
+        return {"stream": stream, "filename": stream.filename, "mimetype": metadata.get("mimetype", "application/octet-stream")}
+
+    def tomar_siguiente(self):
+        """
+        Marca como "en_proceso" el trabajo pendiente más antiguo (o uno abandonado por un worker que murió)
+        y lo devuelve. Es atómico, así que varios workers pueden compartir la cola.
+        """
+        ahora = datetime.now()
+        return self.jobs_col.find_one_and_update(
+            {"$or": [
+                {"estado": "pendiente"},
+                {"estado": "en_proceso", "started_at": {"$lt": ahora - timedelta(seconds=JOBS_TIMEOUT_SECONDS)},
+                 "intentos": {"$lt": JOBS_MAX_INTENTOS}},
+            ]},
+            {"$set": {"estado": "en_proceso", "started_at": ahora, "worker": os.getpid()}, "$inc": {"intentos": 1}},
+            sort=[("created_at", pymongo.ASCENDING)],
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+
+    def ejecutar(self, job):
+        """Ejecuta un trabajo y guarda su resultado (o el error)."""
+        update = {}
+        try:
+            tarea = self.tareas.get(job["tipo"])
+            if tarea is None:
+                raise ValueError(f"Tipo de trabajo desconocido: {job['tipo']}")
+
+            resultado = dict(tarea(**job.get("params", {})) or {})
+            archivo = resultado.pop("archivo", None)
+            filename = resultado.pop("filename", f"{job['_id']}")
+            mimetype = resultado.pop("mimetype", "application/octet-stream")
+
+            if archivo is not None:
+                if isinstance(archivo, (bytes, bytearray)):
+                    archivo = io.BytesIO(archivo)
+                update["archivo_id"] = self.jobs_fs.upload_from_stream(filename, archivo, metadata={"mimetype": mimetype, "job_id": job["_id"]})
+                archivo.close()  # Los archivos temporales se borran al cerrarse
+
+            update.update({"estado": "terminado", "resultado": resultado})
+        except Exception as e:
+            logger.exception("Error en el trabajo %s (%s)", job["_id"], job["tipo"])
+            update.update({"estado": "error", "error": str(e)})
+
+        update["finished_at"] = datetime.now()
+        update["expires_at"] = update["finished_at"] + timedelta(seconds=JOBS_RETENTION_SECONDS)
+        self.jobs_col.update_one({"_id": job["_id"]}, {"$set": update})
+        return update["estado"]
+
+    def marcar_abandonados(self):
+        """Marca como error los trabajos abandonados que ya agotaron sus intentos."""
+        limite = datetime.now() - timedelta(seconds=JOBS_TIMEOUT_SECONDS)
+        return self.jobs_col.update_many(
+            {"estado": "en_proceso", "started_at": {"$lt": limite}, "intentos": {"$gte": JOBS_MAX_INTENTOS}},
+            {"$set": {"estado": "error", "error": "El trabajo no terminó tras varios intentos",
+                      "finished_at": datetime.now(), "expires_at": datetime.now() + timedelta(seconds=JOBS_RETENTION_SECONDS)}}
+        ).modified_count
+
+    def purgar_expirados(self):
+        """Borra los trabajos cuyo tiempo de retención terminó, junto con sus archivos."""
+        expirados = list(self.jobs_col.find({"expires_at": {"$lt": datetime.now()}}, {"archivo_id": 1}))
+        for job in expirados:
+            if job.get("archivo_id") is not None:
+                try:
+                    self.jobs_fs.delete(job["archivo_id"])
+                except gridfs.errors.NoFile:
+                    pass
+
+        if expirados:
+            self.jobs_col.delete_many({"_id": {"$in": [job["_id"] for job in expirados]}})
+        return len(expirados)
+
+    def run_worker(self, once=False):
+        """
+        Ejecuta trabajos de la cola hasta que se interrumpa el proceso.
+        Con once=True procesa los pendientes y termina.
+        """
+        procesados = 0
+        ultima_purga = 0
+        while True:
+            if time.monotonic() - ultima_purga > JOBS_PURGE_SECONDS:
+                self.marcar_abandonados()
+                self.purgar_expirados()
+                ultima_purga = time.monotonic()
+
+            job = self.tomar_siguiente()
+            if job is not None:
+                estado = self.ejecutar(job)
+                procesados += 1
+                logger.info("Trabajo %s (%s): %s", job["_id"], job["tipo"], estado)
+                continue
+
+            if once:
+                return {"success": True, "procesados": procesados}
+            time.sleep(JOBS_POLL_SECONDS)
@@ -0,0 +1,89 @@
+import time
+import threading
+from collections import OrderedDict
+from DataManagers.Metrics import cache_result
+
+
+class LRUCache:
+    def __init__(self, max_size, ttl=None, sizeof=None, name=None):
+        """
+        Caché en memoria con expulsión LRU.
+        max_size: límite total medido con 'sizeof' (por defecto, número de entradas).
+        ttl: segundos que una entrada sigue siendo válida (None = sin expiración).
+        name: si se indica, los aciertos y fallos se exportan en /metrics con ese nombre.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sizeof = sizeof or (lambda value: 1)
+        self.name = name
+
+        self._data = OrderedDict()  # key -> (value, size, stored_at)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Devuelve el valor guardado para 'key' o 'default' si no existe o ya expiró."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[2] > self.ttl:
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+
+        if self.name:
+            cache_result(self.name, entry is not None)
+        return default if entry is None else entry[0]
+
+    def set(self, key, value):
+        """Guarda un valor y expulsa las entradas menos usadas si se supera el límite."""
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return  # Nunca cabría: no vaciar la caché por él
+
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+            self._data[key] = (value, size, time.monotonic())
+            self._size += size
+
+            while self._size > self.max_size:
+                oldest_key = next(iter(self._data))
+                self._remove(oldest_key)
+
+    def pop(self, key):
+        """Elimina una entrada si existe."""
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        """Vacía la caché (las estadísticas se conservan)."""
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def stats(self):
+        """Devuelve aciertos, fallos, tasa de aciertos y ocupación de la caché."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entries": len(self._data),
+                "size": self._size,
+                "max_size": self.max_size,
+            }
+
+    def _remove(self, key):
+        """Elimina una entrada. Debe llamarse con el lock adquirido."""
+        _, size, _ = self._data.pop(key)
+        self._size -= size
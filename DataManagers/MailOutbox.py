@@ -0,0 +1,172 @@
+import os
+import random
+import logging
+import threading
+import pymongo
+from datetime import datetime, timedelta
+from DataManagers.Database import get_database
+from DataManagers.MailSender import MailSender
+
+# Correos que se envían juntos en cada vuelta del enviador
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", 20))
+
+# Reintentos: la espera empieza en MAIL_RETRY_BASE_SECONDS y se duplica en cada fallo, hasta MAIL_RETRY_MAX_SECONDS
+MAIL_MAX_INTENTOS = int(os.getenv("MAIL_MAX_INTENTOS", 6))
+MAIL_RETRY_BASE_SECONDS = int(os.getenv("MAIL_RETRY_BASE_SECONDS", 30))
+MAIL_RETRY_MAX_SECONDS = int(os.getenv("MAIL_RETRY_MAX_SECONDS", 3600))
+
+# Un correo "enviando" durante más de estos segundos se considera abandonado (el enviador murió) y se reintenta
+MAIL_LEASE_SECONDS = int(os.getenv("MAIL_LEASE_SECONDS", 120))
+
+# Segundos que se conservan los correos enviados o fallidos (contienen códigos de verificación)
+MAIL_RETENTION_SECONDS = int(os.getenv("MAIL_RETENTION_SECONDS", 24 * 3600))
+
+# Segundos que espera el enviador cuando no hay correos pendientes (si no lo despierta un correo nuevo)
+MAIL_POLL_SECONDS = float(os.getenv("MAIL_POLL_SECONDS", 5))
+
+# Si es verdadero, cada worker web envía sus correos en un hilo; si no, lo hace "flask mail-sender"
+MAIL_SENDER_THREAD = os.getenv("MAIL_SENDER_THREAD", "true").lower() in ("1", "true", "yes")
+
+logger = logging.getLogger(__name__)
+
+
+class MailOutbox:
+    def __init__(self, database=None, mail_sender=None, sender_thread=MAIL_SENDER_THREAD):
+        """
+        Bandeja de salida de correos en la colección 'email_outbox'. Las rutas solo encolan el correo y responden;
+        un enviador en segundo plano los envía por lotes y reintenta los fallidos con espera exponencial.
+        Estados: pendiente → enviando → enviado | fallido.
+        """
+        self.database = database or get_database()
+        self.mail_sender = mail_sender or MailSender()
+        self.sender_thread = sender_thread
+
+        self._wake = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def db(self):
+        """Base de datos del proceso actual (ver DataManagers.Database)."""
+        return self.database.db
+
+    @property
+    def outbox_col(self):
+        return self.db["email_outbox"]
+
+    def enqueue(self, message):
+        """Guarda un mensaje {"from", "to", "subject", "html"} para enviarlo en segundo plano."""
+        ahora = datetime.now()
+        result = self.outbox_col.insert_one({
+            **message,
+            "estado": "pendiente",
+            "intentos": 0,
+            "created_at": ahora,
+            "next_attempt_at": ahora,
+        })
+
+        if self.sender_thread:
+            self.start_thread()
+            self._wake.set()
+        return str(result.inserted_id)
+
+    def send_verification_code(self, to_email, code):
+        """Encola el correo con el código de verificación."""
+        return self.enqueue(self.mail_sender.verification_email(to_email, code))
+
+    def claim_batch(self, batch_size=MAIL_BATCH_SIZE):
+        """
+        Marca como "enviando" hasta 'batch_size' correos listos para enviarse (o abandonados por un enviador
+        que murió) y los devuelve. Cada correo se toma de forma atómica, así que puede haber varios enviadores.
+        """
+        batch = []
+        while len(batch) < batch_size:
+            ahora = datetime.now()
+            message = self.outbox_col.find_one_and_update(
+                {"$or": [
+                    {"estado": "pendiente", "next_attempt_at": {"$lte": ahora}},
+                    {"estado": "enviando", "lease_until": {"$lt": ahora}},
+                ]},
+                {"$set": {"estado": "enviando", "lease_until": ahora + timedelta(seconds=MAIL_LEASE_SECONDS)}},
+                sort=[("next_attempt_at", pymongo.ASCENDING)],
+                return_document=pymongo.ReturnDocument.AFTER
+            )
+            if message is None:
+                break
+            batch.append(message)
+        return batch
+
+    def send_pending(self, batch_size=MAIL_BATCH_SIZE):
+        """Envía un lote de correos pendientes. Devuelve cuántos se enviaron y cuántos fallaron."""
+        batch = self.claim_batch(batch_size)
+        if not batch:
+            return {"enviados": 0, "fallidos": 0}
+
+        try:
+            errores = self.mail_sender.transport.send_batch(batch)
+        except Exception as e:
+            # Falló el lote completo (por ejemplo, no se pudo conectar al servidor SMTP)
+            errores = [str(e)] * len(batch)
+
+        ahora = datetime.now()
+        operaciones = []
+        for message, error in zip(batch, errores):
+            if error is None:
+                update = {"$set": {"estado": "enviado", "sent_at": ahora,
+                                   "expires_at": ahora + timedelta(seconds=MAIL_RETENTION_SECONDS)},
+                          "$unset": {"lease_until": ""}}
+            else:
+                intentos = message.get("intentos", 0) + 1
+                if intentos >= MAIL_MAX_INTENTOS:
+                    update = {"$set": {"estado": "fallido", "intentos": intentos, "error": error,
+                                       "expires_at": ahora + timedelta(seconds=MAIL_RETENTION_SECONDS)},
+                              "$unset": {"lease_until": ""}}
+                else:
+                    update = {"$set": {"estado": "pendiente", "intentos": intentos, "error": error,
+                                       "next_attempt_at": ahora + timedelta(seconds=self.backoff(intentos))},
+                              "$unset": {"lease_until": ""}}
+                logger.warning("Error enviando el correo a %s (intento %s): %s", message["to"], intentos, error)
+            operaciones.append(pymongo.UpdateOne({"_id": message["_id"]}, update))
+
+        self.outbox_col.bulk_write(operaciones, ordered=False)
+        fallidos = sum(1 for error in errores if error is not None)
+        return {"enviados": len(batch) - fallidos, "fallidos": fallidos}
+
+    def backoff(self, intentos):
+        """Segundos de espera antes del siguiente intento (exponencial, con algo de azar para no reintentar todos a la vez)."""
+        espera = MAIL_RETRY_BASE_SECONDS * 2 ** (intentos - 1) * random.uniform(0.8, 1.2)
+        return min(espera, MAIL_RETRY_MAX_SECONDS)
+
+    def run_sender(self, once=False):
+        """
+        Envía correos hasta que se interrumpa el proceso; entre lotes vacíos espera MAIL_POLL_SECONDS o hasta
+        que se encole un correo nuevo. Con once=True envía los pendientes y termina.
+        """
+        totales = {"enviados": 0, "fallidos": 0}
+        while True:
+            try:
+                resultado = self.send_pending()
+            except Exception:
+                logger.exception("Error en el enviador de correos")
+                resultado = {"enviados": 0, "fallidos": 0}
+
+            totales["enviados"] += resultado["enviados"]
+            totales["fallidos"] += resultado["fallidos"]
+            if resultado["enviados"] or resultado["fallidos"]:
+                continue
+
+            if once:
+                return totales
+            self._wake.wait(MAIL_POLL_SECONDS)
+            self._wake.clear()
+
+    def start_thread(self):
+        """Arranca (una vez por proceso) el hilo que envía los correos de este worker."""
+        if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._thread_pid != os.getpid() or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.run_sender, name="mail-outbox", daemon=True)
+                self._thread_pid = os.getpid()
+                self._thread.start()
@@ -1,18 +1,130 @@
 import os
-import random
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
+import uuid
+import smtplib
+from email.message import EmailMessage
 from dotenv import load_dotenv
 
+# Cómo se envían los correos: "sendgrid" (producción), "smtp" (cualquier servidor SMTP, también uno local de pruebas)
+# o "file" (se escriben como .eml en MAIL_FILE_DIR, para probar sin conexión)
+MAIL_TRANSPORT = os.getenv("MAIL_TRANSPORT", "sendgrid")
+
+
+class MailTransport:
+    """Forma de entregar correos. Cada mensaje es {"from", "to", "subject", "html"}."""
+
+    def send(self, message):
+        """Envía un mensaje; lanza una excepción si no se pudo."""
+        raise NotImplementedError
+
+    def send_batch(self, messages):
+        """Envía varios mensajes y devuelve, para cada uno, None si se envió o el texto del error."""
+        errores = []
+        for message in messages:
+            try:
+                self.send(message)
+                errores.append(None)
+            except Exception as e:
+                errores.append(str(e))
+        return errores
+
+
+class SendGridTransport(MailTransport):
+    def __init__(self, api_key=None):
+        """Envía por la API de SendGrid con un único cliente reutilizado para todos los correos."""
+        self.api_key = api_key or os.getenv("SENDGRID_API_KEY")
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            # sendgrid se importa al enviar el primer correo, no al arrancar la aplicación
+            from sendgrid import SendGridAPIClient
+            self._client = SendGridAPIClient(self.api_key)
+        return self._client
+
+    def send(self, message):
+        from sendgrid.helpers.mail import Mail
+
+        response = self.client.send(Mail(
+            from_email=message["from"],
+            to_emails=message["to"],
+            subject=message["subject"],
+            html_content=message["html"]
+        ))
+        if response.status_code >= 300:
+            raise RuntimeError(f"SendGrid respondió {response.status_code}")
+
+
+class SMTPTransport(MailTransport):
+    def __init__(self, host=None, port=None, username=None, password=None, use_tls=None):
+        """Envía por SMTP, con una sola conexión por lote. Con MAIL_SMTP_HOST=localhost sirve un servidor local de pruebas."""
+        self.host = host or os.getenv("MAIL_SMTP_HOST", "localhost")
+        self.port = int(port or os.getenv("MAIL_SMTP_PORT", 25))
+        self.username = username or os.getenv("MAIL_SMTP_USER")
+        self.password = password or os.getenv("MAIL_SMTP_PASSWORD")
+        self.use_tls = use_tls if use_tls is not None else os.getenv("MAIL_SMTP_TLS", "").lower() in ("1", "true", "yes")
+
+    def send(self, message):
+        error = self.send_batch([message])[0]
+        if error is not None:
+            raise smtplib.SMTPException(error)
+
+    def send_batch(self, messages):
+        errores = []
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            for message in messages:
+                try:
+                    smtp.send_message(email_message(message))
+                    errores.append(None)
+                except smtplib.SMTPException as e:
+                    errores.append(str(e))
+        return errores
+
+
+class FileTransport(MailTransport):
+    def __init__(self, directory=None):
+        """Escribe cada correo como un archivo .eml en 'directory', para probar el envío sin conexión."""
+        self.directory = directory or os.getenv("MAIL_FILE_DIR", "outbox_mails")
+
+    def send(self, message):
+        os.makedirs(self.directory, exist_ok=True)
+        # El nombre no usa el destinatario: 'To' puede traer "/" u otros caracteres que no valen en una ruta
+        path = os.path.join(self.directory, f"{uuid.uuid4().hex}.eml")
+        with open(path, "wb") as archivo:
+            archivo.write(email_message(message).as_bytes())
+
+
+def email_message(message):
+    """Convierte un mensaje {"from", "to", "subject", "html"} en un EmailMessage."""
+    email = EmailMessage()
+    email["From"] = message["from"]
+    email["To"] = message["to"]
+    email["Subject"] = message["subject"]
+    email.set_content(message["html"], subtype="html")
+    return email
+
+
+def get_transport(name=MAIL_TRANSPORT):
+    """Crea el transporte configurado en MAIL_TRANSPORT."""
+    transports = {"sendgrid": SendGridTransport, "smtp": SMTPTransport, "file": FileTransport}
+    if name not in transports:
+        raise ValueError(f"MAIL_TRANSPORT desconocido: {name}")
+    return transports[name]()
+
+
 class MailSender:
-    def __init__(self):
-        """Inicializa la clase con el correo de origen y carga la API key."""
+    def __init__(self, transport=None):
+        """Inicializa la clase con el correo de origen y el transporte con el que se envían los correos."""
         load_dotenv()
         self.FROM_EMAIL = os.getenv("SENDER_EMAIL")
-        self.SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY")
-    
-    def send_email(self, to_email, code):
-        """Envía un correo con un código de verificación y una breve introducción sobre LeppupyUrns."""
+        self.transport = transport or get_transport()
+
+    def verification_email(self, to_email, code):
+        """Construye el correo con un código de verificación y una breve introducción sobre LeppupyUrns."""
         subject = "Tu Código de Verificación"
         content = (
             f"""
@@ -25,19 +137,4 @@ class MailSender:
             <p><strong>Equipo de LeppupyUrns</strong></p>
             """
         )
-        try:
-            message = Mail(
-                from_email=self.FROM_EMAIL,
-                to_emails=to_email,
-                subject=subject,
-                html_content=content
-            )
-            sg = SendGridAPIClient(self.SENDGRID_API_KEY)
-            response = sg.send(message)
-            
-            print("Correo enviado exitosamente!")
-            print("Código de verificación:", code)
-            print("Status Code:", response.status_code)
-        except Exception as e:
-            print("Error enviando el correo:", str(e))
-
+        return {"from": self.FROM_EMAIL, "to": to_email, "subject": subject, "html": content}
@@ -0,0 +1,113 @@
+import os
+import glob
+import time
+import threading
+from contextlib import contextmanager
+
+# Con PROMETHEUS_MULTIPROC_DIR definido (gunicorn.conf.py y el Procfile lo definen para los workers de gunicorn y
+# "flask jobs-worker"), cada proceso escribe sus métricas en archivos de ese directorio, que ya debe existir, y /metrics
+# devuelve la suma de todos los procesos de la misma máquina. Sin él (pruebas, comandos sueltos) las métricas quedan
+# en la memoria del proceso. prometheus_client lee la variable al importarse.
+METRICS_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR") or None
+
+from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+from pymongo import monitoring
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Duración de las peticiones HTTP por endpoint.",
+    ["endpoint", "method", "status"]
+)
+MONGO_COMMAND_DURATION = Histogram(
+    "mongo_command_duration_seconds", "Duración de los comandos de MongoDB por colección.",
+    ["command", "collection"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+MONGO_COMMANDS = Counter(
+    "mongo_commands_total", "Comandos de MongoDB ejecutados por colección y resultado.",
+    ["command", "collection", "result"]
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Consultas a las cachés en memoria (aciertos y fallos).",
+    ["cache", "result"]
+)
+REPORT_DURATION = Histogram(
+    "report_generation_seconds", "Tiempo de generación de Excel, exportaciones y dashboard.",
+    ["report"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+)
+
+
+def observe_request(endpoint, method, status, seconds):
+    """Registra la duración de una petición HTTP."""
+    REQUEST_DURATION.labels(endpoint or "sin_endpoint", method, str(status)).observe(seconds)
+
+
+def cache_result(cache, hit):
+    """Cuenta un acierto o un fallo de una caché."""
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+@contextmanager
+def timed_report(report):
+    """Mide lo que tarda en generarse un informe (Excel, exportación, dashboard)."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        REPORT_DURATION.labels(report).observe(time.perf_counter() - inicio)
+
+
+class MongoMetricsListener(monitoring.CommandListener):
+    """Mide los comandos que envía el MongoClient (se pasa en 'event_listeners' al crearlo)."""
+
+    def __init__(self):
+        self._colecciones = {}  # request_id -> colección del comando en curso
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        # El nombre de la colección es el valor del propio comando ({"find": "orders", ...}); getMore lo trae aparte
+        coleccion = event.command.get("collection") if event.command_name == "getMore" else event.command.get(event.command_name)
+        with self._lock:
+            self._colecciones[event.request_id] = coleccion if isinstance(coleccion, str) else "-"
+
+    def succeeded(self, event):
+        self._observe(event, "ok")
+
+    def failed(self, event):
+        self._observe(event, "error")
+
+    def _observe(self, event, result):
+        with self._lock:
+            coleccion = self._colecciones.pop(event.request_id, "-")
+        MONGO_COMMAND_DURATION.labels(event.command_name, coleccion).observe(event.duration_micros / 1_000_000)
+        MONGO_COMMANDS.labels(event.command_name, coleccion, result).inc()
+
+
+def limpiar_procesos_terminados():
+    """Borra los archivos de métricas de procesos que ya no existen (de un arranque anterior)."""
+    if not METRICS_DIR:
+        return
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.db")):
+        pid = os.path.basename(path)[:-len(".db")].rsplit("_", 1)[-1]
+        if pid.isdigit() and not proceso_vivo(int(pid)):
+            os.remove(path)
+
+
+def proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Existe, aunque sea de otro usuario
+    return True
+
+
+def export():
+    """Devuelve (contenido, content type) con todas las métricas en el formato de texto de Prometheus."""
+    if METRICS_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,84 +1,267 @@
 import os
-import io
 import re
+import csv
+import io
 import pymongo
-import plotly.express as px
 from datetime import datetime, timedelta
 from bson.objectid import ObjectId
-import pandas as pd
-from collections import defaultdict
-import xlsxwriter
-from dotenv import load_dotenv
-import numpy as np
+from bson import Binary
+from pymongo.errors import DuplicateKeyError
+from DataManagers.ContentCache import content_cache
+from DataManagers.ExcelExporter import ExcelExporter
+from DataManagers.StatsRollup import StatsRollup, PROYECCION_PEDIDO
+from DataManagers.LRUCache import LRUCache
+from DataManagers.Database import get_database
+from DataManagers.Metrics import cache_result, timed_report
+
+# Segundos que los datos del dashboard siguen siendo válidos aunque nadie los invalide
+DASHBOARD_CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", 300))
+
+# Memoria máxima (en bytes) que ocupan en la colección 'excel_cache' los Excel ya generados de los pedidos
+EXCEL_CACHE_MAX_BYTES = int(os.getenv("EXCEL_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# Los Excel más grandes que esto no se guardan (un documento de MongoDB no puede superar los 16 MB)
+EXCEL_CACHE_MAX_FILE_BYTES = 15 * 1024 * 1024
+
+# La fecha de uso de un Excel de la caché solo se actualiza si es más antigua que esto (no en cada descarga)
+EXCEL_CACHE_TOUCH_INTERVAL = timedelta(hours=1)
+
+# Columnas de la tabla con la información general de un pedido
+COLUMNAS_PEDIDO = ["Orden ID", "Cliente", "Fecha", "Estado", "Total Pedidos", "Total Urnas"]
+
+# Nombres con los que se muestran en los Excel algunas claves de 'forms_lleno'
+COLUMNAS_RENOMBRADAS = {
+    "¿quieres_el_logo_de_tu_empresa?": "logo_grabado",
+    "tipo-urna": "tipo-madera"
+}
+
+# Claves de los cortes láser que no se incluyen en la tabla "Cortes Láser"
+COLUMNAS_EXCLUIDAS_CORTES = re.compile(r"(color|colores|base|bases)", re.IGNORECASE)
+
+# Formato con el que se muestran las fechas de los pedidos (y en el que se guardaban antes de usar fechas BSON)
+FORMATO_FECHA = "%Y-%m-%d %H:%M:%S"
 
 class PedidosManager:
-    def __init__(self):
-        """Inicializa la conexión con la base de datos y la colección 'orders'."""
-        load_dotenv()
-        MONGO_URI = os.getenv("MONGO_URI")
-        DATABASE_NAME = os.getenv("DATABASE_NAME")
-        
-        self.client = pymongo.MongoClient(MONGO_URI)
-        self.db = self.client[DATABASE_NAME]
-        
-        if "orders" not in self.db.list_collection_names():
-            self.db.create_collection("orders")
+    def __init__(self, database=None):
+        """Usa la conexión compartida con la base de datos. Las colecciones e índices los crea SchemaManager."""
+        self.database = database or get_database()
+
+        # Estadísticas precalculadas para el dashboard y la página de pedidos del cliente
+        self.stats = StatsRollup(self.database)
+        self.dashboard_cache = LRUCache(max_size=1, ttl=DASHBOARD_CACHE_TTL, name="dashboard")
+
+    @property
+    def db(self):
+        """Base de datos del proceso actual (ver DataManagers.Database)."""
+        return self.database.db
+
+    @property
+    def excel_cache_col(self):
+        return self.db["excel_cache"]
 
     def get_pedidos_for_client(self, client_id):
         """
         Obtiene todos los pedidos de un cliente específico, ordenados por timestamp del más reciente al más antiguo.
-        Reemplaza los IDs de los productos por sus nombres reales.
+        Reemplaza los IDs de los productos por el nombre guardado en el pedido al momento de la compra.
         """
-        pedidos = list(self.db.orders.find({"client_id": client_id}).sort("timestamp", pymongo.DESCENDING))
-
-        # Obtener un diccionario con los nombres reales de los productos usando el _id como clave
-        productos_dict = {str(prod["_id"]): prod["modelo"] for prod in self.db.prods.find({}, {"_id": 1, "modelo": 1})}
+        pedidos = list(self.db.orders.find({"client_id": client_id}).sort([("timestamp", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)]))
 
         for pedido in pedidos:
             pedido["_id"] = str(pedido["_id"])
             pedido["orden_id"] = str(pedido.get("orden_id", "Desconocido"))
-            pedido["timestamp"] = pedido.get("timestamp", "Fecha no disponible")
+            pedido["timestamp"] = self.formatear_fecha(pedido.get("timestamp"))
             pedido["estado"] = pedido.get("estado", "Estado no disponible")
             pedido["total_pedidos"] = pedido.get("total_pedidos", 0)
             pedido["total_urnas"] = pedido.get("total_urnas", 0)
 
             for producto in pedido.get("productos", []):
-                producto["model"] = productos_dict[producto['forms_lleno']["product_id"]]# Asegurar que se usa el ID correcto
+                producto["model"] = producto.get("modelo", "Modelo Desconocido")  # Nombre guardado al finalizar la compra
 
         return pedidos
 
-    def get_pedidos(self):
+    def get_pedidos(self, estado=None, client_id=None, fecha_desde=None, fecha_hasta=None, cursor=None, limit=50):
         """
-        Obtiene todos los pedidos en la base de datos, ordenados del más reciente al más antiguo.
-        Reemplaza los client_id por los nombres reales de los clientes.
+        Obtiene una página de pedidos, ordenados del más reciente al más antiguo.
+        Filtra opcionalmente por estado, cliente y rango de fechas ("%Y-%m-%d", ambos inclusive).
+        La paginación es por cursor sobre (timestamp, _id): 'cursor' es el 'next_cursor' de la página anterior.
+        No incluye los productos de cada pedido. Reemplaza los client_id por los nombres reales de los clientes.
         """
-        pedidos = list(self.db.orders.find().sort("timestamp", pymongo.DESCENDING))
-
-        # Obtener un diccionario con los nombres de los clientes usando el _id como clave
-        usuarios_dict = {str(user["_id"]): user["client_name"] for user in self.db.usuarios.find({}, {"_id": 1, "client_name": 1})}
+        condiciones = self.condiciones_pedidos(estado, client_id, fecha_desde, fecha_hasta)
+
+        # Continuar después del último pedido de la página anterior
+        posicion = self.decode_cursor(cursor)
+        if posicion:
+            timestamp, oid = posicion
+            condiciones.append({"$or": [
+                {"timestamp": {"$lt": timestamp}},
+                {"timestamp": timestamp, "_id": {"$lt": oid}}
+            ]})
+
+        filtro = {"$and": condiciones} if condiciones else {}
+        pedidos = list(
+            self.db.orders.find(filtro, {"productos": 0})
+            .sort([("timestamp", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+            .limit(limit + 1)
+        )
+
+        # Se pide un pedido de más para saber si hay otra página
+        next_cursor = None
+        if len(pedidos) > limit:
+            pedidos = pedidos[:limit]
+            next_cursor = self.encode_cursor(pedidos[-1])
+
+        # Obtener solo los nombres de los clientes de esta página
+        client_ids = [ObjectId(cid) for cid in {pedido.get("client_id") for pedido in pedidos} if cid and ObjectId.is_valid(cid)]
+        usuarios_dict = {
+            str(user["_id"]): user["client_name"]
+            for user in self.db.usuarios.find({"_id": {"$in": client_ids}}, {"_id": 1, "client_name": 1})
+        }
 
         for pedido in pedidos:
             pedido["_id"] = str(pedido["_id"])
             pedido["orden_id"] = str(pedido.get("orden_id", "Desconocido"))
-            pedido["timestamp"] = pedido.get("timestamp", "Fecha no disponible")
+            pedido["timestamp"] = self.formatear_fecha(pedido.get("timestamp"))
             pedido["estado"] = pedido.get("estado", "Estado no disponible")
             pedido["total_pedidos"] = pedido.get("total_pedidos", 0)
             pedido["total_urnas"] = pedido.get("total_urnas", 0)
             
             # Reemplazar el client_id con el nombre real del cliente
-            pedido["client_name"] = usuarios_dict[pedido["client_id"]]
+            pedido["client_name"] = usuarios_dict.get(pedido.get("client_id"), "Cliente Desconocido")
+
+        return {"pedidos": pedidos, "next_cursor": next_cursor}
+
+    def condiciones_pedidos(self, estado=None, client_id=None, fecha_desde=None, fecha_hasta=None):
+        """Condiciones de búsqueda de pedidos por estado, cliente y rango de fechas (las vacías se ignoran)."""
+        condiciones = []
+        if estado:
+            condiciones.append({"estado": estado})
+        if client_id:
+            condiciones.append({"client_id": client_id})
+
+        rango = self.rango_fechas(fecha_desde, fecha_hasta)
+        if rango:
+            condiciones.append({"timestamp": rango})
+        return condiciones
+
+    def formatear_fecha(self, timestamp):
+        """Convierte la fecha de un pedido en texto para mostrarla."""
+        if isinstance(timestamp, datetime):
+            return timestamp.strftime(FORMATO_FECHA)
+        return timestamp or "Fecha no disponible"
+
+    def rango_fechas(self, fecha_desde=None, fecha_hasta=None):
+        """Construye el filtro de 'timestamp' para un rango de fechas "%Y-%m-%d" (inclusive). Ignora fechas inválidas."""
+        rango = {}
+        try:
+            if fecha_desde:
+                rango["$gte"] = datetime.strptime(fecha_desde, "%Y-%m-%d")
+        except ValueError:
+            pass
+        try:
+            if fecha_hasta:
+                rango["$lt"] = datetime.strptime(fecha_hasta, "%Y-%m-%d") + timedelta(days=1)
+        except ValueError:
+            pass
+        return rango
+
+    def nombre_exportacion(self, fecha_desde=None, fecha_hasta=None):
+        """
+        Nombre (sin extensión) del archivo de una exportación de pedidos: "pedidos" y las fechas válidas del rango.
+        Se construye con las fechas ya interpretadas por rango_fechas, así que solo tiene dígitos y guiones.
+        """
+        rango = self.rango_fechas(fecha_desde, fecha_hasta)
+        fechas = [rango["$gte"]] if "$gte" in rango else []
+        if "$lt" in rango:
+            fechas.append(rango["$lt"] - timedelta(days=1))
+        return "_".join(["pedidos"] + [fecha.strftime("%Y-%m-%d") for fecha in fechas])
+
+    def encode_cursor(self, pedido):
+        """Codifica la posición de un pedido (timestamp y _id) como cursor de paginación."""
+        timestamp = pedido.get("timestamp")
+        timestamp = timestamp.isoformat() if isinstance(timestamp, datetime) else str(timestamp)
+        return f"{timestamp}|{pedido['_id']}"
+
+    def decode_cursor(self, cursor):
+        """Decodifica un cursor de paginación. Devuelve None si no es válido."""
+        if not cursor or "|" not in cursor:
+            return None
+        timestamp, oid = cursor.rsplit("|", 1)
+        if not ObjectId.is_valid(oid):
+            return None
+        try:
+            return datetime.fromisoformat(timestamp), ObjectId(oid)
+        except ValueError:
+            return None
+
+    def migrate_timestamps_to_dates(self, batch_size=500):
+        """
+        Convierte los 'timestamp' guardados como texto ("%Y-%m-%d %H:%M:%S") en fechas BSON.
+        Recorre los pedidos con un cursor por lotes y actualiza cada lote con un solo bulk_write.
+        """
+        migrated = 0
+        operations = []
 
-        return pedidos
+        for pedido in self.db.orders.find({"timestamp": {"$type": "string"}}, {"timestamp": 1}).batch_size(batch_size):
+            try:
+                fecha = datetime.strptime(pedido["timestamp"], FORMATO_FECHA)
+            except (TypeError, ValueError):
+                print(f"DEBUG: timestamp inválido en el pedido {pedido['_id']}: {pedido.get('timestamp')}")
+                continue
 
+            operations.append(pymongo.UpdateOne({"_id": pedido["_id"]}, {"$set": {"timestamp": fecha}}))
+            if len(operations) >= batch_size:
+                migrated += self.db.orders.bulk_write(operations, ordered=False).modified_count
+                operations = []
+
+        if operations:
+            migrated += self.db.orders.bulk_write(operations, ordered=False).modified_count
+
+        return {"success": True, "migrated": migrated}
+
+
+    def migrate_snapshot_productos(self, batch_size=200):
+        """
+        Guarda en cada producto de los pedidos antiguos el 'modelo' y el 'corte_lazer_hash' actuales del producto,
+        igual que se hace al finalizar la compra. Los productos eliminados quedan como "Modelo Desconocido".
+        """
+        productos_dict = {
+            prod["_id"]: prod for prod in self.db.prods.find({}, {"_id": 1, "modelo": 1, "corte_lazer_hash": 1})
+        }
+
+        migrated = 0
+        operations = []
+
+        filtro = {"productos": {"$elemMatch": {"modelo": {"$exists": False}}}}
+        for pedido in self.db.orders.find(filtro, {"productos": 1}).batch_size(batch_size):
+            productos = pedido.get("productos", [])
+            for producto in productos:
+                if "modelo" in producto:
+                    continue
+                prod = productos_dict.get(producto.get("model"), {})
+                producto["modelo"] = prod.get("modelo", "Modelo Desconocido")
+                producto["corte_lazer_hash"] = prod.get("corte_lazer_hash")
+
+            operations.append(pymongo.UpdateOne({"_id": pedido["_id"]}, {"$set": {"productos": productos}}))
+            if len(operations) >= batch_size:
+                migrated += self.db.orders.bulk_write(operations, ordered=False).modified_count
+                operations = []
+
+        if operations:
+            migrated += self.db.orders.bulk_write(operations, ordered=False).modified_count
+
+        return {"success": True, "migrated": migrated}
 
     def delete_pedido(self, pedido_id):
         """Elimina un pedido basado en su ID."""
-        result = self.db.orders.delete_one({"_id": ObjectId(pedido_id)})
-        return {"success": result.deleted_count > 0}
+        pedido = self.db.orders.find_one_and_delete({"_id": ObjectId(pedido_id)}, PROYECCION_PEDIDO)
+        if pedido:
+            self.stats.eliminar_pedido(pedido)
+            self.borrar_excel_cache({"pedido_id": pedido_id})
+        return {"success": pedido is not None}
 
     def toggle_estado_pedido(self, pedido_id):
         """Alterna el estado del pedido de forma cíclica: Enviado → En Proceso → Terminado → Enviado."""
-        pedido = self.db.orders.find_one({"_id": ObjectId(pedido_id)})
+        pedido = self.db.orders.find_one({"_id": ObjectId(pedido_id)}, {"estado": 1, "stats_aplicadas": 1})
         if not pedido:
             return {"error": "Pedido no encontrado"}
 
@@ -89,51 +272,105 @@ class PedidosManager:
             "Terminado": "Enviado"
         }.get(estado_actual, "Enviado")
 
-        self.db.orders.update_one({"_id": ObjectId(pedido_id)}, {"$set": {"estado": nuevo_estado}})
+        # Solo cambia si nadie lo cambió (ni lo sumó a las estadísticas) mientras tanto, para no contar dos veces
+        # el cambio en las estadísticas. La nueva versión del pedido invalida los Excel generados con el estado anterior
+        result = self.db.orders.update_one(
+            {"_id": ObjectId(pedido_id), "estado": estado_actual, "stats_aplicadas": pedido.get("stats_aplicadas")},
+            {"$set": {"estado": nuevo_estado}, "$inc": {"version": 1}}
+        )
+        if result.modified_count == 0:
+            return {"error": "El pedido cambió de estado mientras tanto, inténtalo de nuevo"}
+
+        self.stats.cambiar_estado(pedido, nuevo_estado)
+        self.borrar_excel_cache({"pedido_id": pedido_id})
         return {"success": True, "nuevo_estado": nuevo_estado}
 
+    def estadisticas_pedidos(self):
+        """
+        Devuelve las estadísticas del dashboard leyendo la colección 'stats' (precalculada):
+        pedidos por cliente, pedidos por día en los últimos 30 días y urnas vendidas por producto.
+        """
+        pedidos_por_cliente = self.stats.get_clientes()
+
+        # Nombres solo de los clientes que aparecen en las estadísticas
+        client_ids = [ObjectId(row["client_id"]) for row in pedidos_por_cliente if row.get("client_id") and ObjectId.is_valid(row["client_id"])]
+        usuarios = {
+            str(user["_id"]): user["client_name"]
+            for user in self.db.usuarios.find({"_id": {"$in": client_ids}}, {"_id": 1, "client_name": 1})
+        }
+        clientes = [
+            {"cliente": usuarios.get(row.get("client_id"), "Cliente Desconocido"), "total": row["pedidos"]}
+            for row in pedidos_por_cliente
+        ]
+
+        # Pedidos del último mes
+        fecha_limite = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
+        pedidos_por_dia = [{"fecha": row["fecha"], "cantidad": row["pedidos"]} for row in self.stats.get_dias(fecha_limite)]
+
+        # Urnas vendidas por producto
+        productos = [{"producto": row["producto"], "cantidad": row["urnas"]} for row in self.stats.get_productos()]
+
+        return {"clientes": clientes, "pedidos_por_dia": pedidos_por_dia, "productos": productos}
+
+    def get_resumen_cliente(self, client_id):
+        """Devuelve el total de pedidos y de urnas de un cliente (de la colección 'stats')."""
+        return self.stats.get_cliente(client_id)
+
+    def rebuild_estadisticas(self, batch_size=500):
+        """Recalcula la colección 'stats' desde cero a partir de 'orders'."""
+        return self.stats.rebuild(batch_size=batch_size)
+
     def generar_graficos_pedidos(self):
         """
-        Genera gráficos con estadísticas de los pedidos y devuelve los datos procesados
+        Genera las especificaciones JSON (data + layout de Plotly) de los gráficos del dashboard.
+        Se dibujan en el navegador con plotly.js, así que aquí no se importa plotly.
         """
-        pedidos = list(self.db.orders.find())
-        usuarios = {str(user["_id"]): user["client_name"] for user in self.db.usuarios.find({}, {"_id": 1, "client_name": 1})}
-        productos = {str(prod["_id"]): prod["modelo"] for prod in self.db.prods.find({}, {"_id": 1, "modelo": 1})}
-        
-        # Convertir datos de pedidos a DataFrame
-        df_pedidos = pd.DataFrame(pedidos)
-        
-        if df_pedidos.empty:
+        estadisticas = self.estadisticas_pedidos()
+
+        if not estadisticas["clientes"]:
             return None, None, None
-        
-        # Reemplazar IDs con nombres en DataFrame
-        df_pedidos["client_id"] = df_pedidos["client_id"].map(usuarios)
-        
+
+        def figura(tipo, x, y, titulo, titulo_x, titulo_y, **trace):
+            return {
+                "data": [{"type": tipo, "x": x, "y": y, **trace}],
+                "layout": {"title": {"text": titulo}, "xaxis": {"title": {"text": titulo_x}}, "yaxis": {"title": {"text": titulo_y}}}
+            }
+
         # Clientes con más pedidos
-        clientes_contados = df_pedidos["client_id"].value_counts().reset_index()
-        clientes_contados.columns = ["Cliente", "Total Pedidos"]
-        fig1 = px.bar(clientes_contados, x="Cliente", y="Total Pedidos", title="Clientes con Más Pedidos", color="Cliente")
-        
+        clientes = estadisticas["clientes"]
+        fig1 = figura("bar", [row["cliente"] for row in clientes], [row["total"] for row in clientes],
+                      "Clientes con Más Pedidos", "Cliente", "Total Pedidos")
+
         # Pedidos del último mes
-        fecha_limite = datetime.now() - timedelta(days=30)
-        df_pedidos["timestamp"] = pd.to_datetime(df_pedidos["timestamp"], errors='coerce')
-        df_ultimo_mes = df_pedidos[df_pedidos["timestamp"] >= fecha_limite]
-        pedidos_por_fecha = df_ultimo_mes.groupby(df_ultimo_mes["timestamp"].dt.date).size().reset_index(name="Cantidad")
-        fig2 = px.line(pedidos_por_fecha, x="timestamp", y="Cantidad", title="Pedidos en el Último Mes", markers=True)
-        
+        pedidos_por_dia = estadisticas["pedidos_por_dia"]
+        fig2 = figura("scatter", [row["fecha"] for row in pedidos_por_dia], [row["cantidad"] for row in pedidos_por_dia],
+                      "Pedidos en el Último Mes", "Fecha", "Cantidad", mode="lines+markers")
+
         # Producto más vendido
-        productos_vendidos = []
-        for pedido in pedidos:
-            for producto in pedido.get("productos", []):
-                productos_vendidos.append(str(producto.get("model")))
-        
-        df_productos = pd.DataFrame(productos_vendidos, columns=["Producto"])
-        df_productos["Producto"] = df_productos["Producto"].map(productos)
-        productos_contados = df_productos["Producto"].value_counts().reset_index()
-        productos_contados.columns = ["Producto", "Cantidad Vendida"]
-        fig3 = px.bar(productos_contados, x="Producto", y="Cantidad Vendida", title="Productos Más Vendidos", color="Producto")
-        
-        return fig1.to_html(full_html=False), fig2.to_html(full_html=False), fig3.to_html(full_html=False)
+        productos = estadisticas["productos"]
+        fig3 = figura("bar", [row["producto"] for row in productos], [row["cantidad"] for row in productos],
+                      "Productos Más Vendidos", "Producto", "Cantidad Vendida")
+
+        return fig1, fig2, fig3
+
+    def get_dashboard(self):
+        """
+        Devuelve los gráficos y los conteos por estado del dashboard. Se cachean bajo la versión de los pedidos,
+        que cambia con cada pedido creado, eliminado o cambiado de estado (y expiran tras DASHBOARD_CACHE_TTL).
+        """
+        version = self.stats.version()
+        dashboard = self.dashboard_cache.get(version)
+        if dashboard is None:
+            with timed_report("dashboard"):
+                grafico_clientes, grafico_pedidos_mes, grafico_productos = self.generar_graficos_pedidos()
+                dashboard = {
+                    "grafico_clientes": grafico_clientes,
+                    "grafico_pedidos_mes": grafico_pedidos_mes,
+                    "grafico_productos": grafico_productos,
+                    "estados": self.stats.get_estados(),
+                }
+            self.dashboard_cache.set(version, dashboard)
+        return dashboard
 
     def get_pedidos_por_id(self, pedido_id):
         """
@@ -146,7 +383,7 @@ class PedidosManager:
 
         pedido["_id"] = str(pedido["_id"])
         pedido["orden_id"] = str(pedido.get("orden_id", "Desconocido"))
-        pedido["timestamp"] = pedido.get("timestamp", "Fecha no disponible")
+        pedido["timestamp"] = self.formatear_fecha(pedido.get("timestamp"))
         pedido["estado"] = pedido.get("estado", "Estado no disponible")
         pedido["total_pedidos"] = pedido.get("total_pedidos", 0)
         pedido["total_urnas"] = pedido.get("total_urnas", 0)
@@ -157,86 +394,79 @@ class PedidosManager:
 
         return pedido
 
-    def generate_pedido_dataframes(self, pedido_id):
-        """Genera los DataFrames del pedido, productos y cortes láser."""
+    def generate_pedido_tablas(self, pedido_id, incluir_cortes=True):
+        """
+        Genera las tablas del pedido, productos y (opcionalmente) cortes láser, listas para exportar.
+        Cada tabla es {"title", "columns", "rows"}. Devuelve None si el pedido no existe.
+        """
         pedido = self.get_pedidos_por_id(pedido_id)
 
         if not pedido:
-            return None, None, None  # Si no existe el pedido, devuelve None en todos los DataFrames
-
-        # Crear DataFrame con información general del pedido
-        data_pedido = {
-            "Orden ID": [pedido.get("orden_id", "Desconocido")],
-            "Cliente": [pedido.get("client_name", "Cliente Desconocido")],
-            "Fecha": [pedido.get("timestamp", "Fecha no disponible")],
-            "Estado": [pedido.get("estado", "Estado no disponible")],
-            "Total Pedidos": [pedido.get("total_pedidos", 0)],
-            "Total Urnas": [pedido.get("total_urnas", 0)]
+            return None
+        return self.tablas_pedido(pedido, incluir_cortes)
+
+    def tablas_pedido(self, pedido, incluir_cortes=True):
+        """Tablas de exportación de un pedido ya leído con get_pedidos_por_id."""
+        # Tabla con información general del pedido
+        tabla_pedido = {
+            "title": "Información del Pedido",
+            "columns": COLUMNAS_PEDIDO,
+            "rows": [[
+                pedido.get("orden_id", "Desconocido"),
+                pedido.get("client_name", "Cliente Desconocido"),
+                pedido.get("timestamp", "Fecha no disponible"),
+                pedido.get("estado", "Estado no disponible"),
+                pedido.get("total_pedidos", 0),
+                pedido.get("total_urnas", 0)
+            ]]
         }
-        df_pedido = pd.DataFrame(data_pedido)
 
-        # Obtener diccionario de modelos de la colección 'prods'
-        productos_dict = {
-            str(prod["_id"]): prod for prod in self.db.prods.find({}, {"_id": 1, "modelo": 1, "corte_lazer_hash": 1})
-        }
+        tabla_productos, tabla_cortes = self.tablas_productos(pedido.get("productos", []), incluir_cortes)
 
-        # Obtener todas las claves únicas de "forms_lleno" en los productos
-        all_keys = set()
-        for producto in pedido.get("productos", []):
-            all_keys.update(producto.get("forms_lleno", {}).keys())
+        tablas = [tabla_pedido, tabla_productos]
+        if incluir_cortes:
+            tablas.append(tabla_cortes)
+        return tablas
 
-        # Definir el mapeo de nombres de columnas
-        column_mapping = {
-            "¿quieres_el_logo_de_tu_empresa?": "logo_grabado",
-            "tipo-urna": "tipo-madera"
-        }
+    def tablas_productos(self, productos_pedido, incluir_cortes=True):
+        """Genera las tablas "Lista de Productos" y "Detalles de Corte Láser" a partir de los productos de un pedido."""
+        # Obtener todas las claves únicas de "forms_lleno" en los productos (en el orden en que aparecen)
+        all_keys = {}
+        for producto in productos_pedido:
+            all_keys.update(dict.fromkeys(producto.get("forms_lleno", {}).keys()))
+        all_keys.pop("product_id", None)  # Excluir la columna "product_id"
 
-        # Definir regex para excluir columnas en la tabla "Cortes Láser"
-        excluded_columns_regex = re.compile(r"(color|colores|base|bases)", re.IGNORECASE)
+        # Cortes láser del pedido: un solo $in para todos los hashes distintos, y el filtro de claves
+        # (sin "color" ni "base") se aplica una vez por corte en lugar de una vez por línea del pedido
+        cortes_filtrados = {}
+        if incluir_cortes:
+            cortes_filtrados = self.cortes_filtrados([producto.get("corte_lazer_hash") for producto in productos_pedido])
 
         # Crear lista de productos con información completa del formulario
         productos = []
-        cortes_laser_dict = defaultdict(lambda: defaultdict(int))  # Para mergear filas duplicadas
+        cortes_laser_dict = {}  # Para mergear filas duplicadas
 
-        for producto in pedido.get("productos", []):
-            product_id = producto.get("forms_lleno", {}).get("product_id")
-            producto_info = {
-                "Modelo": productos_dict.get(product_id, {}).get("modelo", "Modelo Desconocido"),
-            }
+        for producto in productos_pedido:
+            forms_lleno = producto.get("forms_lleno", {})
+
+            # Modelo (nombre guardado al finalizar la compra) y todas las claves de forms_lleno
+            productos.append([producto.get("modelo", "Modelo Desconocido")] + [forms_lleno.get(key, '-') for key in all_keys])
 
-            # Agregar todas las claves de forms_lleno con mapeo, excluyendo "product_id"
-            for key in all_keys:
-                if key != "product_id":  # Excluir la columna "product_id"
-                    mapped_key = column_mapping.get(key, key)  # Aplicar mapeo si existe
-                    producto_info[mapped_key] = producto.get("forms_lleno", {}).get(key, '-')
-
-            productos.append(producto_info)
-
-            # Obtener el corte láser correspondiente al producto
-            corte_lazer_hash = productos_dict.get(product_id, {}).get("corte_lazer_hash")
-            corte_entry = {}
-
-            if corte_lazer_hash:
-                corte_info = self.db.corte_lazer.find_one({"_id": corte_lazer_hash})
-                if corte_info:
-                    corte_lazer_data = corte_info.get("corte_lazer_data", {})
-                    # Filtrar claves de corte_lazer eliminando las que contienen "color" o "base"
-                    corte_lazer_filtered = {
-                        k: v for k, v in corte_lazer_data.items() if not excluded_columns_regex.search(k)
-                    }
-
-                    # Fusionar datos del form_llenado con corte_lazer solo para las claves permitidas
-                    for key in corte_lazer_filtered.keys():
-                        if key in producto.get("forms_lleno", {}):
-                            corte_entry[key] = producto["forms_lleno"][key]  # Priorizar form_llenado
-                        else:
-                            corte_entry[key] = corte_lazer_filtered[key]  # Si no está en form_llenado, tomar el original
+            if not incluir_cortes:
+                continue
+
+            # Fusionar datos del form_llenado con el corte láser del producto solo para las claves permitidas
+            corte_lazer_filtered = cortes_filtrados.get(producto.get("corte_lazer_hash"), {})
+            corte_entry = {
+                key: forms_lleno[key] if key in forms_lleno else valor  # Priorizar form_llenado; si no está, tomar el original
+                for key, valor in corte_lazer_filtered.items()
+            }
 
             # Incluir siempre la Figura si está en forms_lleno
-            corte_entry["Figura"] = producto.get("forms_lleno", {}).get("Figura", '-')
+            corte_entry["Figura"] = forms_lleno.get("Figura", '-')
 
             # Añadir cantidad desde el formulario si existe
-            cantidad = int(producto.get("forms_lleno", {}).get("Cantidad", 0))
+            cantidad = int(forms_lleno.get("Cantidad", 0))
             corte_entry["Cantidad"] = cantidad
 
             # Crear clave única basada en los valores del corte_lazer sin incluir la cantidad
@@ -248,222 +478,276 @@ class PedidosManager:
             else:
                 cortes_laser_dict[corte_key] = corte_entry
 
-        # Convertir cortes_laser_dict en lista de diccionarios
+        tabla_productos = {
+            "title": "Lista de Productos",
+            "columns": ["Modelo"] + [COLUMNAS_RENOMBRADAS.get(key, key) for key in all_keys],  # Aplicar mapeo si existe
+            "rows": productos
+        }
+
+        # Columnas de cortes láser en el orden en que aparecen; las que falten en una fila quedan vacías
         cortes_laser = list(cortes_laser_dict.values())
+        columnas_cortes = list({key: None for corte in cortes_laser for key in corte})
+        tabla_cortes = {
+            "title": "Detalles de Corte Láser",
+            "columns": columnas_cortes,
+            "rows": [[corte.get(key, "") for key in columnas_cortes] for corte in cortes_laser]
+        }
+
+        return tabla_productos, tabla_cortes
 
-        df_productos = pd.DataFrame(productos)
-        df_cortes_laser = pd.DataFrame(cortes_laser) if cortes_laser else pd.DataFrame()
+    def cortes_filtrados(self, corte_lazer_hashes):
+        """Devuelve hash -> datos del corte láser sin las claves excluidas (color, base), con una sola consulta."""
+        cortes = content_cache.get_many(self.db.corte_lazer, corte_lazer_hashes)
+        return {
+            corte_lazer_hash: {
+                k: v for k, v in corte_info.get("corte_lazer_data", {}).items() if not COLUMNAS_EXCLUIDAS_CORTES.search(k)
+            }
+            for corte_lazer_hash, corte_info in cortes.items()
+        }
 
-        return df_pedido, df_productos, df_cortes_laser
+    def generate_pedido_dataframes(self, pedido_id):
+        """Genera los DataFrames del pedido, productos y cortes láser."""
+        import pandas as pd  # Solo quien pide DataFrames paga el import de pandas
 
-    def download_excel(self, pedido_id):
-        """Toma los DataFrames generados y los exporta a un archivo Excel en una sola hoja con formato elegante y colores diferenciados."""
-        df_pedido, df_productos, df_cortes_laser = self.generate_pedido_dataframes(pedido_id)
-
-        if df_pedido is None:
-            return None  # Si no se generaron DataFrames, retornar None
-
-        # Crear un buffer en memoria
-        output = io.BytesIO()
-        
-        # Crear un archivo Excel con XlsxWriter
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            workbook = writer.book
-            worksheet = workbook.add_worksheet("Resumen Pedido")
-
-            # Definir formatos de títulos con diferentes colores por tabla
-            title_formats = [
-                workbook.add_format({'bold': True, 'font_size': 16, 'align': 'center', 'valign': 'vcenter', 'bg_color': '#2F5597', 'font_color': 'white'}),
-                workbook.add_format({'bold': True, 'font_size': 16, 'align': 'center', 'valign': 'vcenter', 'bg_color': '#009688', 'font_color': 'white'}),
-                workbook.add_format({'bold': True, 'font_size': 16, 'align': 'center', 'valign': 'vcenter', 'bg_color': '#795548', 'font_color': 'white'})
-            ]
-
-            # Definir formatos de encabezados con colores diferenciados
-            header_formats = [
-                workbook.add_format({'bold': True, 'font_size': 12, 'bg_color': '#D9E1F2', 'align': 'center', 'border': 1}),
-                workbook.add_format({'bold': True, 'font_size': 12, 'bg_color': '#B2DFDB', 'align': 'center', 'border': 1}),
-                workbook.add_format({'bold': True, 'font_size': 12, 'bg_color': '#D7CCC8', 'align': 'center', 'border': 1})
-            ]
-
-            # Formato para celdas de datos
-            cell_format = workbook.add_format({'font_size': 11, 'border': 1})
-            cell_center_format = workbook.add_format({'font_size': 11, 'border': 1, 'align': 'center'})
-
-            row = 0  # Controla la fila donde se escribe en el Excel
-
-            # Función para escribir DataFrames en el Excel con formato
-            def write_dataframe(title, df, start_row, title_format, header_format):
-                """Escribe un DataFrame en el archivo con formato y devuelve la siguiente fila disponible."""
-                nonlocal worksheet
-                if df.empty:
-                    return start_row  # Si está vacío, no escribirlo
-
-                # Reemplazar NaN, None, Inf, -Inf con ""
-                df = df.replace([np.nan, None, np.inf, -np.inf], "")
-
-                # Escribir título fusionado con color específico
-                col_range = len(df.columns) - 1
-                worksheet.merge_range(start_row, 0, start_row, col_range, title, title_format)
-                start_row += 1
-
-                # Escribir encabezados con formato diferenciado
-                for col_num, column_name in enumerate(df.columns):
-                    worksheet.write(start_row, col_num, column_name, header_format)
-                start_row += 1
-
-                # Escribir datos con formato
-                for i, row_data in df.iterrows():
-                    for col_num, value in enumerate(row_data):
-                        if isinstance(value, (int, float)) and not pd.isna(value):  # Alinear números al centro
-                            worksheet.write(start_row, col_num, value, cell_center_format)
-                        else:
-                            worksheet.write(start_row, col_num, str(value), cell_format)
-                    start_row += 1
-
-                # Ajustar automáticamente el ancho de las columnas basado en la celda más larga
-                for col_num, column_name in enumerate(df.columns):
-                    max_length = max(df[column_name].astype(str).apply(len).max(), len(column_name))
-                    worksheet.set_column(col_num, col_num, max_length + 2)
-
-                return start_row + 2  # Dejar espacio entre tablas
-
-            # Escribir cada DataFrame en la hoja con colores diferenciados
-            row = write_dataframe("Información del Pedido", df_pedido, row, title_formats[0], header_formats[0])
-            row = write_dataframe("Lista de Productos", df_productos, row, title_formats[1], header_formats[1])
-            row = write_dataframe("Detalles de Corte Láser", df_cortes_laser, row, title_formats[2], header_formats[2])
-
-        output.seek(0)
-        return output
+        tablas = self.generate_pedido_tablas(pedido_id)
+        if tablas is None:
+            return None, None, None  # Si no existe el pedido, devuelve None en todos los DataFrames
+        return tuple(pd.DataFrame(tabla["rows"], columns=tabla["columns"]) for tabla in tablas)
 
     def generate_pedido_dataframes_cliente(self, pedido_id):
         """Genera los DataFrames del pedido y productos, sin incluir cortes láser."""
-        pedido = self.get_pedidos_por_id(pedido_id)
+        import pandas as pd  # Solo quien pide DataFrames paga el import de pandas
 
-        if not pedido:
+        tablas = self.generate_pedido_tablas(pedido_id, incluir_cortes=False)
+        if tablas is None:
             return None, None  # Si no existe el pedido, devuelve None en los DataFrames
+        return tuple(pd.DataFrame(tabla["rows"], columns=tabla["columns"]) for tabla in tablas)
 
-        # Crear DataFrame con información general del pedido
-        data_pedido = {
-            "Orden ID": [pedido.get("orden_id", "Desconocido")],
-            "Cliente": [pedido.get("client_name", "Cliente Desconocido")],
-            "Fecha": [pedido.get("timestamp", "Fecha no disponible")],
-            "Estado": [pedido.get("estado", "Estado no disponible")],
-            "Total Pedidos": [pedido.get("total_pedidos", 0)],
-            "Total Urnas": [pedido.get("total_urnas", 0)]
-        }
-        df_pedido = pd.DataFrame(data_pedido)
-
-        # Obtener diccionario de modelos de la colección 'prods'
-        productos_dict = {
-            str(prod["_id"]): prod for prod in self.db.prods.find({}, {"_id": 1, "modelo": 1})
-        }
+    def download_excel(self, pedido_id):
+        """Exporta el pedido (información, productos y cortes láser) a un archivo Excel en una sola hoja con formato elegante y colores diferenciados."""
+        tablas = self.generate_pedido_tablas(pedido_id)
+        if tablas is None:
+            return None  # Si el pedido no existe, retornar None
+        return ExcelExporter().export(tablas)
 
-        # Obtener todas las claves únicas de "forms_lleno" en los productos
-        all_keys = set()
-        for producto in pedido.get("productos", []):
-            all_keys.update(producto.get("forms_lleno", {}).keys())
+    def download_excel_cliente(self, pedido_id):
+        """Exporta el pedido (información y productos, sin cortes láser) a un archivo Excel para el cliente."""
+        tablas = self.generate_pedido_tablas(pedido_id, incluir_cortes=False)
+        if tablas is None:
+            return None  # Si el pedido no existe, retornar None
+        return ExcelExporter().export(tablas)
+
+    def get_version_pedido(self, pedido_id):
+        """Devuelve la versión del pedido (0 si nunca cambió de estado), o None si el pedido no existe."""
+        pedido = self.db.orders.find_one({"_id": ObjectId(pedido_id)}, {"version": 1})
+        return pedido.get("version", 0) if pedido else None
+
+    def excel_etag(self, pedido_id, version, cliente=False):
+        """ETag del Excel de un pedido: identifica el pedido, su versión (get_version_pedido) y el tipo de Excel (admin o cliente)."""
+        return f"{pedido_id}-{version}-{'cliente' if cliente else 'admin'}"
+
+    def get_excel_pedido(self, pedido_id, version, cliente=False):
+        """
+        Devuelve {"data": bytes, "etag": str} con el Excel del pedido (el del cliente no incluye los cortes láser),
+        o None si el pedido no existe. 'version' es la que la ruta ya leyó para responder 304, así que un acierto
+        de la caché ('excel_cache') es una sola lectura. Se genera una sola vez por versión del pedido.
+        """
+        etag = self.excel_etag(pedido_id, version, cliente)
+        cached = self.excel_cache_col.find_one({"_id": etag}, {"_id": 0, "data": 1, "accessed_at": 1})
+        cache_result("excel", cached is not None)
+        if cached:
+            # Para elegir qué desalojar basta con saber en qué hora se usó por última vez
+            if cached["accessed_at"] < datetime.now() - EXCEL_CACHE_TOUCH_INTERVAL:
+                self.excel_cache_col.update_one({"_id": etag}, {"$set": {"accessed_at": datetime.now()}})
+            return {"data": bytes(cached["data"]), "etag": etag}
 
-        # Definir el mapeo de nombres de columnas
-        column_mapping = {
-            "¿quieres_el_logo_de_tu_empresa?": "logo_grabado",
-            "tipo-urna": "tipo-madera"
+        pedido = self.get_pedidos_por_id(pedido_id)
+        if pedido is None:
+            return None
+        with timed_report("excel_cliente" if cliente else "excel_pedido"):
+            data = ExcelExporter().export(self.tablas_pedido(pedido, incluir_cortes=not cliente)).getvalue()
+
+        # Si el pedido cambió de estado después de leer 'version', el Excel es el de la versión nueva
+        etag = self.excel_etag(pedido_id, pedido.get("version", 0), cliente)
+        if len(data) <= EXCEL_CACHE_MAX_FILE_BYTES:
+            self.guardar_excel_cache(etag, pedido_id, data)
+        return {"data": data, "etag": etag}
+
+    def guardar_excel_cache(self, etag, pedido_id, data):
+        """Guarda un Excel en 'excel_cache', suma su tamaño al total y desaloja los más antiguos si se supera el máximo."""
+        try:
+            self.excel_cache_col.insert_one(
+                {"_id": etag, "pedido_id": pedido_id, "data": Binary(data), "size": len(data), "accessed_at": datetime.now()}
+            )
+        except DuplicateKeyError:
+            return  # Otro worker lo generó a la vez y ya está contado
+
+        total = self.db.cache_versions.find_one_and_update(
+            {"_id": "excel_cache"}, {"$inc": {"size": len(data)}}, upsert=True, return_document=pymongo.ReturnDocument.AFTER
+        )["size"]
+        if total > EXCEL_CACHE_MAX_BYTES:
+            self.evict_excel_cache(EXCEL_CACHE_MAX_BYTES)
+
+    def borrar_excel_cache(self, filtro):
+        """Borra los Excel de 'excel_cache' que cumplan 'filtro' y resta su tamaño del total. Devuelve cuántos borró."""
+        borrados = 0
+        for doc in self.excel_cache_col.find(filtro, {"_id": 1}):
+            # Uno a uno: si dos procesos borran el mismo Excel, solo el que lo borra resta su tamaño
+            borrado = self.excel_cache_col.find_one_and_delete({"_id": doc["_id"]}, {"size": 1})
+            if borrado:
+                self.db.cache_versions.update_one({"_id": "excel_cache"}, {"$inc": {"size": -borrado.get("size", 0)}}, upsert=True)
+                borrados += 1
+        return borrados
+
+    def evict_excel_cache(self, max_bytes=EXCEL_CACHE_MAX_BYTES):
+        """Elimina los Excel usados hace más tiempo hasta que 'excel_cache' ocupe como mucho 'max_bytes'."""
+        total = (self.db.cache_versions.find_one({"_id": "excel_cache"}) or {}).get("size", 0)
+        if total <= max_bytes:
+            return 0
+
+        evicted = 0
+        for doc in self.excel_cache_col.find({}, {"size": 1}).sort("accessed_at", pymongo.ASCENDING):
+            if total <= max_bytes:
+                break
+            evicted += self.borrar_excel_cache({"_id": doc["_id"]})
+            total -= doc.get("size", 0)
+        else:
+            # La caché quedó vacía y el total seguía por encima: se había desviado (p. ej. un proceso que terminó
+            # entre guardar un Excel y sumar su tamaño)
+            self.recalcular_tamano_excel_cache()
+        return evicted
+
+    def recalcular_tamano_excel_cache(self):
+        """Recalcula el tamaño total de 'excel_cache' (que guardar_excel_cache y borrar_excel_cache mantienen)."""
+        total = next(self.excel_cache_col.aggregate([{"$group": {"_id": None, "size": {"$sum": "$size"}}}]), {"size": 0})["size"]
+        self.db.cache_versions.update_one({"_id": "excel_cache"}, {"$set": {"size": total}}, upsert=True)
+        return {"success": True, "size": total}
+
+    def columnas_exportacion(self, filtro):
+        """
+        Columnas de las tablas "productos" y "cortes" de la exportación de varios pedidos. Se calculan en la BD
+        antes de leer los pedidos, para poder escribir cada fila en cuanto llega.
+        """
+        # Claves de 'forms_lleno' de todos los productos, en el orden en que suelen aparecer en el formulario
+        claves = self.db.orders.aggregate([
+            {"$match": filtro},
+            {"$unwind": "$productos"},
+            {"$project": {"campos": {"$objectToArray": {"$ifNull": ["$productos.forms_lleno", {}]}}}},
+            {"$unwind": {"path": "$campos", "includeArrayIndex": "posicion"}},
+            {"$group": {"_id": "$campos.k", "posicion": {"$min": "$posicion"}}},
+            {"$sort": {"posicion": 1, "_id": 1}},
+        ], allowDiskUse=True)
+        columnas_productos = list(dict.fromkeys(COLUMNAS_RENOMBRADAS.get(doc["_id"], doc["_id"]) for doc in claves if doc["_id"] != "product_id"))
+
+        # Claves de los cortes láser usados (sin las excluidas), seguidas de la figura y la cantidad
+        cortes = self.cortes_filtrados(self.db.orders.distinct("productos.corte_lazer_hash", filtro))
+        columnas_cortes = [key for key in dict.fromkeys(key for corte in cortes.values() for key in corte) if key not in ("Figura", "Cantidad")]
+
+        return {
+            "pedidos": COLUMNAS_PEDIDO,
+            "productos": ["Orden ID", "Modelo"] + columnas_productos,
+            "cortes": ["Orden ID"] + columnas_cortes + ["Figura", "Cantidad"],
         }
 
-        # Crear lista de productos con información completa del formulario
-        productos = []
-
-        for producto in pedido.get("productos", []):
-            product_id = producto.get("forms_lleno", {}).get("product_id")
-            producto_info = {
-                "Modelo": productos_dict.get(product_id, {}).get("modelo", "Modelo Desconocido"),
-            }
-
-            # Agregar todas las claves de forms_lleno con mapeo, excluyendo "product_id"
-            for key in all_keys:
-                if key != "product_id":  # Excluir la columna "product_id"
-                    mapped_key = column_mapping.get(key, key)  # Aplicar mapeo si existe
-                    producto_info[mapped_key] = producto.get("forms_lleno", {}).get(key, '-')
-
-            productos.append(producto_info)
-
-        df_productos = pd.DataFrame(productos)
-
-        return df_pedido, df_productos
-    def download_excel_cliente(self, pedido_id):
-        """Toma los DataFrames generados y los exporta a un archivo Excel en una sola hoja con formato elegante y colores diferenciados."""
-        df_pedido, df_productos = self.generate_pedido_dataframes_cliente(pedido_id)
-
-        if df_pedido is None:
-            return None  # Si no se generaron DataFrames, retornar None
-
-        # Crear un buffer en memoria
-        output = io.BytesIO()
-        
-        # Crear un archivo Excel con XlsxWriter
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            workbook = writer.book
-            worksheet = workbook.add_worksheet("Resumen Pedido")
-
-            # Definir formatos de títulos con diferentes colores por tabla
-            title_formats = [
-                workbook.add_format({'bold': True, 'font_size': 16, 'align': 'center', 'valign': 'vcenter', 'bg_color': '#2F5597', 'font_color': 'white'}),
-                workbook.add_format({'bold': True, 'font_size': 16, 'align': 'center', 'valign': 'vcenter', 'bg_color': '#009688', 'font_color': 'white'}),
-                workbook.add_format({'bold': True, 'font_size': 16, 'align': 'center', 'valign': 'vcenter', 'bg_color': '#795548', 'font_color': 'white'})
-            ]
-
-            # Definir formatos de encabezados con colores diferenciados
-            header_formats = [
-                workbook.add_format({'bold': True, 'font_size': 12, 'bg_color': '#D9E1F2', 'align': 'center', 'border': 1}),
-                workbook.add_format({'bold': True, 'font_size': 12, 'bg_color': '#B2DFDB', 'align': 'center', 'border': 1}),
-                workbook.add_format({'bold': True, 'font_size': 12, 'bg_color': '#D7CCC8', 'align': 'center', 'border': 1})
-            ]
-
-            # Formato para celdas de datos
-            cell_format = workbook.add_format({'font_size': 11, 'border': 1})
-            cell_center_format = workbook.add_format({'font_size': 11, 'border': 1, 'align': 'center'})
-
-            row = 0  # Controla la fila donde se escribe en el Excel
-
-            # Función para escribir DataFrames en el Excel con formato
-            def write_dataframe(title, df, start_row, title_format, header_format):
-                """Escribe un DataFrame en el archivo con formato y devuelve la siguiente fila disponible."""
-                nonlocal worksheet
-                if df.empty:
-                    return start_row  # Si está vacío, no escribirlo
-
-                # Reemplazar NaN, None, Inf, -Inf con ""
-                df = df.replace([np.nan, None, np.inf, -np.inf], "")
-
-                # Escribir título fusionado con color específico
-                col_range = len(df.columns) - 1
-                worksheet.merge_range(start_row, 0, start_row, col_range, title, title_format)
-                start_row += 1
-
-                # Escribir encabezados con formato diferenciado
-                for col_num, column_name in enumerate(df.columns):
-                    worksheet.write(start_row, col_num, column_name, header_format)
-                start_row += 1
-
-                # Escribir datos con formato
-                for i, row_data in df.iterrows():
-                    for col_num, value in enumerate(row_data):
-                        if isinstance(value, (int, float)) and not pd.isna(value):  # Alinear números al centro
-                            worksheet.write(start_row, col_num, value, cell_center_format)
-                        else:
-                            worksheet.write(start_row, col_num, str(value), cell_format)
-                    start_row += 1
-
-                # Ajustar automáticamente el ancho de las columnas basado en la celda más larga
-                for col_num, column_name in enumerate(df.columns):
-                    max_length = max(df[column_name].astype(str).apply(len).max(), len(column_name))
-                    worksheet.set_column(col_num, col_num, max_length + 2)
-
-                return start_row + 2  # Dejar espacio entre tablas
-
-            # Escribir cada DataFrame en la hoja con colores diferenciados
-            row = write_dataframe("Información del Pedido", df_pedido, row, title_formats[0], header_formats[0])
-            row = write_dataframe("Lista de Productos", df_productos, row, title_formats[1], header_formats[1])
-
-
-        output.seek(0)
-        return output
+    def filas_exportacion(self, filtro, columnas, tablas=("pedidos", "productos", "cortes"), batch_size=200):
+        """
+        Recorre los pedidos del filtro (del más reciente al más antiguo) con un cursor por lotes y genera
+        (tabla, fila) para las tablas pedidas, con las filas en el orden de 'columnas'. Cada pedido se convierte
+        con tablas_productos, así que los cortes láser se mezclan por pedido igual que en su Excel individual.
+        """
+        incluir_cortes = "cortes" in tablas
+        proyeccion = None if "productos" in tablas or incluir_cortes else {"productos": 0}
+        pedidos = (
+            self.db.orders.find(filtro, proyeccion)
+            .sort([("timestamp", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+            .batch_size(batch_size)
+        )
+
+        nombres = {}  # client_id -> nombre del cliente, pedido a la BD una vez por lote
+        lote = []
+        for pedido in pedidos:
+            lote.append(pedido)
+            if len(lote) < batch_size:
+                continue
+            yield from self._filas_lote(lote, columnas, tablas, incluir_cortes, nombres)
+            lote = []
+        yield from self._filas_lote(lote, columnas, tablas, incluir_cortes, nombres)
+
+    def _filas_lote(self, lote, columnas, tablas, incluir_cortes, nombres):
+        """Genera las filas de exportación de un lote de pedidos."""
+        faltantes = [
+            ObjectId(cid) for cid in {pedido.get("client_id") for pedido in lote}
+            if cid not in nombres and cid and ObjectId.is_valid(cid)
+        ]
+        if faltantes:
+            for user in self.db.usuarios.find({"_id": {"$in": faltantes}}, {"_id": 1, "client_name": 1}):
+                nombres[str(user["_id"])] = user["client_name"]
+
+        for pedido in lote:
+            orden_id = str(pedido.get("orden_id", "Desconocido"))
+
+            if "pedidos" in tablas:
+                yield "pedidos", [
+                    orden_id,
+                    nombres.get(pedido.get("client_id"), "Cliente Desconocido"),
+                    self.formatear_fecha(pedido.get("timestamp")),
+                    pedido.get("estado", "Estado no disponible"),
+                    pedido.get("total_pedidos", 0),
+                    pedido.get("total_urnas", 0)
+                ]
+
+            if "productos" not in tablas and not incluir_cortes:
+                continue
+
+            tabla_productos, tabla_cortes = self.tablas_productos(pedido.get("productos", []), incluir_cortes)
+            if "productos" in tablas:
+                for row in tabla_productos["rows"]:
+                    fila = dict(zip(tabla_productos["columns"], row))
+                    yield "productos", [orden_id] + [fila.get(key, '-') for key in columnas["productos"][1:]]
+            if incluir_cortes:
+                for row in tabla_cortes["rows"]:
+                    fila = dict(zip(tabla_cortes["columns"], row))
+                    yield "cortes", [orden_id] + [fila.get(key, "") for key in columnas["cortes"][1:]]
+
+    def exportar_pedidos_excel(self, output=None, batch_size=200, **filtros):
+        """
+        Exporta los pedidos que cumplen los filtros (estado, client_id, fecha_desde, fecha_hasta) a un Excel
+        con tres hojas: pedidos, productos y cortes láser. Las filas se escriben a medida que se leen los pedidos,
+        así que la memoria no depende del número de pedidos (conviene pasar un archivo temporal como 'output').
+        """
+        condiciones = self.condiciones_pedidos(**filtros)
+        filtro = {"$and": condiciones} if condiciones else {}
+        columnas = self.columnas_exportacion(filtro)
+
+        tablas = ["pedidos", "productos", "cortes"]
+        sheets = [
+            {"name": "Pedidos", "title": "Pedidos", "columns": columnas["pedidos"]},
+            {"name": "Productos", "title": "Lista de Productos", "columns": columnas["productos"]},
+            {"name": "Cortes Láser", "title": "Detalles de Corte Láser", "columns": columnas["cortes"]},
+        ]
+        rows = ((tablas.index(tabla), fila) for tabla, fila in self.filas_exportacion(filtro, columnas, batch_size=batch_size))
+        with timed_report("exportar_excel"):
+            return ExcelExporter().export_sheets(sheets, rows, output)
+
+    def exportar_pedidos_csv(self, tabla="productos", batch_size=200, chunk_size=64 * 1024, **filtros):
+        """
+        Exporta una tabla ("pedidos", "productos" o "cortes") de los pedidos que cumplen los filtros a CSV.
+        Es un generador de trozos de texto, para enviarlos mientras se leen los pedidos.
+        """
+        condiciones = self.condiciones_pedidos(**filtros)
+        filtro = {"$and": condiciones} if condiciones else {}
+        columnas = self.columnas_exportacion(filtro)
+
+        buffer = io.StringIO()
+        buffer.write("\ufeff")  # BOM para que Excel abra el CSV como UTF-8
+        writer = csv.writer(buffer)
+        writer.writerow(columnas[tabla])
+
+        for _, fila in self.filas_exportacion(filtro, columnas, tablas=(tabla,), batch_size=batch_size):
+            writer.writerow(fila)
+            if buffer.tell() >= chunk_size:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+        yield buffer.getvalue()
@@ -1,29 +1,137 @@
 import os
-import pymongo
-from dotenv import load_dotenv
-from pymongo import ASCENDING, DESCENDING
+import logging
+import gridfs
+from gridfs.errors import NoFile, FileExists
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+import io
 import json
 import hashlib
-from bson import ObjectId
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId, Binary
+from DataManagers.LRUCache import LRUCache
+from DataManagers.ContentCache import content_cache
+from DataManagers.Database import get_database
 
+# Imágenes más grandes que este límite se guardan en GridFS en lugar de un documento de 'imgs'
+GRIDFS_THRESHOLD_BYTES = 8 * 1024 * 1024
 
-class ProductManager:
-    def __init__(self):
-        """Initialize the connection to the database."""
-        load_dotenv()
-        MONGO_URI = os.getenv("MONGO_URI")
-        DATABASE_NAME = os.getenv("DATABASE_NAME")
+# Variantes WebP generadas para cada imagen: nombre -> lado mayor en píxeles
+IMAGE_VARIANTS = {
+    "thumb": 400,     # Tarjetas del catálogo y del carrito
+    "gallery": 1200,  # Galería de la página del producto
+}
+
+# Firmas de archivo para detectar el tipo real de la imagen
+IMAGE_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+# Segundos que el catálogo cacheado sigue siendo válido aunque nadie lo invalide (ediciones directas en la BD)
+CATALOG_CACHE_TTL = int(os.getenv("CATALOG_CACHE_TTL", 300))
+
+# Memoria máxima (en bytes) para las imágenes cacheadas en cada proceso
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Las variantes se generan fuera del request que sube el producto
+_variants_executor = ThreadPoolExecutor(max_workers=2)
+
+logger = logging.getLogger(__name__)
+
+
+def image_url(img_hash, variant=None):
+    """Devuelve la URL pública de una imagen a partir de su hash SHA-256 (ver ruta /img/<img_hash>)."""
+    return f"/img/{img_hash}/{variant}" if variant else f"/img/{img_hash}"
 
-        self.client = pymongo.MongoClient(MONGO_URI)
-        self.db = self.client[DATABASE_NAME]
 
-        # Define collections
-        self.prods_col = self.db["prods"]
-        self.forms_col = self.db["forms"]
-        self.imgs_col = self.db["imgs"]
-        self.corte_lazer_col = self.db["corte_lazer"]
+def image_srcset(img_hash):
+    """Construye el atributo srcset con todas las variantes de una imagen."""
+    return ", ".join(f"{image_url(img_hash, variant)} {size}w" for variant, size in IMAGE_VARIANTS.items())
+
+
+def sniff_mimetype(img_bytes):
+    """Detecta el tipo MIME de una imagen a partir de sus primeros bytes."""
+    for signature, mimetype in IMAGE_SIGNATURES:
+        if img_bytes.startswith(signature):
+            return mimetype
+    if img_bytes[:4] == b"RIFF" and img_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+class ProductManager:
+    def __init__(self, database=None):
+        """Use the shared database connection (see DataManagers.Database)."""
+        self.database = database or get_database()
+
+        # Cachés en memoria: el catálogo se guarda bajo su versión y las imágenes bajo (hash, variante)
+        self.catalog_cache = LRUCache(max_size=1, ttl=CATALOG_CACHE_TTL, name="catalogo")
+        self.image_cache = LRUCache(max_size=IMAGE_CACHE_MAX_BYTES, sizeof=lambda img: len(img["data"]), name="imagenes")
+
+    # Collections are looked up on every access so they always belong to this process' client
+    @property
+    def db(self):
+        return self.database.db
+
+    @property
+    def prods_col(self):
+        return self.db["prods"]
+
+    @property
+    def forms_col(self):
+        return self.db["forms"]
+
+    @property
+    def imgs_col(self):
+        return self.db["imgs"]
+
+    @property
+    def corte_lazer_col(self):
+        return self.db["corte_lazer"]
+
+    @property
+    def imgs_variants_col(self):
+        return self.db["imgs_variants"]
+
+    @property
+    def imgs_fs(self):
+        return gridfs.GridFSBucket(self.db, bucket_name="imgs_fs")
+
+    @property
+    def cache_versions_col(self):
+        return self.db["cache_versions"]
+
+    def get_catalog_version(self):
+        """Devuelve la versión actual del catálogo. Se comparte en la BD para que todos los workers la vean."""
+        doc = self.cache_versions_col.find_one({"_id": "catalogo"}, {"version": 1})
+        return doc["version"] if doc else 0
+
+    def invalidate_catalogo(self):
+        """Incrementa la versión del catálogo para descartar las copias cacheadas en todos los workers."""
+        self.cache_versions_col.update_one({"_id": "catalogo"}, {"$inc": {"version": 1}}, upsert=True)
+        self.catalog_cache.clear()
+
+    def get_cache_stats(self):
+        """Devuelve las estadísticas (aciertos, fallos, ocupación) de las cachés del catálogo, de imágenes y de contenido."""
+        return {
+            "catalogo": self.catalog_cache.stats(),
+            "imagenes": self.image_cache.stats(),
+            "contenido": content_cache.stats(),
+        }
 
     def get_catalogo(self):
+        """Devuelve el catálogo ordenado, usando la copia en memoria mientras su versión siga vigente."""
+        version = self.get_catalog_version()
+        products_with_images = self.catalog_cache.get(version)
+        if products_with_images is None:
+            products_with_images = self._load_catalogo()
+            self.catalog_cache.set(version, products_with_images)
+        return products_with_images
+
+    def _load_catalogo(self):
         # Step 1: Fetch sorted product details (sorted from greatest to smallest 'sort_order')
         sorted_products = list(self.prods_col.find(
             {}, {"_id": 1, "modelo": 1, "sort_order": 1, "img_hashes.img_2": 1}  # Ensure "modelo" and "sort_order" are included
@@ -33,10 +141,9 @@ class ProductManager:
         img_hashes = [product.get("img_hashes", {}).get("img_2") for product in sorted_products if "img_hashes" in product]
         img_hashes = list(filter(None, img_hashes))  # Remove None values
 
-        # Step 3: Fetch all images in a single query
-        images_data = {
-            img["_id"]: img["image_data"]
-            for img in self.imgs_col.find({"_id": {"$in": img_hashes}}, {"_id": 1, "image_data": 1})
+        # Step 3: Check which images exist (only the _id is read, the image bytes are served by /img/<hash>)
+        existing_hashes = {
+            img["_id"] for img in self.imgs_col.find({"_id": {"$in": img_hashes}}, {"_id": 1})
         }
 
         # Step 4: Process and structure the final list
@@ -45,8 +152,10 @@ class ProductManager:
                 "id": str(product["_id"]),
                 "model": product.get("modelo", "Unknown"),  # Ensure model key exists
                 "sort_order": product.get("sort_order", 0),  # Ensure sort_order key exists
-                "image": f"data:image/png;base64,{images_data.get(product.get('img_hashes', {}).get('img_2'))}"
-                if product.get("img_hashes", {}).get("img_2") in images_data else None
+                "image": image_url(product.get("img_hashes", {}).get("img_2"), "thumb")
+                if product.get("img_hashes", {}).get("img_2") in existing_hashes else None,
+                "image_srcset": image_srcset(product.get("img_hashes", {}).get("img_2"))
+                if product.get("img_hashes", {}).get("img_2") in existing_hashes else None
             }
             for product in sorted_products
         ]
@@ -69,20 +178,18 @@ class ProductManager:
 
         # Get actual forms data from 'forms' collection
         forms_hash = product.get("forms_hash")
-        forms_data = self.forms_col.find_one({"_id": forms_hash}, {"_id": 0, "forms_data": 1}) if forms_hash else None
+        forms_data = content_cache.get(self.forms_col, forms_hash)
 
         # Get multiple images from 'imgs' collection
         img_hashes = product.get("img_hashes", {}).get("img_1", [])  # Lista de hashes de imágenes
         images = []
         if img_hashes:
-            images = [
-                f"data:image/png;base64,{img['image_data']}" 
-                for img in self.imgs_col.find({"_id": {"$in": img_hashes}}, {"_id": 0, "image_data": 1})
-            ]
+            existing_hashes = {img["_id"] for img in self.imgs_col.find({"_id": {"$in": img_hashes}}, {"_id": 1})}
+            images = [image_url(img_hash, "gallery") for img_hash in img_hashes if img_hash in existing_hashes]
 
         # Get corte_lazer data from 'corte_lazer' collection
         corte_lazer_hash = product.get("corte_lazer_hash")
-        corte_lazer_data = self.corte_lazer_col.find_one({"_id": corte_lazer_hash}, {"_id": 0, "corte_lazer_data": 1}) if corte_lazer_hash else None
+        corte_lazer_data = content_cache.get(self.corte_lazer_col, corte_lazer_hash)
 
         response = {
             "model": product.get("modelo", "Unknown"),
@@ -94,6 +201,182 @@ class ProductManager:
         return response
 
 
+    def image_hash(self, img_bytes):
+        """
+        Genera el hash SHA-256 de una imagen. Se calcula sobre su representación base64 para que
+        coincida con los hashes ya guardados en 'prods.img_hashes' antes del almacenamiento binario.
+        """
+        return hashlib.sha256(base64.b64encode(img_bytes)).hexdigest()
+
+    def store_image(self, img_bytes, background=True):
+        """Guarda una imagen en binario (o en GridFS si es muy grande), genera sus variantes y devuelve su hash."""
+        img_hash = self.image_hash(img_bytes)
+
+        if not self.imgs_col.find_one({"_id": img_hash}, {"_id": 1}):
+            mimetype = sniff_mimetype(img_bytes)
+            if len(img_bytes) > GRIDFS_THRESHOLD_BYTES:
+                self.imgs_fs.upload_from_stream_with_id(img_hash, img_hash, img_bytes)
+                self.imgs_col.insert_one({"_id": img_hash, "gridfs_id": img_hash, "mimetype": mimetype})
+            else:
+                self.imgs_col.insert_one({"_id": img_hash, "image_data": Binary(img_bytes), "mimetype": mimetype})
+
+        if background:
+            _variants_executor.submit(self._generate_image_variants_safe, img_hash)
+        else:
+            self.generate_image_variants(img_hash)
+
+        return img_hash
+
+    def _read_original_image(self, img_hash):
+        """Lee los bytes y el tipo MIME de la imagen original. Devuelve None si no existe."""
+        img = self.imgs_col.find_one({"_id": img_hash}, {"_id": 0, "image_data": 1, "gridfs_id": 1, "mimetype": 1})
+        if not img:
+            return None
+
+        if "gridfs_id" in img:
+            img_bytes = self.imgs_fs.open_download_stream(img["gridfs_id"]).read()
+        elif isinstance(img["image_data"], str):  # Documento antiguo aún no migrado
+            img_bytes = base64.b64decode(img["image_data"])
+        else:
+            img_bytes = bytes(img["image_data"])
+
+        return img_bytes, img.get("mimetype") or sniff_mimetype(img_bytes)
+
+    def get_image(self, img_hash, variant="original"):
+        """
+        Recupera una imagen por su hash y variante ('original', 'thumb' o 'gallery').
+        Si la variante aún no se ha generado se devuelve la original; 'variant' en la respuesta indica cuál se entregó.
+        Devuelve None si la imagen no existe.
+        """
+        cached = self.image_cache.get((img_hash, variant))
+        if cached is not None:
+            return cached
+
+        if variant in IMAGE_VARIANTS:
+            img = self.imgs_variants_col.find_one({"_id": f"{img_hash}:{variant}"}, {"_id": 0, "image_data": 1, "mimetype": 1})
+            if img:
+                result = {"data": bytes(img["image_data"]), "mimetype": img["mimetype"], "variant": variant}
+                self.image_cache.set((img_hash, variant), result)
+                return result
+
+            cached = self.image_cache.get((img_hash, "original"))
+            if cached is not None:
+                return cached
+
+        original = self._read_original_image(img_hash)
+        if original is None:
+            return None
+        img_bytes, mimetype = original
+        result = {"data": img_bytes, "mimetype": mimetype, "variant": "original"}
+
+        # Solo se cachea bajo la variante pedida si realmente es esa; si no, se volvería a pedir cuando exista
+        self.image_cache.set((img_hash, "original"), result)
+        return result
+
+    def generate_image_variants(self, img_hash):
+        """Genera (si faltan) las variantes WebP redimensionadas de una imagen y las guarda en 'imgs_variants'."""
+        from PIL import Image
+
+        missing = [
+            variant for variant in IMAGE_VARIANTS
+            if not self.imgs_variants_col.find_one({"_id": f"{img_hash}:{variant}"}, {"_id": 1})
+        ]
+        if not missing:
+            return {"success": True, "generated": 0}
+
+        original = self._read_original_image(img_hash)
+        if original is None:
+            return {"success": False, "error": "Imagen no encontrada"}
+
+        source = Image.open(io.BytesIO(original[0]))
+        if source.mode not in ("RGB", "RGBA"):
+            source = source.convert("RGBA")
+
+        for variant in missing:
+            size = IMAGE_VARIANTS[variant]
+            resized = source.copy()
+            resized.thumbnail((size, size))  # Nunca amplía imágenes pequeñas
+
+            buffer = io.BytesIO()
+            resized.save(buffer, format="WEBP", quality=80, method=4)
+
+            self.imgs_variants_col.replace_one(
+                {"_id": f"{img_hash}:{variant}"},
+                {
+                    "source": img_hash,
+                    "variant": variant,
+                    "width": resized.width,
+                    "height": resized.height,
+                    "mimetype": "image/webp",
+                    "image_data": Binary(buffer.getvalue()),
+                },
+                upsert=True
+            )
+
+        return {"success": True, "generated": len(missing)}
+
+    def _generate_image_variants_safe(self, img_hash):
+        """Versión para el hilo de fondo: los errores se registran en lugar de perderse en el executor."""
+        try:
+            self.generate_image_variants(img_hash)
+        except Exception:
+            logger.exception("Error generando variantes de la imagen %s", img_hash)
+
+    def generate_all_image_variants(self):
+        """Genera las variantes que falten para todas las imágenes de 'imgs'."""
+        generated = 0
+        for img in self.imgs_col.find({}, {"_id": 1}):
+            result = self.generate_image_variants(img["_id"])
+            generated += result.get("generated", 0)
+        return {"success": True, "generated": generated}
+
+    def delete_image(self, img_hash):
+        """Elimina una imagen de 'imgs', sus variantes y, si existe, su archivo en GridFS."""
+        img = self.imgs_col.find_one_and_delete({"_id": img_hash}, {"gridfs_id": 1})
+        for variant in ["original", *IMAGE_VARIANTS]:
+            self.image_cache.pop((img_hash, variant))
+        self.imgs_variants_col.delete_many({"source": img_hash})
+        if img and "gridfs_id" in img:
+            try:
+                self.imgs_fs.delete(img["gridfs_id"])
+            except NoFile:
+                pass
+
+    def migrate_images_to_binary(self, batch_size=50):
+        """
+        Convierte los documentos de 'imgs' guardados como texto base64 a binario (o GridFS).
+        Recorre la colección con un cursor por lotes, así que nunca carga todas las imágenes en memoria.
+        Los hashes no cambian, por lo que las referencias en 'prods.img_hashes' siguen siendo válidas.
+        """
+        migrated = 0
+        operations = []
+
+        cursor = self.imgs_col.find({"image_data": {"$type": "string"}}, {"image_data": 1}).batch_size(batch_size)
+        for img in cursor:
+            if not isinstance(img.get("image_data"), str):
+                continue
+
+            img_bytes = base64.b64decode(img["image_data"])
+            if len(img_bytes) > GRIDFS_THRESHOLD_BYTES:
+                try:
+                    self.imgs_fs.upload_from_stream_with_id(img["_id"], img["_id"], img_bytes)
+                except FileExists:
+                    pass  # Una migración anterior se interrumpió después de subir el archivo
+                update = {"$set": {"gridfs_id": img["_id"]}, "$unset": {"image_data": ""}}
+            else:
+                update = {"$set": {"image_data": Binary(img_bytes)}}
+            update["$set"]["mimetype"] = sniff_mimetype(img_bytes)
+
+            operations.append(UpdateOne({"_id": img["_id"]}, update))
+            if len(operations) >= batch_size:
+                migrated += self.imgs_col.bulk_write(operations, ordered=False).modified_count
+                operations = []
+
+        if operations:
+            migrated += self.imgs_col.bulk_write(operations, ordered=False).modified_count
+
+        return {"success": True, "migrated": migrated}
+
     def update_sort_order(self, product_id, direction):
         """Cambia el orden del producto en el catálogo."""
         try:
@@ -119,6 +402,7 @@ class ProductManager:
             # Intercambia los valores de sort_order
             self.prods_col.update_one({"_id": ObjectId(product_id)}, {"$set": {"sort_order": swap_order}})
             self.prods_col.update_one({"_id": swap_product["_id"]}, {"$set": {"sort_order": current_order}})
+            self.invalidate_catalogo()
 
             return {"success": True}
 
@@ -158,6 +442,7 @@ class ProductManager:
             if old_forms_hash and old_forms_hash != new_forms_hash:
                 if self.forms_col.find_one({"_id": old_forms_hash}):
                     self.forms_col.delete_one({"_id": old_forms_hash})
+                    content_cache.pop(self.forms_col, old_forms_hash)
                 else:
                     print(f"DEBUG: forms_hash anterior ({old_forms_hash}) no encontrado, omitiendo eliminación.")
 
@@ -205,6 +490,7 @@ class ProductManager:
             if old_corte_lazer_hash and old_corte_lazer_hash != new_corte_lazer_hash:
                 if self.corte_lazer_col.find_one({"_id": old_corte_lazer_hash}):
                     self.corte_lazer_col.delete_one({"_id": old_corte_lazer_hash})
+                    content_cache.pop(self.corte_lazer_col, old_corte_lazer_hash)
                 else:
                     print(f"DEBUG: corte_lazer_hash anterior ({old_corte_lazer_hash}) no encontrado, omitiendo eliminación.")
 
@@ -224,28 +510,17 @@ class ProductManager:
             return {"success": False, "error": f"Error al actualizar el corte láser: {str(e)}"}
 
 
-    def set_new_product(self, model_name, img_2_base64_list, img_1_base64):
+    def set_new_product(self, model_name, img_2_list, img_1):
         """Crea un nuevo producto con un nombre de modelo, múltiples imágenes para formularios (img_2) y una única imagen de catálogo (img_1)."""
         try:
-            if not model_name or not img_2_base64_list or not img_1_base64:
+            if not model_name or not img_2_list or not img_1:
                 return {"success": False, "error": "El nombre del modelo, al menos una imagen para formularios y una imagen de catálogo son obligatorios."}
             
             # ✅ Generar hashes y almacenar `img_2` (Múltiples Imágenes para Formularios)
-            img_2_hashes = []
-            for img_base64 in img_2_base64_list:
-                if img_base64:
-                    img_hash = hashlib.sha256(img_base64.encode()).hexdigest()
-                    
-                    if not self.imgs_col.find_one({"_id": img_hash}):
-                        self.imgs_col.insert_one({"_id": img_hash, "image_data": img_base64})
-                    
-                    img_2_hashes.append(img_hash)
+            img_2_hashes = [self.store_image(img_bytes) for img_bytes in img_2_list if img_bytes]
             
             # ✅ Generar hash y almacenar `img_1` (Imagen única de catálogo)
-            img_1_hash = hashlib.sha256(img_1_base64.encode()).hexdigest()
-            
-            if not self.imgs_col.find_one({"_id": img_1_hash}):
-                self.imgs_col.insert_one({"_id": img_1_hash, "image_data": img_1_base64})
+            img_1_hash = self.store_image(img_1)
             
             # ✅ Generar hash para `corte_lazer` y `forms`
             empty_dict_hash = hashlib.sha256(str({}).encode()).hexdigest()
@@ -266,6 +541,7 @@ class ProductManager:
             }
             
             result = self.prods_col.insert_one(new_product)
+            self.invalidate_catalogo()
             if result.inserted_id:
                 return {"success": True, "message": "Producto creado exitosamente", "product_id": str(result.inserted_id)}
             else:
@@ -292,19 +568,23 @@ class ProductManager:
             delete_result = self.prods_col.delete_one({"_id": ObjectId(product_id)})
             if delete_result.deleted_count == 0:
                 return {"success": False, "error": "No se pudo eliminar el producto"}
+            self.invalidate_catalogo()
 
             # ✅ Check if images are used by other products before deleting
-            if img_1_hash and self.prods_col.count_documents({"img_hashes.img_1": img_1_hash}) == 0:
-                self.imgs_col.delete_one({"_id": img_1_hash})
+            for img_hash in img_1_hash or []:
+                if self.prods_col.count_documents({"img_hashes.img_1": img_hash}) == 0:
+                    self.delete_image(img_hash)
             if img_2_hash and self.prods_col.count_documents({"img_hashes.img_2": img_2_hash}) == 0:
-                self.imgs_col.delete_one({"_id": img_2_hash})
+                self.delete_image(img_2_hash)
 
             # ✅ Check if forms and corte_lazer are used elsewhere before deleting
             if forms_hash and self.prods_col.count_documents({"forms_hash": forms_hash}) == 0:
                 self.forms_col.delete_one({"_id": forms_hash})
+                content_cache.pop(self.forms_col, forms_hash)
 
             if corte_lazer_hash and self.prods_col.count_documents({"corte_lazer_hash": corte_lazer_hash}) == 0:
                 self.corte_lazer_col.delete_one({"_id": corte_lazer_hash})
+                content_cache.pop(self.corte_lazer_col, corte_lazer_hash)
 
             return {"success": True, "message": "Producto eliminado correctamente"}
 
@@ -0,0 +1,209 @@
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from DataManagers.Database import get_database
+
+# Colecciones que deben existir antes de usarse dentro de una transacción (MongoDB < 4.4 no las crea ahí)
+COLECCIONES = ["carts", "orders", "cache_versions"]
+
+# Índices que necesitan las consultas de los managers: (colección, claves, opciones)
+INDICES = [
+    # UserManager: inicio de sesión, registro y verificación por email; listados y búsqueda de clientes y administradores
+    ("usuarios", [("email", ASCENDING)], {"unique": True}),
+    ("usuarios", [("access", ASCENDING)], {}),
+    ("usuarios", [("access", ASCENDING), ("search_keys", ASCENDING)], {}),
+
+    # ProductManager: catálogo ordenado y comprobaciones de uso al eliminar un producto (img_1 es una lista: multikey)
+    ("prods", [("sort_order", ASCENDING)], {}),
+    ("prods", [("img_hashes.img_1", ASCENDING)], {}),
+    ("prods", [("img_hashes.img_2", ASCENDING)], {}),
+    ("prods", [("forms_hash", ASCENDING)], {}),
+    ("prods", [("corte_lazer_hash", ASCENDING)], {}),
+    ("imgs_variants", [("source", ASCENDING)], {}),
+
+    # PedidosManager y CarritoManager: listados por cliente, por estado y por fecha; una orden por token de compra
+    ("orders", [("client_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], {}),
+    ("orders", [("estado", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], {}),
+    ("orders", [("timestamp", DESCENDING), ("_id", DESCENDING)], {}),
+    ("orders", [("client_id", ASCENDING), ("idempotency_key", ASCENDING)],
+     {"unique": True, "partialFilterExpression": {"idempotency_key": {"$exists": True}}}),
+    ("orders", [("stats_aplicadas", ASCENDING)], {"partialFilterExpression": {"stats_aplicadas": False}}),
+
+    # Estadísticas, Excel ya generados y cola de trabajos
+    ("stats", [("generacion", ASCENDING), ("tipo", ASCENDING), ("fecha", ASCENDING)], {}),
+    ("stats", [("generacion", ASCENDING), ("tipo", ASCENDING), ("pedidos", ASCENDING)], {}),
+    ("stats", [("generacion", ASCENDING), ("tipo", ASCENDING), ("urnas", ASCENDING)], {}),
+    ("stats_pendientes", [("generacion", ASCENDING), ("_id", ASCENDING)], {}),
+    ("excel_cache", [("pedido_id", ASCENDING)], {}),
+    ("excel_cache", [("accessed_at", ASCENDING)], {}),
+    ("jobs", [("estado", ASCENDING), ("created_at", ASCENDING)], {}),
+    ("jobs", [("expires_at", ASCENDING)], {}),
+
+    # Bandeja de salida de correos: siguientes a enviar y borrado automático (TTL) de los ya enviados o fallidos
+    ("email_outbox", [("estado", ASCENDING), ("next_attempt_at", ASCENDING)], {}),
+    ("email_outbox", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+]
+
+# Consultas de los managers que deben resolverse con un índice: (descripción, colección, filtro, orden)
+CONSULTAS = [
+    ("UserManager.authenticate_user", "usuarios", {"email": "cliente@example.com", "contraseña": "x"}, None),
+    ("UserManager.get_clients", "usuarios", {"access": "cliente"}, None),
+    ("UserManager.search_clients", "usuarios", {"access": "cliente", "search_keys": {"$regex": "^ana"}}, None),
+    ("ProductManager.get_catalogo", "prods", {}, [("sort_order", ASCENDING)]),
+    ("ProductManager.update_sort_order", "prods", {"sort_order": {"$lt": 1}}, [("sort_order", DESCENDING)]),
+    ("ProductManager.delete_product (img_1)", "prods", {"img_hashes.img_1": "hash"}, None),
+    ("ProductManager.delete_product (img_2)", "prods", {"img_hashes.img_2": "hash"}, None),
+    ("ProductManager.delete_product (forms)", "prods", {"forms_hash": "hash"}, None),
+    ("ProductManager.delete_product (corte_lazer)", "prods", {"corte_lazer_hash": "hash"}, None),
+    ("ProductManager.delete_image", "imgs_variants", {"source": "hash"}, None),
+    ("CarritoManager.finalizar_compra", "orders", {"client_id": "id", "idempotency_key": "token"}, None),
+    ("PedidosManager.get_pedidos_for_client", "orders", {"client_id": "id"}, [("timestamp", DESCENDING), ("_id", DESCENDING)]),
+    ("PedidosManager.get_pedidos", "orders", {}, [("timestamp", DESCENDING), ("_id", DESCENDING)]),
+    ("PedidosManager.get_pedidos (estado)", "orders", {"estado": "Enviado"}, [("timestamp", DESCENDING), ("_id", DESCENDING)]),
+    ("PedidosManager.get_pedidos (fechas)", "orders", {"timestamp": {"$gte": datetime(2024, 1, 1)}}, [("timestamp", DESCENDING), ("_id", DESCENDING)]),
+    ("StatsRollup.get_dias", "stats", {"generacion": 1, "tipo": "dia", "fecha": {"$gte": "2024-01-01"}}, [("fecha", ASCENDING)]),
+    ("StatsRollup.get_clientes", "stats", {"generacion": 1, "tipo": "cliente", "pedidos": {"$gt": 0}}, [("pedidos", DESCENDING)]),
+    ("StatsRollup.get_productos", "stats", {"generacion": 1, "tipo": "producto", "urnas": {"$gt": 0}}, [("urnas", DESCENDING)]),
+    ("StatsRollup.get_estados", "stats", {"generacion": 1, "tipo": "estado"}, None),
+    ("StatsRollup.registrar_pendientes", "orders", {"stats_aplicadas": False}, None),
+    ("PedidosManager.delete_pedido (excel_cache)", "excel_cache", {"pedido_id": "id"}, None),
+    ("PedidosManager.evict_excel_cache", "excel_cache", {}, [("accessed_at", ASCENDING)]),
+    ("JobManager.tomar_siguiente", "jobs", {"estado": "pendiente"}, [("created_at", ASCENDING)]),
+    ("JobManager.purgar_expirados", "jobs", {"expires_at": {"$lt": datetime(2024, 1, 1)}}, None),
+    ("MailOutbox.claim_batch", "email_outbox", {"estado": "pendiente", "next_attempt_at": {"$lte": datetime(2024, 1, 1)}},
+     [("next_attempt_at", ASCENDING)]),
+]
+
+
+class SchemaManager:
+    def __init__(self, database=None):
+        """
+        Colecciones, índices y migraciones de datos de la aplicación.
+        Los índices se declaran en INDICES y se crean de forma idempotente; las migraciones se registran con
+        register_migration y se aplican una sola vez, en orden, guardando cuáles ya se aplicaron en 'schema_migrations'.
+        """
+        self.database = database or get_database()
+        self.migraciones = []  # (versión, descripción, función)
+
+    @property
+    def db(self):
+        """Base de datos del proceso actual (ver DataManagers.Database)."""
+        return self.database.db
+
+    @property
+    def migrations_col(self):
+        return self.db["schema_migrations"]
+
+    def register_migration(self, version, descripcion, funcion):
+        """Registra una migración de datos. Se aplican por orden de versión; 'funcion' no recibe argumentos."""
+        self.migraciones.append((version, descripcion, funcion))
+        self.migraciones.sort(key=lambda migracion: migracion[0])
+
+    def ensure_schema(self):
+        """Crea las colecciones e índices que falten. Devuelve una línea de resultado por índice."""
+        existentes = set(self.db.list_collection_names())
+        for coleccion in COLECCIONES:
+            if coleccion not in existentes:
+                self.db.create_collection(coleccion)
+
+        resultados = []
+        for coleccion, claves, opciones in INDICES:
+            try:
+                nombre = self.db[coleccion].create_index(claves, **opciones)
+                resultados.append({"coleccion": coleccion, "indice": nombre, "estado": "ok"})
+            except OperationFailure as e:
+                # Por ejemplo, emails duplicados que impiden crear el índice único
+                resultados.append({"coleccion": coleccion, "indice": self.nombre_indice(claves), "estado": "error", "error": str(e)})
+        return resultados
+
+    def index_status(self):
+        """Compara los índices declarados con los que existen en la BD."""
+        informacion = {}
+        estado = []
+        for coleccion, claves, opciones in INDICES:
+            if coleccion not in informacion:
+                informacion[coleccion] = self.db[coleccion].index_information()
+
+            existente = next((info for info in informacion[coleccion].values() if list(info["key"]) == list(claves)), None)
+            if existente is None:
+                resultado = "falta"
+            elif any(existente.get(opcion) != valor for opcion, valor in opciones.items()):
+                resultado = "distinto"  # Mismas claves pero sin 'unique' o con otro filtro parcial
+            else:
+                resultado = "ok"
+            estado.append({"coleccion": coleccion, "indice": self.nombre_indice(claves), "estado": resultado})
+        return estado
+
+    def migration_status(self):
+        """Devuelve cada migración registrada con la fecha en que se aplicó (None si está pendiente)."""
+        aplicadas = {doc["_id"]: doc for doc in self.migrations_col.find({})}
+        return [
+            {"version": version, "descripcion": descripcion, "applied_at": aplicadas.get(version, {}).get("applied_at")}
+            for version, descripcion, _ in self.migraciones
+        ]
+
+    def migrate(self, dry_run=False):
+        """Crea colecciones e índices y aplica, en orden, las migraciones pendientes. Se detiene en la primera que falle."""
+        resultado = {"indices": [] if dry_run else self.ensure_schema(), "migraciones": []}
+
+        for migracion in self.migration_status():
+            if migracion["applied_at"] is not None:
+                continue
+            if dry_run:
+                resultado["migraciones"].append({**migracion, "estado": "pendiente"})
+                continue
+
+            funcion = next(funcion for version, _, funcion in self.migraciones if version == migracion["version"])
+            try:
+                salida = funcion()
+            except Exception as e:
+                resultado["migraciones"].append({**migracion, "estado": "error", "error": str(e)})
+                break
+            if isinstance(salida, dict) and salida.get("success") is False:
+                resultado["migraciones"].append({**migracion, "estado": "error", "error": salida.get("error")})
+                break
+
+            self.migrations_col.insert_one({
+                "_id": migracion["version"],
+                "descripcion": migracion["descripcion"],
+                "applied_at": datetime.now(),
+                "resultado": salida,
+            })
+            resultado["migraciones"].append({**migracion, "estado": "aplicada", "resultado": salida})
+
+        return resultado
+
+    def explain_queries(self):
+        """
+        Ejecuta explain() sobre las consultas de los managers (CONSULTAS) e indica cuáles recorren toda la colección
+        (COLLSCAN) y cuáles ordenan en memoria (SORT) en lugar de usar un índice.
+        """
+        resultados = []
+        for descripcion, coleccion, filtro, orden in CONSULTAS:
+            cursor = self.db[coleccion].find(filtro)
+            if orden:
+                cursor = cursor.sort(orden)
+            plan = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+            etapas = self.etapas_plan(plan)
+            resultados.append({
+                "consulta": descripcion,
+                "coleccion": coleccion,
+                "etapas": etapas,
+                "collscan": "COLLSCAN" in etapas,
+                "sort_en_memoria": "SORT" in etapas,
+            })
+        return resultados
+
+    def etapas_plan(self, plan):
+        """Lista las etapas ('stage') de un plan de ejecución, incluidas las de sus planes hijos."""
+        # Desde MongoDB 5.0 el plan puede venir dentro de 'queryPlan' (motor de ejecución SBE)
+        plan = plan.get("queryPlan", plan)
+        etapas = [plan["stage"]] if "stage" in plan else []
+        for hijo in [plan.get("inputStage")] + plan.get("inputStages", []):
+            if hijo:
+                etapas.extend(self.etapas_plan(hijo))
+        return etapas
+
+    def nombre_indice(self, claves):
+        """Nombre que MongoDB da por defecto a un índice con estas claves."""
+        return "_".join(f"{campo}_{direccion}" for campo, direccion in claves)
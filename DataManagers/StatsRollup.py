@@ -0,0 +1,296 @@
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pymongo import UpdateOne, DESCENDING
+
+# Campos de un pedido que se usan para calcular sus estadísticas
+PROYECCION_PEDIDO = {"client_id": 1, "timestamp": 1, "estado": 1, "total_urnas": 1, "stats_aplicadas": 1,
+                     "productos.modelo": 1, "productos.forms_lleno.Cantidad": 1}
+
+# Segundos que rebuild espera después de cambiar el estado de la reconstrucción, para que terminen las escrituras
+# que lo leyeron antes del cambio (cada una es una lectura y un bulk_write, de pocos milisegundos)
+ESPERA_ESCRITORES = 5
+
+# Una reconstrucción que no terminó en este tiempo se da por abandonada y otra puede ocupar su lugar
+MAX_RECONSTRUCCION = timedelta(hours=1)
+
+
+class StatsRollup:
+    def __init__(self, database):
+        """
+        Estadísticas de pedidos precalculadas en la colección 'stats'. Se actualizan con $inc al crear,
+        eliminar o cambiar de estado un pedido, así que leerlas no depende del número de pedidos.
+        Documentos: 'dia:<YYYY-MM-DD>', 'cliente:<client_id>', 'producto:<modelo>' y 'estado:<estado>',
+        con el prefijo de su generación ('<generacion>:dia:...'). Solo se lee la generación activa
+        ({_id: "stats"} en 'cache_versions'); rebuild construye la siguiente y la activa al terminar.
+        'database' es la conexión compartida (DataManagers.Database).
+        """
+        self.database = database
+
+    @property
+    def db(self):
+        return self.database.db
+
+    @property
+    def stats_col(self):
+        return self.db["stats"]
+
+    @property
+    def pendientes_col(self):
+        return self.db["stats_pendientes"]
+
+    @property
+    def cache_versions_col(self):
+        return self.db["cache_versions"]
+
+    def version(self):
+        """Versión actual de los pedidos; cambia con cada pedido creado, eliminado o cambiado de estado."""
+        doc = self.cache_versions_col.find_one({"_id": "pedidos"}, {"version": 1})
+        return doc["version"] if doc else 0
+
+    def incrementar_version(self, session=None):
+        """Invalida en todos los workers lo que se haya cacheado a partir de los pedidos."""
+        self.cache_versions_col.update_one({"_id": "pedidos"}, {"$inc": {"version": 1}}, upsert=True, session=session)
+
+    def estado(self):
+        """Generación activa de las estadísticas y, si hay una reconstrucción en curso, la que se está construyendo."""
+        return self.cache_versions_col.find_one({"_id": "stats"}) or {"generacion": 0, "reconstruyendo": None}
+
+    def generacion(self):
+        return self.estado().get("generacion", 0)
+
+    def operacion(self, generacion, clave, incrementos, campos):
+        """$inc sobre el documento 'clave' de una generación (se crea si no existe)."""
+        return UpdateOne(
+            {"_id": f"{generacion}:{clave}"},
+            {"$inc": incrementos, "$set": {"generacion": generacion, **campos}},
+            upsert=True
+        )
+
+    def operaciones_pedido(self, pedido, signo=1, generacion=0):
+        """Devuelve los $inc que suman (signo=1) o restan (signo=-1) un pedido de las estadísticas de una generación."""
+        fecha = self.fecha_pedido(pedido)
+        urnas_por_producto = defaultdict(int)
+        for producto in pedido.get("productos", []):
+            urnas_por_producto[producto.get("modelo", "Modelo Desconocido")] += self.cantidad(producto)
+
+        operaciones = [
+            self.operacion(generacion, f"cliente:{pedido.get('client_id')}",
+                           {"pedidos": signo, "urnas": signo * pedido.get("total_urnas", 0)},
+                           {"tipo": "cliente", "client_id": pedido.get("client_id")}),
+            self.operacion(generacion, f"estado:{pedido.get('estado')}",
+                           {"pedidos": signo}, {"tipo": "estado", "estado": pedido.get("estado")}),
+        ]
+        if fecha:
+            operaciones.append(self.operacion(generacion, f"dia:{fecha}", {"pedidos": signo}, {"tipo": "dia", "fecha": fecha}))
+        for modelo, urnas in urnas_por_producto.items():
+            operaciones.append(self.operacion(generacion, f"producto:{modelo}", {"urnas": signo * urnas},
+                                              {"tipo": "producto", "producto": modelo}))
+        return operaciones
+
+    def operaciones_estado(self, estado_anterior, estado_nuevo, generacion=0):
+        """Devuelve los $inc que mueven un pedido de un estado a otro."""
+        return [
+            self.operacion(generacion, f"estado:{estado_anterior}", {"pedidos": -1}, {"tipo": "estado", "estado": estado_anterior}),
+            self.operacion(generacion, f"estado:{estado_nuevo}", {"pedidos": 1}, {"tipo": "estado", "estado": estado_nuevo}),
+        ]
+
+    def aplicar(self, evento):
+        """
+        Aplica un evento ('registrar', 'eliminar' o 'estado') a la generación activa. Si se está construyendo otra,
+        lo anota también en 'stats_pendientes' para que rebuild lo repita en ella si su lectura no lo incluye.
+        """
+        estado = self.estado()
+        generacion = estado.get("generacion", 0)
+        self.stats_col.bulk_write(self.operaciones_evento(evento, generacion), ordered=False)
+
+        nueva = estado.get("reconstruyendo")
+        if nueva is not None and nueva != generacion:
+            self.pendientes_col.insert_one({"generacion": nueva, **evento})
+
+    def operaciones_evento(self, evento, generacion):
+        if evento["evento"] == "estado":
+            return self.operaciones_estado(evento["anterior"], evento["nuevo"], generacion)
+        signo = 1 if evento["evento"] == "registrar" else -1
+        return self.operaciones_pedido(evento["pedido"], signo, generacion)
+
+    def registrar_pedido(self, pedido_id):
+        """
+        Suma un pedido nuevo a las estadísticas, después de confirmar la transacción del checkout: dentro de ella, los
+        $inc sobre documentos compartidos ('estado:Enviado', 'dia:<hoy>') harían chocar a los checkouts simultáneos.
+        El pedido se crea con stats_aplicadas=False y aquí se marca antes de sumarlo, así que llamarlo de nuevo
+        (un reintento del checkout, registrar_pendientes) no lo cuenta dos veces. Devuelve True si lo sumó.
+        """
+        pedido = self.db.orders.find_one_and_update(
+            {"_id": pedido_id, "stats_aplicadas": False}, {"$set": {"stats_aplicadas": True}}, projection=PROYECCION_PEDIDO
+        )
+        if not pedido:
+            return False
+        self.aplicar({"evento": "registrar", "orden": pedido["_id"], "pedido": pedido})
+        return True
+
+    def registrar_pendientes(self):
+        """Suma los pedidos cuyo checkout se interrumpió entre la transacción y registrar_pedido."""
+        return sum(self.registrar_pedido(pedido["_id"]) for pedido in self.db.orders.find({"stats_aplicadas": False}, {"_id": 1}))
+
+    def eliminar_pedido(self, pedido):
+        """Resta un pedido eliminado (con los campos de PROYECCION_PEDIDO) de las estadísticas."""
+        if pedido.get("stats_aplicadas") is False:
+            return  # Nunca se sumó; registrar_pedido ya no lo encontrará
+        self.aplicar({"evento": "eliminar", "orden": pedido["_id"], "pedido": pedido})
+        self.incrementar_version()
+
+    def cambiar_estado(self, pedido, estado_nuevo):
+        """Mueve un pedido (con su estado anterior) a 'estado_nuevo' en los conteos por estado."""
+        if pedido.get("stats_aplicadas") is False:
+            return  # registrar_pedido lo sumará con el estado nuevo
+        self.aplicar({"evento": "estado", "orden": pedido["_id"], "anterior": pedido["estado"], "nuevo": estado_nuevo})
+        self.incrementar_version()
+
+    def rebuild(self, batch_size=500, espera=ESPERA_ESCRITORES):
+        """
+        Recalcula todas las estadísticas desde 'orders' sin transacción ni bloqueos, con la aplicación en marcha:
+        1. Reserva la generación siguiente; desde ahí, cada $inc se anota además en 'stats_pendientes'.
+        2. Lee los pedidos con una sesión 'snapshot' (todos tal como estaban en un mismo instante) y escribe la
+           nueva generación, que nadie lee todavía.
+        3. Repite en ella los eventos anotados que la lectura no incluye (se comprueba cada pedido en la misma
+           sesión), la activa y, tras la espera, repite los que llegaron mientras tanto.
+        4. Borra la generación anterior.
+        Si falla, la generación activa no cambia. La lectura snapshot debe terminar dentro de la ventana de historial
+        del servidor (minSnapshotHistoryWindowInSeconds, 300 s por defecto).
+        """
+        self.registrar_pendientes()
+
+        # 1. Reservar la generación siguiente (solo una reconstrucción a la vez)
+        self.cache_versions_col.update_one(
+            {"_id": "stats"}, {"$setOnInsert": {"generacion": 0, "reconstruyendo": None}}, upsert=True
+        )
+        actual = self.generacion()
+        nueva = actual + 1
+        reservada = self.cache_versions_col.update_one(
+            {"_id": "stats", "generacion": actual,
+             "$or": [{"reconstruyendo": None}, {"reconstruyendo_desde": {"$lt": datetime.now() - MAX_RECONSTRUCCION}}]},
+            {"$set": {"reconstruyendo": nueva, "reconstruyendo_desde": datetime.now()}}
+        )
+        if reservada.modified_count == 0:
+            return {"success": False, "error": "Ya hay otra reconstrucción de las estadísticas en curso."}
+
+        # Restos de una reconstrucción abandonada de la misma generación
+        self.stats_col.delete_many({"generacion": nueva})
+        time.sleep(espera)
+
+        with self.database.client.start_session(snapshot=True) as session:
+            # 2. Agregar los pedidos de la instantánea
+            dias = defaultdict(int)
+            clientes = defaultdict(lambda: {"pedidos": 0, "urnas": 0})
+            productos = defaultdict(int)
+            estados = defaultdict(int)
+
+            total_pedidos = 0
+            pedidos = self.db.orders.find({"stats_aplicadas": {"$ne": False}}, PROYECCION_PEDIDO, session=session)
+            for pedido in pedidos.batch_size(batch_size):
+                total_pedidos += 1
+                fecha = self.fecha_pedido(pedido)
+                if fecha:
+                    dias[fecha] += 1
+                clientes[pedido.get("client_id")]["pedidos"] += 1
+                clientes[pedido.get("client_id")]["urnas"] += pedido.get("total_urnas", 0)
+                estados[pedido.get("estado")] += 1
+                for producto in pedido.get("productos", []):
+                    productos[producto.get("modelo", "Modelo Desconocido")] += self.cantidad(producto)
+
+            documentos = (
+                [{"_id": f"{nueva}:dia:{fecha}", "tipo": "dia", "fecha": fecha, "pedidos": n} for fecha, n in dias.items()]
+                + [{"_id": f"{nueva}:cliente:{cid}", "tipo": "cliente", "client_id": cid, **totales} for cid, totales in clientes.items()]
+                + [{"_id": f"{nueva}:producto:{modelo}", "tipo": "producto", "producto": modelo, "urnas": n} for modelo, n in productos.items()]
+                + [{"_id": f"{nueva}:estado:{estado}", "tipo": "estado", "estado": estado, "pedidos": n} for estado, n in estados.items()]
+            )
+            for doc in documentos:
+                doc["generacion"] = nueva
+            if documentos:
+                self.stats_col.insert_many(documentos, ordered=False)
+
+            # 3. Repetir los eventos anotados, activar la generación nueva y repetir los que llegaron antes del cambio
+            pedidos_leidos = {}
+            repetidos = self.repetir_pendientes(nueva, session, pedidos_leidos)
+            self.cache_versions_col.update_one({"_id": "stats"}, {"$set": {"generacion": nueva}})
+            self.incrementar_version()
+            time.sleep(espera)
+            repetidos += self.repetir_pendientes(nueva, session, pedidos_leidos)
+
+        # 4. Terminar la reconstrucción y borrar lo anterior
+        self.cache_versions_col.update_one({"_id": "stats"}, {"$set": {"reconstruyendo": None}})
+        self.stats_col.delete_many({"generacion": {"$ne": nueva}})
+        self.pendientes_col.delete_many({"generacion": {"$lte": nueva}})
+        self.incrementar_version()
+        return {"success": True, "pedidos": total_pedidos, "documentos": len(documentos), "repetidos": repetidos, "generacion": nueva}
+
+    def repetir_pendientes(self, generacion, session, pedidos_leidos):
+        """
+        Aplica a 'generacion' los eventos anotados durante su reconstrucción que la lectura snapshot no incluye.
+        'pedidos_leidos' guarda, por pedido, si la generación lo cuenta y con qué estado: se parte de la instantánea
+        (leída con 'session') y se avanza con cada evento aplicado, en el orden en que se anotaron.
+        """
+        aplicados = []
+        operaciones = []
+        for evento in self.pendientes_col.find({"generacion": generacion}).sort("_id", 1):
+            aplicados.append(evento["_id"])
+            orden = evento["orden"]
+            if orden not in pedidos_leidos:
+                pedido = self.db.orders.find_one({"_id": orden}, {"estado": 1, "stats_aplicadas": 1}, session=session)
+                contado = pedido is not None and pedido.get("stats_aplicadas") is not False
+                pedidos_leidos[orden] = {"contado": contado, "estado": pedido.get("estado") if pedido else None}
+            leido = pedidos_leidos[orden]
+
+            if evento["evento"] == "registrar" and not leido["contado"]:
+                leido.update(contado=True, estado=evento["pedido"].get("estado"))
+            elif evento["evento"] == "eliminar" and leido["contado"]:
+                leido.update(contado=False, estado=None)
+            elif evento["evento"] == "estado" and leido["contado"] and leido["estado"] == evento["anterior"]:
+                leido["estado"] = evento["nuevo"]
+            else:
+                continue  # La instantánea ya lo incluye
+            operaciones.extend(self.operaciones_evento(evento, generacion))
+
+        if operaciones:
+            self.stats_col.bulk_write(operaciones, ordered=False)
+        if aplicados:
+            self.pendientes_col.delete_many({"_id": {"$in": aplicados}})
+        return len(aplicados)
+
+    def get_clientes(self):
+        """Pedidos y urnas por cliente, de más a menos pedidos."""
+        return list(self.stats_col.find({"generacion": self.generacion(), "tipo": "cliente", "pedidos": {"$gt": 0}}, {"_id": 0, "generacion": 0}).sort("pedidos", DESCENDING))
+
+    def get_cliente(self, client_id):
+        """Pedidos y urnas de un cliente."""
+        doc = self.stats_col.find_one({"_id": f"{self.generacion()}:cliente:{client_id}"}, {"_id": 0, "pedidos": 1, "urnas": 1})
+        return doc or {"pedidos": 0, "urnas": 0}
+
+    def get_dias(self, fecha_desde):
+        """Pedidos por día desde 'fecha_desde' ("%Y-%m-%d"), en orden cronológico."""
+        return list(self.stats_col.find({"generacion": self.generacion(), "tipo": "dia", "fecha": {"$gte": fecha_desde}, "pedidos": {"$gt": 0}}, {"_id": 0, "generacion": 0}).sort("fecha", 1))
+
+    def get_productos(self):
+        """Urnas vendidas por producto, de más a menos vendidas."""
+        return list(self.stats_col.find({"generacion": self.generacion(), "tipo": "producto", "urnas": {"$gt": 0}}, {"_id": 0, "generacion": 0}).sort("urnas", DESCENDING))
+
+    def get_estados(self):
+        """Número de pedidos en cada estado."""
+        return {doc["estado"]: doc["pedidos"] for doc in self.stats_col.find({"generacion": self.generacion(), "tipo": "estado"}, {"_id": 0, "generacion": 0})}
+
+    def fecha_pedido(self, pedido):
+        """Día ("%Y-%m-%d") en que se hizo un pedido; acepta fechas BSON y el formato de texto antiguo."""
+        timestamp = pedido.get("timestamp")
+        if isinstance(timestamp, datetime):
+            return timestamp.strftime("%Y-%m-%d")
+        if isinstance(timestamp, str) and len(timestamp) >= 10:
+            return timestamp[:10]
+        return None
+
+    def cantidad(self, producto):
+        """Cantidad de urnas de un producto del pedido (0 si no es un número válido)."""
+        try:
+            return int(producto.get("forms_lleno", {}).get("Cantidad", 0))
+        except (TypeError, ValueError):
+            return 0
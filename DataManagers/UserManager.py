@@ -1,28 +1,33 @@
-import os
-import pymongo
 import re
 import zlib
 import hashlib
-from dotenv import load_dotenv
 import json
 import random
-from DataManagers.MailSender import MailSender
+from DataManagers.MailOutbox import MailOutbox
+from DataManagers.Database import get_database
 from bson.objectid import ObjectId
+from pymongo import UpdateOne
 import base64
 
+# Máximo de clientes que devuelve la búsqueda del filtro de pedidos
+CLIENT_SEARCH_LIMIT = 20
+
 class UserManager():
-    def __init__(self):
-        """Inicializa la conexión con la base de datos."""
-        load_dotenv()
-        MONGO_URI = os.getenv("MONGO_URI")
-        DATABASE_NAME = os.getenv("DATABASE_NAME")
+    def __init__(self, database=None, mail_outbox=None):
+        """Usa la conexión compartida con la base de datos y la bandeja de salida de correos."""
+        self.database = database or get_database()
+        self.mail_outbox = mail_outbox or MailOutbox(self.database)
+
+    @property
+    def db(self):
+        """Base de datos del proceso actual (ver DataManagers.Database)."""
+        return self.database.db
+
+    @property
+    def users_col(self):
+        return self.db["usuarios"]
 
-        self.client = pymongo.MongoClient(MONGO_URI)
-        self.db = self.client[DATABASE_NAME]
 
-        # Definir colección
-        self.users_col = self.db["usuarios"]
-        
     def get_user(self, email):
         """Recupera un usuario por su correo electrónico."""
         user = self.users_col.find_one({"email": email}, {"_id": 0, "client_name": 1, "email": 1, "access": 1})
@@ -33,6 +38,52 @@ class UserManager():
         clients = list(self.users_col.find({"access": "cliente"}, {"_id": 1, "client_name": 1, "email": 1, "phone": 1}))
         return clients
     
+    def search_clients(self, texto, limit=CLIENT_SEARCH_LIMIT):
+        """
+        Busca clientes cuyo nombre o email empiece por 'texto' (como mucho 'limit', para el autocompletado).
+        Compara con 'search_keys' (nombre y email en minúsculas) con un prefijo sensible a mayúsculas, que el índice
+        (access, search_keys) resuelve recorriendo solo las claves con ese prefijo.
+        """
+        texto = (texto or "").strip().lower()
+        if not texto:
+            return []
+
+        clients = self.users_col.find(
+            {"access": "cliente", "search_keys": {"$regex": "^" + re.escape(texto)}},
+            {"_id": 1, "client_name": 1, "email": 1}
+        ).limit(limit)
+        clients = [{"_id": str(client["_id"]), "client_name": client.get("client_name", ""), "email": client.get("email", "")}
+                   for client in clients]
+        return sorted(clients, key=lambda client: client["client_name"].lower())
+
+    def search_keys(self, user):
+        """Nombre y email en minúsculas, para buscar clientes por prefijo."""
+        return sorted({valor.strip().lower() for valor in (user.get("client_name"), user.get("email")) if valor})
+
+    def migrate_search_keys(self, batch_size=500):
+        """Guarda 'search_keys' en los usuarios creados antes de que existiera."""
+        migrated = 0
+        operations = []
+
+        for user in self.users_col.find({"search_keys": {"$exists": False}}, {"client_name": 1, "email": 1}).batch_size(batch_size):
+            operations.append(UpdateOne({"_id": user["_id"]}, {"$set": {"search_keys": self.search_keys(user)}}))
+            if len(operations) >= batch_size:
+                migrated += self.users_col.bulk_write(operations, ordered=False).modified_count
+                operations = []
+
+        if operations:
+            migrated += self.users_col.bulk_write(operations, ordered=False).modified_count
+
+        return {"success": True, "migrated": migrated}
+
+    def get_client_name(self, client_id):
+        """Devuelve el nombre de un cliente por su ID, o None si no existe."""
+        try:
+            client = self.users_col.find_one({"_id": ObjectId(client_id)}, {"client_name": 1})
+        except Exception:
+            return None
+        return client.get("client_name") if client else None
+
     def get_admins(self):
         """Recupera todos los usuarios con acceso 'admin'."""
         admins = list(self.users_col.find({"access": "admin"}, {"_id": 1, "client_name": 1, "email": 1, "phone": 1}))
@@ -77,6 +128,9 @@ class UserManager():
         # Generar client_id como un hash del JSON del usuario
         user_data_json = json.dumps(user_data, sort_keys=True)
         user_data["client_id"] = hashlib.sha256(user_data_json.encode()).hexdigest()
+
+        # Claves para la búsqueda de clientes del filtro de pedidos
+        user_data["search_keys"] = self.search_keys(user_data)
         
         # Insertar usuario en la base de datos sin código de verificación ni contraseña
         result = self.users_col.insert_one(user_data)
@@ -86,9 +140,11 @@ class UserManager():
         """Genera y agrega un código de verificación para un usuario existente."""
         verification_code = self.generate_verification_code()
         result = self.users_col.update_one({"email": email}, {"$set": {"verification_code": verification_code}})
-        MailSender().send_email(email, verification_code)
         if result.matched_count == 0:
             return {"error": "Usuario no encontrado"}
+
+        # El correo se envía en segundo plano: la petición no espera al proveedor de correo
+        self.mail_outbox.send_verification_code(email, verification_code)
         return {"éxito": True, "mensaje": "Código de verificación agregado correctamente", "código_de_verificación": verification_code}
     
     def verify_code(self, email, code):
@@ -1,27 +1,48 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, make_response, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, session, flash, make_response, jsonify, send_file, Response, stream_with_context, g
 from DataManagers.UserManager import UserManager
-from DataManagers.ProductManager import ProductManager
+from DataManagers.ProductManager import ProductManager, IMAGE_VARIANTS
 from DataManagers.CarritoManager import CarritoManager
 from DataManagers.PedidosManager import PedidosManager
+from DataManagers.JobManager import JobManager
+from DataManagers.Database import Database
+from DataManagers.SchemaManager import SchemaManager
+from DataManagers import Metrics
 
+import io
 import os
 import json
+import time
+import hmac
+import logging
+import tempfile
+import uuid
+import importlib.util
+import click
 from collections import OrderedDict
 from dotenv import load_dotenv
 from datetime import timedelta
-import base64
 
 # Cargar variables de entorno
 load_dotenv()
 
+# Los mensajes de los managers (trabajos, correos, variantes de imágenes) salen por la salida de error del proceso
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "clave_secreta_por_defecto")  # Establecer una clave secreta para la gestión de sesiones
 
+# Una sola conexión a MongoDB por proceso, compartida por todos los managers. El MongoClient se crea con la
+# primera consulta y los managers no hacen consultas al crearse (las colecciones e índices los crea "flask setup-db").
+# El listener mide cada comando enviado a MongoDB para /metrics
+database = Database(event_listeners=[Metrics.MongoMetricsListener()])
+
 # Inicializar UserManager
-user_manager = UserManager()
-product_manager = ProductManager()
-carrito_manager = CarritoManager()
-pedidos_manager = PedidosManager()
+user_manager = UserManager(database)
+product_manager = ProductManager(database)
+carrito_manager = CarritoManager(database)
+pedidos_manager = PedidosManager(database)
+job_manager = JobManager(database)
+schema_manager = SchemaManager(database)
 
 ##################################################################################################################################
 ##################################################################################################################################
@@ -32,6 +53,28 @@ def make_session_permanent():
     app.permanent_session_lifetime = timedelta(hours=2)  # Keep session active for 2 hours
 
 
+@app.before_request
+def iniciar_medicion():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def registrar_duracion(response):
+    """Registra en /metrics lo que tardó la petición, por endpoint (la regla de la ruta, no la URL con sus IDs)."""
+    if "request_start" in g:
+        Metrics.observe_request(request.endpoint, request.method, response.status_code,
+                                time.perf_counter() - g.request_start)
+    return response
+
+
+@app.context_processor
+def inject_cart_count():
+    """Pone el número de productos del carrito a disposición de la barra de navegación del cliente."""
+    if session.get("access") != "cliente" or not session.get("user_id"):
+        return {}
+    return {"cart_count": carrito_manager.count_carrito_for_client(session["user_id"])}
+
+
 @app.route("/", methods=["GET", "POST"])
 def login():
     # Si el usuario ya está autenticado, redirigirlo según su rol
@@ -171,6 +214,42 @@ def set_password(email):
     
     return render_template("register/set_password.html", email=email)
 
+##################################################################################################################################
+# IMÁGENES
+##################################################################################################################################
+
+@app.route("/img/<img_hash>")
+@app.route("/img/<img_hash>/<variant>")
+def image(img_hash, variant="original"):
+    """Sirve una imagen (o una de sus variantes) por su hash SHA-256. El contenido nunca cambia, así que se cachea como inmutable."""
+    if "user" not in session:
+        return "Acceso no autorizado.", 403
+
+    if variant != "original" and variant not in IMAGE_VARIANTS:
+        return "Variante no encontrada", 404
+
+    # El hash identifica el contenido, por lo que sirve directamente como ETag
+    etag = f"{img_hash}-{variant}"
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, max-age=31536000, immutable"
+        return response
+
+    result = product_manager.get_image(img_hash, variant)
+    if result is None:
+        return "Imagen no encontrada", 404
+
+    response = make_response(result["data"])
+    response.mimetype = result["mimetype"]
+    response.set_etag(f"{img_hash}-{result['variant']}")
+    if result["variant"] == variant:
+        response.headers["Cache-Control"] = "private, max-age=31536000, immutable"
+    else:
+        # La variante todavía se está generando: no fijar la original en la caché del navegador
+        response.headers["Cache-Control"] = "private, max-age=60"
+    return response
+
 ##################################################################################################################################
 # CLIENTE
 ##################################################################################################################################
@@ -218,9 +297,7 @@ def add_to_cart():
         carrito_manager.set_prod_in_cart(user_id, product_id, form_data)
 
         # Get updated cart count
-        carrito_items = carrito_manager.get_carrito_for_client(user_id)
-        cart_count = len(carrito_items)
-
+        cart_count = carrito_manager.count_carrito_for_client(user_id)
 
         return jsonify({
             "success": True,
@@ -244,7 +321,10 @@ def carrito():
     # Retrieve detailed cart items, including model name and img_2 (Base64 image)
     cart_items = carrito_manager.get_product_details_from_cart(user_id)
 
-    return render_template("client/carrito.html", cart_items=cart_items)
+    # Token de idempotencia para el botón "Finalizar Compra" de esta vista del carrito
+    checkout_token = uuid.uuid4().hex
+
+    return render_template("client/carrito.html", cart_items=cart_items, checkout_token=checkout_token)
 
 
 @app.route("/remove_from_cart/<cart_item_id>", methods=["POST"])
@@ -252,7 +332,7 @@ def remove_from_cart(cart_item_id):
     if "user" not in session or session.get("access") != "cliente":
         return jsonify({"success": False, "error": "Acceso no autorizado."}), 403
 
-    result = carrito_manager.remove_from_cart(cart_item_id)
+    result = carrito_manager.remove_from_cart(session.get("user_id"), cart_item_id)
     return jsonify(result)
 
 
@@ -263,7 +343,10 @@ def finalizar_compra():
 
     user_id = session.get("user_id")
 
-    mensaje_codificado = carrito_manager.finalizar_compra(user_id)
+    # El carrito envía el mismo token en cada reintento para no duplicar el pedido
+    idempotency_key = request.headers.get("Idempotency-Key")
+
+    mensaje_codificado = carrito_manager.finalizar_compra(user_id, idempotency_key)
     if isinstance(mensaje_codificado, dict):
         return jsonify(mensaje_codificado)  # If there's an error, return it
 
@@ -280,8 +363,9 @@ def pedidos():
     user_id = session.get("user_id")
 
     pedidos = pedidos_manager.get_pedidos_for_client(user_id)
+    resumen = pedidos_manager.get_resumen_cliente(user_id)
 
-    return render_template("client/pedidos.html", pedidos = pedidos)
+    return render_template("client/pedidos.html", pedidos = pedidos, resumen = resumen)
 
 from bson import ObjectId
 from bson.errors import InvalidId
@@ -298,18 +382,29 @@ def descargar_pedido(pedido_id):
         return redirect(url_for("pedidos"))
 
     try:
-        excel_file = pedidos_manager.download_excel_cliente(pedido_id)
+        # El ETag cambia con la versión del pedido: si el navegador ya tiene esta versión, no se envía de nuevo
+        version = pedidos_manager.get_version_pedido(pedido_id)
+        etag = pedidos_manager.excel_etag(pedido_id, version, cliente=True)
+        if version is not None and request.if_none_match.contains(etag):
+            response = make_response("", 304)
+            response.set_etag(etag)
+            return response
+
+        excel = pedidos_manager.get_excel_pedido(pedido_id, version, cliente=True) if version is not None else None
 
-        if not excel_file:
+        if not excel:
             flash("No se pudo generar el archivo.", "danger")
             return redirect(url_for("pedidos"))
 
-        return send_file(
-            excel_file,
+        response = send_file(
+            io.BytesIO(excel["data"]),
             mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             as_attachment=True,
             download_name=f"pedido_{pedido_id}.xlsx"
         )
+        response.set_etag(excel["etag"])
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
     
     except InvalidId:
         flash("ID de pedido inválido.", "danger")
@@ -330,8 +425,68 @@ def admin_pedidos():
         flash("Acceso no autorizado.", "danger")
         return redirect(url_for("login"))
 
-    pedidos = pedidos_manager.get_pedidos()  # Obtener todos los pedidos
-    return render_template("admin/pedidos.html", pedidos=pedidos)
+    # Filtros y cursor de la página actual
+    filtros = {
+        "estado": request.args.get("estado") or None,
+        "client_id": request.args.get("client_id") or None,
+        "fecha_desde": request.args.get("desde") or None,
+        "fecha_hasta": request.args.get("hasta") or None,
+    }
+    pagina = pedidos_manager.get_pedidos(cursor=request.args.get("cursor"), **filtros)
+
+    # El filtro de cliente se completa con /admin_buscar_clientes; solo hace falta el nombre del cliente elegido
+    cliente_filtrado = user_manager.get_client_name(filtros["client_id"]) if filtros["client_id"] else None
+
+    return render_template(
+        "admin/pedidos.html",
+        pedidos=pagina["pedidos"],
+        next_cursor=pagina["next_cursor"],
+        cliente_filtrado=cliente_filtrado,
+        filtros=filtros,
+        filtros_url={k: v for k, v in request.args.items() if k != "cursor" and v}
+    )
+
+@app.route("/admin_buscar_clientes")
+def admin_buscar_clientes():
+    """Autocompletado del filtro de cliente: clientes cuyo nombre o email empieza por ?q=."""
+    if "user" not in session or session.get("access") != "admin":
+        return jsonify({"success": False, "error": "Acceso no autorizado"}), 403
+
+    return jsonify({"success": True, "clientes": user_manager.search_clients(request.args.get("q"))})
+
+@app.route("/admin_exportar_pedidos")
+def admin_exportar_pedidos():
+    """
+    Exporta a CSV una tabla (?formato=csv&tabla=pedidos|productos|cortes) de los pedidos filtrados por estado,
+    cliente y rango de fechas, enviándola por trozos. El Excel con las tres tablas se genera solo en segundo plano,
+    con el trabajo "exportar_pedidos" (POST /admin_jobs), para no ocupar un worker web mientras se escribe.
+    """
+    if "user" not in session or session.get("access") != "admin":
+        flash("Acceso no autorizado.", "danger")
+        return redirect(url_for("login"))
+
+    filtros = {
+        "estado": request.args.get("estado") or None,
+        "client_id": request.args.get("client_id") or None,
+        "fecha_desde": request.args.get("desde") or None,
+        "fecha_hasta": request.args.get("hasta") or None,
+    }
+    if request.args.get("formato") != "csv":
+        return "El Excel de varios pedidos se genera con el trabajo 'exportar_pedidos' (POST /admin_jobs)", 400
+
+    tabla = request.args.get("tabla", "productos")
+    if tabla not in ("pedidos", "productos", "cortes"):
+        return "Tabla no válida", 400
+
+    # El nombre del archivo sale de las fechas ya validadas, nunca del texto de la URL
+    nombre = pedidos_manager.nombre_exportacion(filtros["fecha_desde"], filtros["fecha_hasta"])
+
+    # El CSV se envía por trozos mientras se leen los pedidos
+    return Response(
+        stream_with_context(pedidos_manager.exportar_pedidos_csv(tabla=tabla, **filtros)),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{nombre}_{tabla}.csv"'}
+    )
 
 @app.route("/delete_pedido/<pedido_id>", methods=["POST"])
 def delete_pedido(pedido_id):
@@ -354,11 +509,24 @@ def download_excel(pedido_id):
         flash("Acceso no autorizado.", "danger")
         return redirect(url_for("login"))
 
-    output = pedidos_manager.download_excel(pedido_id)
-    if output is None:
+    # El ETag cambia con la versión del pedido: si el navegador ya tiene esta versión, no se envía de nuevo
+    version = pedidos_manager.get_version_pedido(pedido_id)
+    if version is None:
+        return "Pedido no encontrado", 404
+    etag = pedidos_manager.excel_etag(pedido_id, version)
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+        response.set_etag(etag)
+        return response
+
+    excel = pedidos_manager.get_excel_pedido(pedido_id, version)
+    if excel is None:
         return "Pedido no encontrado", 404
 
-    return send_file(output, download_name=f"pedido_{pedido_id}.xlsx", as_attachment=True, mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    response = send_file(io.BytesIO(excel["data"]), download_name=f"pedido_{pedido_id}.xlsx", as_attachment=True, mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    response.set_etag(excel["etag"])
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 
 @app.route("/admin_catalog")
@@ -369,6 +537,30 @@ def admin_catalog():
 
     products_with_images = product_manager.get_catalogo()
     return render_template("admin/catalog.html", products_with_images=products_with_images)
+@app.route("/admin_cache_stats")
+def admin_cache_stats():
+    """Devuelve las estadísticas de las cachés en memoria de este worker."""
+    if "user" not in session or session.get("access") != "admin":
+        return jsonify({"success": False, "error": "Acceso no autorizado"}), 403
+
+    return jsonify({"success": True, "pid": os.getpid(), "product_manager": product_manager.get_cache_stats()})
+
+@app.route("/metrics")
+def metrics():
+    """
+    Métricas en formato Prometheus (latencia por ruta, comandos de MongoDB, cachés, generación de informes),
+    sumadas entre todos los workers de gunicorn. Requiere sesión de administrador o, para el scraper de
+    Prometheus, la cabecera "Authorization: Bearer <METRICS_TOKEN>".
+    """
+    token = os.getenv("METRICS_TOKEN")
+    autorizacion = request.headers.get("Authorization", "")
+    token_valido = bool(token) and hmac.compare_digest(autorizacion.encode(), f"Bearer {token}".encode())
+    if not token_valido and ("user" not in session or session.get("access") != "admin"):
+        return jsonify({"success": False, "error": "Acceso no autorizado"}), 403
+
+    data, content_type = Metrics.export()
+    return Response(data, content_type=content_type)
+
 @app.route("/update_sort_order", methods=["POST"])
 def update_sort_order():
     if "user" not in session or session.get("access") != "admin":
@@ -402,12 +594,12 @@ def add_product():
         return jsonify({"success": False, "error": "Faltan parámetros. Debe incluir el nombre del modelo, al menos una imagen para forms y una imagen para catálogo."}), 400
 
     try:
-        # ✅ Encode Images as Base64
-        img_2_base64_list = [base64.b64encode(img.read()).decode("utf-8") for img in img_2_files]  # List of images
-        img_1_base64 = base64.b64encode(img_1_file.read()).decode("utf-8")  # Single image
+        # ✅ Read raw image bytes (stored as binary by `ProductManager`)
+        img_2_list = [img.read() for img in img_2_files]  # List of images
+        img_1 = img_1_file.read()  # Single image
 
         # ✅ Insert Product using `ProductManager`
-        result = product_manager.set_new_product(model_name, img_2_base64_list, img_1_base64)
+        result = product_manager.set_new_product(model_name, img_2_list, img_1)
         
         return jsonify(result)
 
@@ -580,15 +772,244 @@ def admin_dashboard():
         flash("Acceso no autorizado.", "danger")
         return redirect(url_for("login"))
 
-    grafico_clientes, grafico_pedidos_mes, grafico_productos = pedidos_manager.generar_graficos_pedidos()
+    # Los gráficos se piden a /admin_dashboard_data y se dibujan en el navegador
+    return render_template("admin/dashboard.html")
+
+
+@app.route("/admin_dashboard_data")
+def admin_dashboard_data():
+    """Devuelve en JSON los gráficos (especificaciones de Plotly) y los conteos por estado del dashboard."""
+    if "user" not in session or session.get("access") != "admin":
+        return jsonify({"success": False, "error": "Acceso no autorizado"}), 403
+
+    return jsonify({"success": True, **pedidos_manager.get_dashboard()})
+
+
+@app.route("/plotly.min.js")
+def plotly_js():
+    """Sirve el plotly.js incluido en el paquete de Python 'plotly', para no depender de un CDN."""
+    spec = importlib.util.find_spec("plotly")
+    plotly_js_path = os.path.join(spec.submodule_search_locations[0], "package_data", "plotly.min.js")
+    return send_file(plotly_js_path, mimetype="application/javascript", max_age=31536000)
+
+##################################################################################################################################
+# TRABAJOS EN SEGUNDO PLANO (los ejecuta "flask --app app jobs-worker")
+##################################################################################################################################
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def tarea_exportar_pedidos(**filtros):
+    """Exporta a Excel los pedidos filtrados (ver PedidosManager.exportar_pedidos_excel)."""
+    archivo = pedidos_manager.exportar_pedidos_excel(output=tempfile.TemporaryFile(), **filtros)
+    nombre = pedidos_manager.nombre_exportacion(filtros.get("fecha_desde"), filtros.get("fecha_hasta"))
+    return {"archivo": archivo, "filename": f"{nombre}.xlsx", "mimetype": XLSX_MIMETYPE}
+
+
+job_manager.register("exportar_pedidos", tarea_exportar_pedidos)
+job_manager.register("dashboard", pedidos_manager.get_dashboard)
+job_manager.register("rebuild_stats", pedidos_manager.rebuild_estadisticas)
+
+
+@app.route("/admin_jobs", methods=["POST"])
+def crear_job():
+    """Encola un trabajo {"tipo", "params"} y devuelve su id sin esperar a que termine."""
+    if "user" not in session or session.get("access") != "admin":
+        return jsonify({"success": False, "error": "Acceso no autorizado"}), 403
+
+    data = request.get_json(silent=True) or {}
+    result = job_manager.encolar(data.get("tipo"), data.get("params"), user=session.get("user"))
+    if not result["success"]:
+        return jsonify(result), 400
+
+    result["status_url"] = url_for("estado_job", job_id=result["job_id"])
+    return jsonify(result), 202
+
+
+@app.route("/admin_jobs/<job_id>")
+def estado_job(job_id):
+    """Devuelve el estado de un trabajo; cuando termina con un archivo, incluye la URL para descargarlo."""
+    if "user" not in session or session.get("access") != "admin":
+        return jsonify({"success": False, "error": "Acceso no autorizado"}), 403
+
+    job = job_manager.get_job(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Trabajo no encontrado"}), 404
+
+    if job["estado"] == "terminado" and job["archivo"]:
+        job["download_url"] = url_for("archivo_job", job_id=job_id)
+    return jsonify({"success": True, **job})
+
+
+@app.route("/admin_jobs/<job_id>", methods=["DELETE"])
+def cancelar_job(job_id):
+    """Cancela un trabajo pendiente (por ejemplo, cuando la página se cansa de esperar y descarga el archivo directamente)."""
+    if "user" not in session or session.get("access") != "admin":
+        return jsonify({"success": False, "error": "Acceso no autorizado"}), 403
+
+    if not job_manager.cancelar(job_id):
+        return jsonify({"success": False, "error": "El trabajo no existe o ya no está pendiente"}), 409
+    return jsonify({"success": True})
+
+
+@app.route("/admin_jobs/<job_id>/archivo")
+def archivo_job(job_id):
+    """Descarga el archivo generado por un trabajo terminado."""
+    if "user" not in session or session.get("access") != "admin":
+        flash("Acceso no autorizado.", "danger")
+        return redirect(url_for("login"))
+
+    archivo = job_manager.get_archivo(job_id)
+    if archivo is None:
+        return "Archivo no encontrado", 404
+
+    # Se envía desde GridFS por fragmentos, sin cargar el archivo entero en memoria
+    return send_file(archivo["stream"], download_name=archivo["filename"], as_attachment=True, mimetype=archivo["mimetype"])
+
+
+##################################################################################################################################
+# COMANDOS (flask --app app <comando>)
+##################################################################################################################################
+
+# Migraciones de datos, en orden de versión. "flask db-migrate" aplica una sola vez las que falten
+schema_manager.register_migration("0001", "Imágenes en binario/GridFS", product_manager.migrate_images_to_binary)
+schema_manager.register_migration("0002", "Carritos en un documento por cliente", carrito_manager.migrate_cart_to_single_document)
+schema_manager.register_migration("0003", "Fechas BSON en los pedidos", pedidos_manager.migrate_timestamps_to_dates)
+schema_manager.register_migration("0004", "Modelo y corte láser guardados en los pedidos", pedidos_manager.migrate_snapshot_productos)
+schema_manager.register_migration("0005", "Estadísticas precalculadas", pedidos_manager.rebuild_estadisticas)
+schema_manager.register_migration("0006", "Variantes WebP de las imágenes", product_manager.generate_all_image_variants)
+schema_manager.register_migration("0007", "Claves de búsqueda de los clientes", user_manager.migrate_search_keys)
+schema_manager.register_migration("0008", "Estadísticas por generación", pedidos_manager.rebuild_estadisticas)
+schema_manager.register_migration("0009", "Tamaño total de la caché de Excel", pedidos_manager.recalcular_tamano_excel_cache)
+
+
+@app.cli.command("mail-sender")
+@click.option("--once", is_flag=True, help="Envía los correos pendientes y termina.")
+def mail_sender(once):
+    """
+    Envía los correos de la bandeja de salida (para usarlo en lugar del hilo de cada worker: MAIL_SENDER_THREAD=false).
+    Para que sus métricas salgan en /metrics, ejecutarlo con el PROMETHEUS_MULTIPROC_DIR de gunicorn, como el worker del Procfile.
+    """
+    click.echo(f"Enviador de correos iniciado (pid {os.getpid()})")
+    result = user_manager.mail_outbox.run_sender(once=once)
+    click.echo(f"Correos enviados: {result['enviados']}, fallidos: {result['fallidos']}")
+
+
+@app.cli.command("setup-db")
+def setup_db():
+    """Crea las colecciones e índices que usa la aplicación (es idempotente)."""
+    for indice in schema_manager.ensure_schema():
+        click.echo(f"{indice['coleccion']}.{indice['indice']}: {indice['estado']} {indice.get('error', '')}")
+
+
+@app.cli.command("db-status")
+def db_status():
+    """Muestra qué índices faltan o son distintos y qué migraciones están pendientes."""
+    click.echo("Índices:")
+    for indice in schema_manager.index_status():
+        click.echo(f"  [{indice['estado']:>8}] {indice['coleccion']}.{indice['indice']}")
+
+    click.echo("Migraciones:")
+    for migracion in schema_manager.migration_status():
+        aplicada = migracion["applied_at"].strftime("%Y-%m-%d %H:%M:%S") if migracion["applied_at"] else "pendiente"
+        click.echo(f"  {migracion['version']} {migracion['descripcion']}: {aplicada}")
+
+
+@app.cli.command("db-migrate")
+@click.option("--dry-run", is_flag=True, help="Solo muestra las migraciones pendientes.")
+def db_migrate(dry_run):
+    """Crea colecciones e índices y aplica las migraciones pendientes (es idempotente; se ejecuta en cada despliegue)."""
+    result = schema_manager.migrate(dry_run=dry_run)
+    errores = [indice for indice in result["indices"] if indice["estado"] == "error"]
+    click.echo(f"Índices comprobados: {len(result['indices'])}, con error: {len(errores)}")
+    for indice in errores:
+        click.echo(f"  {indice['coleccion']}.{indice['indice']}: {indice['error']}")
+
+    for migracion in result["migraciones"]:
+        click.echo(f"  {migracion['version']} {migracion['descripcion']}: {migracion['estado']} {migracion.get('error', '')}")
+    if not result["migraciones"]:
+        click.echo("No hay migraciones pendientes")
+
+    if errores or any(migracion["estado"] == "error" for migracion in result["migraciones"]):
+        raise SystemExit(1)
+
+
+@app.cli.command("db-explain")
+def db_explain():
+    """Comprueba con explain() que las consultas de los managers usan un índice."""
+    sin_indice = 0
+    for consulta in schema_manager.explain_queries():
+        if consulta["collscan"]:
+            estado = "COLLSCAN"
+            sin_indice += 1
+        else:
+            estado = "SORT" if consulta["sort_en_memoria"] else "ok"
+        click.echo(f"  [{estado:>8}] {consulta['consulta']}: {' <- '.join(consulta['etapas'])}")
+
+    click.echo(f"Consultas sin índice: {sin_indice}")
+    if sin_indice:
+        raise SystemExit(1)
+
+
+@app.cli.command("migrate-images")
+@click.option("--batch-size", default=50, show_default=True, help="Documentos de 'imgs' convertidos por lote.")
+def migrate_images(batch_size):
+    """Convierte las imágenes guardadas en base64 a binario/GridFS."""
+    result = product_manager.migrate_images_to_binary(batch_size=batch_size)
+    click.echo(f"Imágenes migradas: {result['migrated']}")
+
+
+@app.cli.command("generate-image-variants")
+def generate_image_variants():
+    """Genera las miniaturas y variantes WebP que falten para todas las imágenes."""
+    result = product_manager.generate_all_image_variants()
+    click.echo(f"Variantes generadas: {result['generated']}")
+
+
+@app.cli.command("migrate-cart")
+@click.option("--batch-size", default=500, show_default=True, help="Productos del carrito movidos por lote.")
+def migrate_cart(batch_size):
+    """Mueve los carritos de 'cart' (un documento por producto) a 'carts' (un documento por cliente)."""
+    result = carrito_manager.migrate_cart_to_single_document(batch_size=batch_size)
+    click.echo(f"Productos del carrito migrados: {result['migrated']}")
+
+
+@app.cli.command("migrate-order-timestamps")
+@click.option("--batch-size", default=500, show_default=True, help="Pedidos convertidos por lote.")
+def migrate_order_timestamps(batch_size):
+    """Convierte los timestamps de texto de los pedidos en fechas BSON."""
+    result = pedidos_manager.migrate_timestamps_to_dates(batch_size=batch_size)
+    click.echo(f"Pedidos migrados: {result['migrated']}")
+
+
+@app.cli.command("migrate-order-products")
+@click.option("--batch-size", default=200, show_default=True, help="Pedidos actualizados por lote.")
+def migrate_order_products(batch_size):
+    """Guarda el nombre del modelo y el corte láser vigentes en los productos de los pedidos antiguos."""
+    result = pedidos_manager.migrate_snapshot_productos(batch_size=batch_size)
+    click.echo(f"Pedidos actualizados: {result['migrated']}")
+
+
+@app.cli.command("rebuild-stats")
+@click.option("--batch-size", default=500, show_default=True, help="Pedidos leídos por lote.")
+def rebuild_stats(batch_size):
+    """Recalcula la colección 'stats' a partir de todos los pedidos."""
+    result = pedidos_manager.rebuild_estadisticas(batch_size=batch_size)
+    if not result["success"]:
+        click.echo(result["error"])
+        raise SystemExit(1)
+    click.echo(f"Pedidos procesados: {result['pedidos']}, documentos de estadísticas: {result['documentos']}, "
+               f"eventos repetidos: {result['repetidos']} (generación {result['generacion']})")
+
 
-    return render_template(
-        "admin/dashboard.html",
-        grafico_clientes=grafico_clientes,
-        grafico_pedidos_mes=grafico_pedidos_mes,
-        grafico_productos=grafico_productos
-    )
 
+@app.cli.command("jobs-worker")
+@click.option("--once", is_flag=True, help="Procesa los trabajos pendientes y termina.")
+def jobs_worker(once):
+    """Ejecuta los trabajos en segundo plano (exportaciones e informes) encolados por la web."""
+    click.echo(f"Worker de trabajos iniciado (pid {os.getpid()})")
+    result = job_manager.run_worker(once=once)
+    click.echo(f"Trabajos procesados: {result['procesados']}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,136 @@
+"""
+Compara el Excel de un pedido grande generado con el escritor anterior (DataFrames de pandas recorridos con iterrows)
+y con ExcelExporter: tiempo (time.perf_counter) y pico de memoria de Python (tracemalloc).
+El pedido es sintético (por defecto 5.000 líneas), así que no hace falta conexión a la base de datos.
+
+    python benchmark_excel.py [--lineas 5000] [--runs 3]
+"""
+import argparse
+import gc
+import io
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+from DataManagers.ExcelExporter import ExcelExporter
+
+
+def tablas_sinteticas(lineas):
+    """Tablas de un pedido con 'lineas' productos, como las de PedidosManager.generate_pedido_tablas."""
+    aleatorio = random.Random(0)
+    tabla_pedido = {
+        "title": "Información del Pedido",
+        "columns": ["Orden ID", "Cliente", "Fecha", "Estado", "Total Pedidos", "Total Urnas"],
+        "rows": [["BENCH00001", "Cliente de prueba", datetime(2024, 1, 1).strftime("%Y-%m-%d %H:%M:%S"), "Enviado", lineas, lineas * 2]],
+    }
+    tabla_productos = {
+        "title": "Lista de Productos",
+        "columns": ["Modelo", "Cantidad", "Figura", "tam", "tipo-madera", "logo_grabado", "Comentarios"],
+        "rows": [
+            [f"Urna {i % 40}", str(aleatorio.randint(1, 5)), f"Figura {i % 12}", str(aleatorio.choice([10, 12, 15])),
+             aleatorio.choice(["Pino", "Roble", "Nogal"]), aleatorio.choice(["si", "no"]), f"Comentario de la línea {i}"]
+            for i in range(lineas)
+        ],
+    }
+    tabla_cortes = {
+        "title": "Detalles de Corte Láser",
+        "columns": ["tam", "grosor", "Figura", "Cantidad"],
+        "rows": [[str(10 + i % 6), "3mm", f"Figura {i % 12}", aleatorio.randint(1, 20)] for i in range(lineas // 2)],
+    }
+    return [tabla_pedido, tabla_productos, tabla_cortes]
+
+
+def exportar_anterior(tablas):
+    """Escritor anterior a ExcelExporter: un DataFrame por tabla, escrito celda a celda con iterrows."""
+    import numpy as np
+    import pandas as pd
+
+    dataframes = [pd.DataFrame(tabla["rows"], columns=tabla["columns"]) for tabla in tablas]
+    output = io.BytesIO()
+
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+        workbook = writer.book
+        worksheet = workbook.add_worksheet("Resumen Pedido")
+        title_formats = [
+            workbook.add_format({'bold': True, 'font_size': 16, 'align': 'center', 'valign': 'vcenter', 'bg_color': color, 'font_color': 'white'})
+            for color in ("#2F5597", "#009688", "#795548")
+        ]
+        header_formats = [
+            workbook.add_format({'bold': True, 'font_size': 12, 'bg_color': color, 'align': 'center', 'border': 1})
+            for color in ("#D9E1F2", "#B2DFDB", "#D7CCC8")
+        ]
+        cell_format = workbook.add_format({'font_size': 11, 'border': 1})
+        cell_center_format = workbook.add_format({'font_size': 11, 'border': 1, 'align': 'center'})
+
+        row = 0
+        for index, (tabla, df) in enumerate(zip(tablas, dataframes)):
+            if df.empty:
+                continue
+            df = df.replace([np.nan, None, np.inf, -np.inf], "")
+
+            worksheet.merge_range(row, 0, row, len(df.columns) - 1, tabla["title"], title_formats[index])
+            row += 1
+            for col_num, column_name in enumerate(df.columns):
+                worksheet.write(row, col_num, column_name, header_formats[index])
+            row += 1
+
+            for _, row_data in df.iterrows():
+                for col_num, value in enumerate(row_data):
+                    if isinstance(value, (int, float)) and not pd.isna(value):
+                        worksheet.write(row, col_num, value, cell_center_format)
+                    else:
+                        worksheet.write(row, col_num, str(value), cell_format)
+                row += 1
+
+            for col_num, column_name in enumerate(df.columns):
+                max_length = max(df[column_name].astype(str).apply(len).max(), len(column_name))
+                worksheet.set_column(col_num, col_num, max_length + 2)
+            row += 2
+
+    output.seek(0)
+    return output
+
+
+def exportar_actual(tablas):
+    """Motor actual, el que usan download_excel y download_excel_cliente."""
+    return ExcelExporter().export(tablas)
+
+
+def medir(exportar, tablas, runs):
+    """Devuelve la mediana del tiempo (s), el pico de memoria (MB) y el tamaño del archivo (KB)."""
+    exportar(tablas)  # Calentamiento: imports y cachés de los módulos
+
+    tiempos = []
+    for _ in range(runs):
+        gc.collect()
+        inicio = time.perf_counter()
+        output = exportar(tablas)
+        tiempos.append(time.perf_counter() - inicio)
+
+    # El pico de memoria se mide aparte: tracemalloc hace más lento el código que observa
+    gc.collect()
+    tracemalloc.start()
+    exportar(tablas)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return statistics.median(tiempos), pico / (1024 * 1024), len(output.getvalue()) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo y memoria de la exportación a Excel de un pedido.")
+    parser.add_argument("--lineas", type=int, default=5000, help="Líneas (productos) del pedido sintético.")
+    parser.add_argument("--runs", type=int, default=3, help="Repeticiones medidas de cada escritor.")
+    args = parser.parse_args()
+
+    tablas = tablas_sinteticas(args.lineas)
+    print(f"Pedido sintético: {args.lineas} líneas de producto, {len(tablas[2]['rows'])} de corte láser")
+
+    for nombre, exportar in (("Anterior (pandas)", exportar_anterior), ("ExcelExporter", exportar_actual)):
+        tiempo, pico, tamano = medir(exportar, tablas, args.runs)
+        print(f"{nombre:<18} {tiempo:8.3f} s (mediana de {args.runs})   pico {pico:7.1f} MB   archivo {tamano:7.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Mide lo que tarda en arrancar un worker: el import de app.py y el tiempo hasta responder la primera petición
+(la página de inicio de sesión, que no consulta la base de datos). Cada medición se hace en un proceso nuevo,
+como un worker recién creado por gunicorn.
+
+    python benchmark_startup.py [--runs 5]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Se ejecuta en un proceso nuevo en cada medición
+MEDICION = r"""
+import json, sys, time
+inicio = time.perf_counter()
+import app
+importado = time.perf_counter()
+respuesta = app.app.test_client().get("/")
+respondido = time.perf_counter()
+pesados = ["pandas", "numpy", "plotly", "xlsxwriter", "sendgrid", "PIL"]
+print(json.dumps({
+    "import_ms": (importado - inicio) * 1000,
+    "first_request_ms": (respondido - inicio) * 1000,
+    "status": respuesta.status_code,
+    "modulos_pesados": [modulo for modulo in pesados if modulo in sys.modules],
+}))
+"""
+
+
+def medir():
+    """Arranca un proceso de Python, importa la aplicación y atiende una petición."""
+    salida = subprocess.run([sys.executable, "-c", MEDICION], capture_output=True, text=True, check=True)
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de arranque de la aplicación.")
+    parser.add_argument("--runs", type=int, default=5, help="Número de procesos medidos.")
+    args = parser.parse_args()
+
+    mediciones = [medir() for _ in range(args.runs)]
+
+    print(f"Import de app.py:        {statistics.median(m['import_ms'] for m in mediciones):8.1f} ms (mediana de {args.runs})")
+    print(f"Hasta la 1ª respuesta:   {statistics.median(m['first_request_ms'] for m in mediciones):8.1f} ms (status {mediciones[-1]['status']})")
+    print(f"Módulos pesados cargados: {', '.join(mediciones[-1]['modulos_pesados']) or 'ninguno'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+import os
+
+# Las métricas de Prometheus de los workers se guardan en PROMETHEUS_MULTIPROC_DIR (ver DataManagers/Metrics.py).
+# Se define aquí, antes de cargar la aplicación, porque prometheus_client lo lee al importarse; "flask jobs-worker"
+# usa el mismo directorio en el Procfile. El resto de procesos (pruebas, comandos sueltos) no lo definen.
+metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/lepuppu_metrics")
+os.makedirs(metrics_dir, exist_ok=True)
+
+
+def on_starting(server):
+    """Borra las métricas de los procesos de un arranque anterior (las de los que siguen en marcha se conservan)."""
+    from DataManagers.Metrics import limpiar_procesos_terminados
+    limpiar_procesos_terminados()
+
+
+def child_exit(server, worker):
+    """Marca como terminado un worker para que sus métricas dejen de contarse como en vivo."""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
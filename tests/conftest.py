@@ -0,0 +1,71 @@
+"""
+Base de datos en memoria (mongomock) para probar los managers sin un servidor de MongoDB.
+mongomock no tiene sesiones ni transacciones y su bulk_write no acepta las operaciones de pymongo 4.9+,
+así que se completan aquí: las transacciones se ejecutan una vez, sin aislamiento.
+"""
+import pytest
+import pymongo
+
+try:
+    import mongomock
+except ImportError:  # Sin mongomock, las pruebas que usan 'database' se omiten
+    mongomock = None
+
+
+class SesionMemoria:
+    """Sesión sin transacciones: with_transaction ejecuta la función una sola vez."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def with_transaction(self, callback, **opciones):
+        return callback(None)
+
+
+def cliente_memoria():
+    """MongoClient de mongomock con start_session."""
+    client = mongomock.MongoClient()
+    client.start_session = lambda **opciones: SesionMemoria()
+    return client
+
+
+def bulk_write(self, requests, ordered=True, session=None, **opciones):
+    """bulk_write de mongomock reescrito con operaciones sueltas (UpdateOne, ReplaceOne, InsertOne, DeleteOne)."""
+    modificados = insertados = borrados = 0
+    for operacion in requests:
+        if isinstance(operacion, pymongo.UpdateOne):
+            modificados += self.update_one(operacion._filter, operacion._doc, upsert=operacion._upsert).modified_count
+        elif isinstance(operacion, pymongo.UpdateMany):
+            modificados += self.update_many(operacion._filter, operacion._doc, upsert=operacion._upsert).modified_count
+        elif isinstance(operacion, pymongo.ReplaceOne):
+            modificados += self.replace_one(operacion._filter, operacion._doc, upsert=operacion._upsert).modified_count
+        elif isinstance(operacion, pymongo.InsertOne):
+            self.insert_one(operacion._doc)
+            insertados += 1
+        elif isinstance(operacion, pymongo.DeleteOne):
+            borrados += self.delete_one(operacion._filter).deleted_count
+        else:
+            raise TypeError(f"Operación no soportada: {operacion!r}")
+    return type("BulkWriteResult", (), {"modified_count": modificados, "inserted_count": insertados, "deleted_count": borrados})()
+
+
+class DatabaseMemoria:
+    """Sustituye a DataManagers.Database con un cliente de mongomock."""
+
+    def __init__(self):
+        self.client = cliente_memoria()
+        self.db = self.client["test"]
+
+    def __getitem__(self, name):
+        return self.db[name]
+
+
+@pytest.fixture
+def database(monkeypatch):
+    if mongomock is None:
+        pytest.skip("mongomock no está instalado")
+    monkeypatch.setattr(mongomock.collection.Collection, "bulk_write", bulk_write)
+    return DatabaseMemoria()
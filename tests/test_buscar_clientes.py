@@ -0,0 +1,33 @@
+"""Búsqueda de clientes del filtro de pedidos: prefijo del nombre o del email, sin distinguir mayúsculas."""
+from DataManagers.UserManager import UserManager
+
+
+def crear_clientes(database):
+    manager = UserManager(database)
+    for nombre, email, access in [("Ana Pérez", "ana@example.com", "cliente"), ("Bruno", "anabel@example.com", "cliente"),
+                                  ("Carla", "carla@example.com", "cliente"), ("Anabella", "admin@example.com", "admin")]:
+        assert "éxito" in manager.create_user({"client_name": nombre, "phone": "1234567890", "email": email, "access": access})
+    return manager
+
+
+def test_busca_por_prefijo_del_nombre_o_del_email(database):
+    manager = crear_clientes(database)
+
+    resultado = manager.search_clients("ANA")
+
+    assert [cliente["client_name"] for cliente in resultado] == ["Ana Pérez", "Bruno"]
+
+
+def test_no_interpreta_el_texto_como_expresion_regular(database):
+    manager = crear_clientes(database)
+
+    assert manager.search_clients("a.a") == []
+    assert manager.search_clients("") == []
+
+
+def test_migracion_de_claves_de_busqueda(database):
+    database.db.usuarios.insert_one({"client_name": "Dora", "email": "DORA@example.com", "access": "cliente"})
+    manager = UserManager(database)
+
+    assert manager.migrate_search_keys()["migrated"] == 1
+    assert [cliente["email"] for cliente in manager.search_clients("dora@")] == ["DORA@example.com"]
@@ -0,0 +1,126 @@
+"""
+Regression test: get_product_details_from_cart must issue the same number of Mongo commands whatever the cart size
+(one read of the cart, one batched read of products and one of images), never one query per line item.
+
+It runs against an in-memory stand-in for the database that records every command. If TEST_MONGO_URI points to a
+real server, the same check also runs there with a pymongo CommandListener.
+"""
+import os
+import uuid
+import pytest
+from bson.objectid import ObjectId
+from pymongo import MongoClient, monitoring
+from DataManagers.CarritoManager import CarritoManager
+
+
+class ColeccionContada:
+    """Colección en memoria que anota en 'comandos' cada consulta que recibe (filtros de igualdad y $in)."""
+
+    def __init__(self, nombre, docs, comandos):
+        self.nombre = nombre
+        self.docs = docs
+        self.comandos = comandos
+
+    def _coincide(self, doc, filtro):
+        for campo, valor in filtro.items():
+            if isinstance(valor, dict):
+                if doc.get(campo) not in valor["$in"]:
+                    return False
+            elif doc.get(campo) != valor:
+                return False
+        return True
+
+    def find(self, filtro, projection=None):
+        self.comandos.append(("find", self.nombre))
+        return [doc for doc in self.docs if self._coincide(doc, filtro)]
+
+    def find_one(self, filtro, projection=None):
+        self.comandos.append(("find", self.nombre))
+        return next(iter(doc for doc in self.docs if self._coincide(doc, filtro)), None)
+
+
+class BaseContada:
+    def __init__(self, colecciones):
+        self.comandos = []
+        self.colecciones = {nombre: ColeccionContada(nombre, docs, self.comandos) for nombre, docs in colecciones.items()}
+
+    def __getitem__(self, nombre):
+        return self.colecciones[nombre]
+
+    def __getattr__(self, nombre):
+        return self.colecciones[nombre]
+
+
+class DatabaseContada:
+    """Sustituye a DataManagers.Database: los managers solo usan su atributo 'db'."""
+
+    def __init__(self, colecciones):
+        self.db = BaseContada(colecciones)
+
+
+def datos_carrito(client_id, lineas):
+    """Un carrito con 'lineas' productos distintos, cada uno con su imagen."""
+    productos = [{"_id": ObjectId(), "modelo": f"Urna {i}", "img_hashes": {"img_2": f"hash{i}"}} for i in range(lineas)]
+    imagenes = [{"_id": f"hash{i}"} for i in range(lineas)]
+    items = [
+        {"_id": ObjectId(), "entry_id": f"E{i}", "model": producto["_id"], "forms_lleno": {"Cantidad": "1"}}
+        for i, producto in enumerate(productos)
+    ]
+    return productos, imagenes, {"_id": client_id, "items": items}
+
+
+def comandos_detalle_carrito(lineas):
+    productos, imagenes, carrito = datos_carrito("cliente", lineas)
+    database = DatabaseContada({"carts": [carrito], "prods": productos, "imgs": imagenes})
+
+    detalles = CarritoManager(database).get_product_details_from_cart("cliente")
+    assert len(detalles) == lineas
+    return database.db.comandos
+
+
+def test_comandos_constantes_con_el_tamano_del_carrito():
+    assert comandos_detalle_carrito(1) == comandos_detalle_carrito(30)
+    assert len(comandos_detalle_carrito(30)) == 3
+
+
+class ContadorComandos(monitoring.CommandListener):
+    def __init__(self):
+        self.comandos = []
+
+    def started(self, event):
+        self.comandos.append(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+class DatabaseReal:
+    def __init__(self, client, nombre):
+        self.db = client[nombre]
+
+
+@pytest.mark.skipif(not os.getenv("TEST_MONGO_URI"), reason="TEST_MONGO_URI no está definido")
+def test_comandos_constantes_en_mongodb():
+    contador = ContadorComandos()
+    client = MongoClient(os.getenv("TEST_MONGO_URI"), event_listeners=[contador])
+    nombre = f"test_carrito_{uuid.uuid4().hex[:8]}"
+    try:
+        database = DatabaseReal(client, nombre)
+        cantidades = []
+        for lineas in (1, 30):
+            productos, imagenes, carrito = datos_carrito(f"cliente{lineas}", lineas)
+            database.db.prods.insert_many(productos)
+            database.db.imgs.insert_many(imagenes)
+            database.db.carts.insert_one(carrito)
+
+            contador.comandos.clear()
+            assert len(CarritoManager(database).get_product_details_from_cart(f"cliente{lineas}")) == lineas
+            cantidades.append(list(contador.comandos))
+
+        assert cantidades[0] == cantidades[1]
+    finally:
+        client.drop_database(nombre)
+        client.close()
@@ -0,0 +1,52 @@
+"""Checkout idempotente: reintentar finalizar_compra con la misma clave devuelve el pedido ya creado."""
+from DataManagers.CarritoManager import CarritoManager
+
+
+def preparar_carrito(database, lineas=2):
+    client_id = str(database.db.usuarios.insert_one({"client_name": "Ana", "access": "cliente"}).inserted_id)
+    producto = database.db.prods.insert_one({"modelo": "Urna A", "corte_lazer_hash": None}).inserted_id
+
+    manager = CarritoManager(database)
+    for _ in range(lineas):
+        manager.set_prod_in_cart(client_id, str(producto), {"Cantidad": "3", "Figura": "A"})
+    return manager, client_id
+
+
+def test_reintento_con_la_misma_clave_no_duplica_el_pedido(database):
+    manager, client_id = preparar_carrito(database)
+
+    primera = manager.finalizar_compra(client_id, idempotency_key="clave-1")
+    reintento = manager.finalizar_compra(client_id, idempotency_key="clave-1")
+
+    assert primera["success"] and reintento["success"]
+    assert reintento["orden_id"] == primera["orden_id"]
+    assert database.db.orders.count_documents({}) == 1
+
+    pedido = database.db.orders.find_one({})
+    assert pedido["total_pedidos"] == 2
+    assert pedido["total_urnas"] == 6
+    assert pedido["productos"][0]["modelo"] == "Urna A"
+
+
+def test_el_checkout_vacia_el_carrito(database):
+    manager, client_id = preparar_carrito(database)
+
+    manager.finalizar_compra(client_id, idempotency_key="clave-1")
+
+    assert manager.count_carrito_for_client(client_id) == 0
+    assert manager.finalizar_compra(client_id, idempotency_key="clave-2") == {
+        "success": False, "error": "No hay productos en el carrito."
+    }
+    assert database.db.orders.count_documents({}) == 1
+
+
+def test_cada_clave_crea_su_propio_pedido(database):
+    manager, client_id = preparar_carrito(database, lineas=1)
+    primera = manager.finalizar_compra(client_id, idempotency_key="clave-1")
+
+    producto = database.db.prods.find_one({})["_id"]
+    manager.set_prod_in_cart(client_id, str(producto), {"Cantidad": "1"})
+    segunda = manager.finalizar_compra(client_id, idempotency_key="clave-2")
+
+    assert primera["orden_id"] != segunda["orden_id"]
+    assert database.db.orders.count_documents({"client_id": client_id}) == 2
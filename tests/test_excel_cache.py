@@ -0,0 +1,67 @@
+"""Caché de los Excel de los pedidos ('excel_cache'): una lectura por acierto y tamaño total mantenido al guardar y borrar."""
+from datetime import datetime
+import pytest
+from DataManagers import PedidosManager as pedidos_module
+from DataManagers.PedidosManager import PedidosManager
+
+
+def crear_pedido(database):
+    client_id = str(database.db.usuarios.insert_one({"client_name": "Ana", "access": "cliente"}).inserted_id)
+    productos = [{"modelo": "Urna A", "forms_lleno": {"Cantidad": "2", "Figura": "A"}, "corte_lazer_hash": None}]
+    return str(database.db.orders.insert_one({
+        "orden_id": "P1", "client_id": client_id, "estado": "Enviado", "timestamp": datetime(2024, 3, 1),
+        "total_pedidos": 1, "total_urnas": 2, "productos": productos,
+    }).inserted_id)
+
+
+def tamano_total(database):
+    return database.db.cache_versions.find_one({"_id": "excel_cache"})["size"]
+
+
+def test_un_acierto_de_la_cache_no_lee_el_pedido_ni_escribe(database, monkeypatch):
+    pedido_id = crear_pedido(database)
+    manager = PedidosManager(database)
+    primera = manager.get_excel_pedido(pedido_id, 0)
+    guardado = database.db.excel_cache.find_one({"_id": primera["etag"]})
+
+    monkeypatch.setattr(manager, "get_pedidos_por_id", lambda pedido_id: pytest.fail("leyó el pedido"))
+    segunda = manager.get_excel_pedido(pedido_id, 0)
+
+    assert segunda == {"data": primera["data"], "etag": f"{pedido_id}-0-admin"}
+    assert database.db.excel_cache.find_one({"_id": primera["etag"]})["accessed_at"] == guardado["accessed_at"]
+
+
+def test_el_excel_se_guarda_con_la_version_que_se_genero(database):
+    pedido_id = crear_pedido(database)
+    database.db.orders.update_one({}, {"$set": {"version": 1}})  # Cambió de estado después de leer la versión 0
+
+    excel = PedidosManager(database).get_excel_pedido(pedido_id, 0, cliente=True)
+
+    assert excel["etag"] == f"{pedido_id}-1-cliente"
+    assert database.db.excel_cache.distinct("_id") == [f"{pedido_id}-1-cliente"]
+
+
+def test_el_tamano_total_se_mantiene_al_guardar_y_borrar(database):
+    pedido_id = crear_pedido(database)
+    manager = PedidosManager(database)
+    admin = manager.get_excel_pedido(pedido_id, 0)
+    cliente = manager.get_excel_pedido(pedido_id, 0, cliente=True)
+    assert tamano_total(database) == len(admin["data"]) + len(cliente["data"])
+
+    manager.toggle_estado_pedido(pedido_id)
+
+    assert database.db.excel_cache.count_documents({}) == 0
+    assert tamano_total(database) == 0
+
+
+def test_se_desalojan_los_usados_hace_mas_tiempo(database, monkeypatch):
+    pedido_id = crear_pedido(database)
+    manager = PedidosManager(database)
+    admin = manager.get_excel_pedido(pedido_id, 0)
+    database.db.excel_cache.update_one({"_id": admin["etag"]}, {"$set": {"accessed_at": datetime(2024, 1, 1)}})
+
+    monkeypatch.setattr(pedidos_module, "EXCEL_CACHE_MAX_BYTES", len(admin["data"]) + 1)
+    cliente = manager.get_excel_pedido(pedido_id, 0, cliente=True)
+
+    assert database.db.excel_cache.distinct("_id") == [cliente["etag"]]
+    assert tamano_total(database) == len(cliente["data"])
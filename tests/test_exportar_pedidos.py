@@ -0,0 +1,16 @@
+"""Nombre de los archivos de exportación de pedidos: solo las fechas válidas del filtro."""
+from DataManagers.PedidosManager import PedidosManager
+
+
+def test_el_nombre_usa_las_fechas_interpretadas():
+    manager = PedidosManager(database=object())
+
+    assert manager.nombre_exportacion("2024-03-01", "2024-03-31") == "pedidos_2024-03-01_2024-03-31"
+    assert manager.nombre_exportacion(None, "2024-03-31") == "pedidos_2024-03-31"
+    assert manager.nombre_exportacion() == "pedidos"
+
+
+def test_el_texto_de_la_url_nunca_llega_al_nombre():
+    manager = PedidosManager(database=object())
+
+    assert manager.nombre_exportacion('2024-03-01"; x=".exe', "../../etc") == "pedidos"
@@ -0,0 +1,92 @@
+"""Cola de trabajos: toma atómica del más antiguo, reintento de los abandonados y cancelación de los pendientes."""
+from datetime import datetime, timedelta
+from DataManagers import JobManager as job_module
+from DataManagers.JobManager import JobManager
+
+
+def crear_manager(database, **tareas):
+    manager = JobManager(database)
+    manager.register("sumar", lambda a, b: {"total": a + b})
+    for tipo, funcion in tareas.items():
+        manager.register(tipo, funcion)
+    return manager
+
+
+def abandonar(database, job_id, minutos=60):
+    """Simula un worker que tomó el trabajo hace 'minutos' y murió."""
+    database.db.jobs.update_one({"_id": job_id}, {"$set": {"started_at": datetime.now() - timedelta(minutes=minutos)}})
+
+
+def test_toma_primero_el_trabajo_mas_antiguo_y_una_sola_vez(database):
+    manager = crear_manager(database)
+    primero = manager.encolar("sumar", {"a": 1, "b": 2})["job_id"]
+    segundo = manager.encolar("sumar", {"a": 3, "b": 4})["job_id"]
+
+    tomados = [manager.tomar_siguiente(), manager.tomar_siguiente(), manager.tomar_siguiente()]
+
+    assert [str(job["_id"]) for job in tomados[:2]] == [primero, segundo]
+    assert tomados[2] is None
+    assert all(job["estado"] == "en_proceso" and job["intentos"] == 1 for job in tomados[:2])
+
+
+def test_ejecuta_y_guarda_el_resultado_o_el_error(database):
+    def fallar():
+        raise RuntimeError("sin datos")
+
+    manager = crear_manager(database, fallar=fallar)
+    bien = manager.encolar("sumar", {"a": 1, "b": 2})["job_id"]
+    mal = manager.encolar("fallar")["job_id"]
+
+    assert manager.run_worker(once=True) == {"success": True, "procesados": 2}
+
+    assert manager.get_job(bien)["estado"] == "terminado"
+    assert manager.get_job(bien)["resultado"] == {"total": 3}
+    assert manager.get_job(mal)["estado"] == "error"
+    assert manager.get_job(mal)["error"] == "sin datos"
+
+
+def test_un_trabajo_abandonado_se_reintenta_hasta_agotar_los_intentos(database, monkeypatch):
+    monkeypatch.setattr(job_module, "JOBS_MAX_INTENTOS", 2)
+    manager = crear_manager(database)
+    job_id = manager.encolar("sumar", {"a": 1, "b": 2})["job_id"]
+
+    tomado = manager.tomar_siguiente()
+    assert manager.tomar_siguiente() is None  # Sigue en proceso y no ha vencido
+
+    abandonar(database, tomado["_id"])
+    reintento = manager.tomar_siguiente()
+    assert str(reintento["_id"]) == job_id and reintento["intentos"] == 2
+
+    abandonar(database, tomado["_id"])
+    assert manager.tomar_siguiente() is None
+    assert manager.marcar_abandonados() == 1
+    assert manager.get_job(job_id)["estado"] == "error"
+
+
+def test_solo_se_cancelan_los_trabajos_pendientes(database):
+    manager = crear_manager(database)
+    pendiente = manager.encolar("sumar", {"a": 1, "b": 2})["job_id"]
+    tomado = manager.encolar("sumar", {"a": 3, "b": 4})["job_id"]
+    database.db.jobs.update_one({"_id": job_module.ObjectId(tomado)}, {"$set": {"estado": "en_proceso", "started_at": datetime.now()}})
+
+    assert manager.cancelar(pendiente) is True
+    assert manager.cancelar(tomado) is False
+    assert manager.cancelar("no-es-un-id") is False
+
+    assert manager.get_job(pendiente)["estado"] == "cancelado"
+    assert manager.tomar_siguiente() is None
+    assert manager.get_archivo(pendiente) is None
+
+
+def test_los_trabajos_expirados_se_purgan(database):
+    manager = crear_manager(database)
+    job_id = manager.encolar("sumar", {"a": 1, "b": 2})["job_id"]
+    manager.run_worker(once=True)
+    database.db.jobs.update_one({}, {"$set": {"expires_at": datetime.now() - timedelta(seconds=1)}})
+
+    assert manager.purgar_expirados() == 1
+    assert manager.get_job(job_id) is None
+
+
+def test_no_encola_tipos_desconocidos(database):
+    assert crear_manager(database).encolar("otro") == {"success": False, "error": "Tipo de trabajo desconocido: otro"}
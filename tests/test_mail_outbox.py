@@ -0,0 +1,87 @@
+"""Bandeja de salida de correos: reintentos con espera exponencial y correos abandonados por un enviador que murió."""
+import email
+import os
+from datetime import datetime, timedelta
+from DataManagers import MailOutbox as outbox_module
+from DataManagers.MailOutbox import MailOutbox
+from DataManagers.MailSender import MailSender, MailTransport, FileTransport
+
+
+class TransporteDePrueba(MailTransport):
+    """Guarda los destinatarios enviados; falla con los que estén en 'fallar'."""
+
+    def __init__(self, fallar=()):
+        self.enviados = []
+        self.fallar = set(fallar)
+
+    def send(self, message):
+        if message["to"] in self.fallar:
+            raise ConnectionError("buzón no disponible")
+        self.enviados.append(message["to"])
+
+
+def crear_outbox(database, transporte):
+    return MailOutbox(database, mail_sender=MailSender(transport=transporte), sender_thread=False)
+
+
+def mensaje(to):
+    return {"from": "tienda@example.com", "to": to, "subject": "Hola", "html": "<p>Hola</p>"}
+
+
+def test_la_espera_se_duplica_en_cada_intento_hasta_el_maximo(monkeypatch):
+    monkeypatch.setattr(outbox_module.random, "uniform", lambda a, b: 1)
+    monkeypatch.setattr(outbox_module, "MAIL_RETRY_BASE_SECONDS", 30)
+    monkeypatch.setattr(outbox_module, "MAIL_RETRY_MAX_SECONDS", 200)
+    outbox = MailOutbox(database=object(), mail_sender=MailSender(transport=TransporteDePrueba()), sender_thread=False)
+
+    assert [outbox.backoff(intentos) for intentos in range(1, 6)] == [30, 60, 120, 200, 200]
+
+
+def test_el_azar_nunca_supera_el_maximo(monkeypatch):
+    monkeypatch.setattr(outbox_module.random, "uniform", lambda a, b: b)
+    outbox = MailOutbox(database=object(), mail_sender=MailSender(transport=TransporteDePrueba()), sender_thread=False)
+
+    assert outbox.backoff(50) == outbox_module.MAIL_RETRY_MAX_SECONDS
+
+
+def test_un_fallo_se_reintenta_mas_tarde_y_despues_se_da_por_fallido(database, monkeypatch):
+    monkeypatch.setattr(outbox_module, "MAIL_MAX_INTENTOS", 2)
+    transporte = TransporteDePrueba(fallar={"b@example.com"})
+    outbox = crear_outbox(database, transporte)
+    outbox.enqueue(mensaje("a@example.com"))
+    outbox.enqueue(mensaje("b@example.com"))
+
+    assert outbox.send_pending() == {"enviados": 1, "fallidos": 1}
+    fallido = database.db.email_outbox.find_one({"to": "b@example.com"})
+    assert fallido["estado"] == "pendiente" and fallido["intentos"] == 1
+    assert fallido["next_attempt_at"] > datetime.now()
+    assert outbox.send_pending() == {"enviados": 0, "fallidos": 0}  # Todavía no toca reintentarlo
+
+    database.db.email_outbox.update_one({"_id": fallido["_id"]}, {"$set": {"next_attempt_at": datetime.now()}})
+    assert outbox.send_pending() == {"enviados": 0, "fallidos": 1}
+    assert database.db.email_outbox.find_one({"_id": fallido["_id"]})["estado"] == "fallido"
+    assert transporte.enviados == ["a@example.com"]
+
+
+def test_un_correo_abandonado_se_toma_de_nuevo_al_vencer_su_plazo(database):
+    transporte = TransporteDePrueba()
+    outbox = crear_outbox(database, transporte)
+    outbox.enqueue(mensaje("a@example.com"))
+
+    # Un enviador tomó el correo y murió antes de enviarlo
+    assert len(outbox.claim_batch()) == 1
+    assert outbox.send_pending() == {"enviados": 0, "fallidos": 0}
+
+    database.db.email_outbox.update_one({}, {"$set": {"lease_until": datetime.now() - timedelta(seconds=1)}})
+    assert outbox.send_pending() == {"enviados": 1, "fallidos": 0}
+    assert transporte.enviados == ["a@example.com"]
+    assert database.db.email_outbox.find_one({})["estado"] == "enviado"
+
+
+def test_file_transport_no_usa_el_destinatario_en_la_ruta(tmp_path):
+    FileTransport(directory=str(tmp_path)).send(mensaje("../otro/a@example.com"))
+
+    archivos = os.listdir(tmp_path)
+    assert len(archivos) == 1 and archivos[0].endswith(".eml")
+    with open(tmp_path / archivos[0], "rb") as archivo:
+        assert email.message_from_bytes(archivo.read())["To"] == "../otro/a@example.com"
@@ -0,0 +1,65 @@
+"""Listado de pedidos del administrador: paginación por cursor sobre (timestamp, _id) y filtros."""
+from datetime import datetime, timedelta
+from DataManagers.PedidosManager import PedidosManager
+
+
+def crear_pedidos(database):
+    """Nueve pedidos en cinco instantes distintos (varios comparten timestamp, como los de un mismo segundo)."""
+    inicio = datetime(2024, 3, 1, 12, 0, 0)
+    pedidos = [
+        {"orden_id": f"P{i}", "client_id": "c1" if i % 2 else "c2", "estado": "Enviado" if i % 3 else "Terminado",
+         "timestamp": inicio + timedelta(days=i // 2), "total_pedidos": 1, "total_urnas": 1, "productos": []}
+        for i in range(9)
+    ]
+    database.db.orders.insert_many(pedidos)
+    return pedidos
+
+
+def recorrer_paginas(manager, limit, **filtros):
+    paginas = []
+    cursor = None
+    while True:
+        pagina = manager.get_pedidos(cursor=cursor, limit=limit, **filtros)
+        paginas.append([pedido["orden_id"] for pedido in pagina["pedidos"]])
+        cursor = pagina["next_cursor"]
+        if cursor is None:
+            return paginas
+
+
+def orden_esperado(pedidos):
+    return [p["orden_id"] for p in sorted(pedidos, key=lambda p: (p["timestamp"], p["_id"]), reverse=True)]
+
+
+def test_las_paginas_recorren_todos_los_pedidos_una_vez_en_orden(database):
+    pedidos = crear_pedidos(database)
+
+    paginas = recorrer_paginas(PedidosManager(database), limit=2)
+
+    assert [len(pagina) for pagina in paginas] == [2, 2, 2, 2, 1]
+    assert [orden for pagina in paginas for orden in pagina] == orden_esperado(pedidos)
+
+
+def test_la_ultima_pagina_completa_no_tiene_cursor(database):
+    crear_pedidos(database)
+
+    pagina = PedidosManager(database).get_pedidos(limit=9)
+
+    assert len(pagina["pedidos"]) == 9
+    assert pagina["next_cursor"] is None
+
+
+def test_la_paginacion_respeta_los_filtros(database):
+    pedidos = crear_pedidos(database)
+
+    paginas = recorrer_paginas(PedidosManager(database), limit=2, estado="Enviado", client_id="c1")
+
+    esperados = [p for p in pedidos if p["estado"] == "Enviado" and p["client_id"] == "c1"]
+    assert [orden for pagina in paginas for orden in pagina] == orden_esperado(esperados)
+
+
+def test_un_cursor_invalido_empieza_por_la_primera_pagina(database):
+    pedidos = crear_pedidos(database)
+
+    pagina = PedidosManager(database).get_pedidos(cursor="basura", limit=3)
+
+    assert [p["orden_id"] for p in pagina["pedidos"]] == orden_esperado(pedidos)[:3]
@@ -0,0 +1,62 @@
+"""Migraciones de datos: se aplican una vez, por orden de versión, y se detienen en la primera que falla."""
+from DataManagers.SchemaManager import SchemaManager
+
+
+def crear_manager(database, aplicadas, fallar=()):
+    """SchemaManager con migraciones que anotan su versión en 'aplicadas' (las de 'fallar' fallan)."""
+    manager = SchemaManager(database)
+    manager.ensure_schema = lambda: []  # Los índices no son parte de estas pruebas
+
+    def migracion(version):
+        def aplicar():
+            if version in fallar:
+                raise RuntimeError(f"falló {version}")
+            aplicadas.append(version)
+            return {"success": True}
+        return aplicar
+
+    for version in ("0003", "0001", "0002"):
+        manager.register_migration(version, f"Migración {version}", migracion(version))
+    return manager
+
+
+def estados(resultado):
+    return [(migracion["version"], migracion["estado"]) for migracion in resultado["migraciones"]]
+
+
+def test_se_aplican_en_orden_de_version_y_una_sola_vez(database):
+    aplicadas = []
+    manager = crear_manager(database, aplicadas)
+
+    assert estados(manager.migrate()) == [("0001", "aplicada"), ("0002", "aplicada"), ("0003", "aplicada")]
+    assert manager.migrate()["migraciones"] == []
+    assert aplicadas == ["0001", "0002", "0003"]
+
+
+def test_se_detiene_en_la_primera_que_falla_y_la_reintenta_despues(database):
+    aplicadas = []
+    resultado = crear_manager(database, aplicadas, fallar={"0002"}).migrate()
+
+    assert estados(resultado) == [("0001", "aplicada"), ("0002", "error")]
+    assert resultado["migraciones"][1]["error"] == "falló 0002"
+    assert aplicadas == ["0001"]
+
+    assert estados(crear_manager(database, aplicadas).migrate()) == [("0002", "aplicada"), ("0003", "aplicada")]
+    assert aplicadas == ["0001", "0002", "0003"]
+
+
+def test_un_resultado_sin_exito_cuenta_como_fallo(database):
+    manager = SchemaManager(database)
+    manager.ensure_schema = lambda: []
+    manager.register_migration("0001", "Ocupada", lambda: {"success": False, "error": "en curso"})
+
+    assert estados(manager.migrate()) == [("0001", "error")]
+    assert manager.migration_status()[0]["applied_at"] is None
+
+
+def test_dry_run_no_aplica_nada(database):
+    aplicadas = []
+    manager = crear_manager(database, aplicadas)
+
+    assert estados(manager.migrate(dry_run=True)) == [("0001", "pendiente"), ("0002", "pendiente"), ("0003", "pendiente")]
+    assert aplicadas == []
@@ -0,0 +1,128 @@
+"""Estadísticas de pedidos: $inc idempotentes después del checkout y reconstrucción por generaciones."""
+from DataManagers import StatsRollup as stats_rollup
+from DataManagers.CarritoManager import CarritoManager
+from DataManagers.PedidosManager import PedidosManager
+
+
+def cliente(database, nombre):
+    """Id de un cliente ('c1', 'c2'...) creado la primera vez que se usa."""
+    usuario = database.db.usuarios.find_one({"client_name": nombre})
+    if not usuario:
+        return str(database.db.usuarios.insert_one({"client_name": nombre, "access": "cliente"}).inserted_id)
+    return str(usuario["_id"])
+
+
+def comprar(database, nombre, clave, cantidad="2"):
+    client_id = cliente(database, nombre)
+    producto = database.db.prods.find_one({"modelo": "Urna A"}) or {"_id": database.db.prods.insert_one({"modelo": "Urna A"}).inserted_id}
+    manager = CarritoManager(database)
+    manager.set_prod_in_cart(client_id, str(producto["_id"]), {"Cantidad": cantidad})
+    return manager.finalizar_compra(client_id, idempotency_key=clave)
+
+
+def resumen(stats):
+    """Lo que leen el dashboard y el perfil del cliente, sin depender de la generación."""
+    return {
+        "estados": stats.get_estados(),
+        "clientes": stats.get_clientes(),
+        "productos": stats.get_productos(),
+        "dias": stats.get_dias("2000-01-01"),
+    }
+
+
+def recalculado(database):
+    """Resumen de una reconstrucción sin escrituras concurrentes: el valor correcto."""
+    stats = stats_rollup.StatsRollup(database)
+    assert stats.rebuild(espera=0)["success"]
+    return resumen(stats)
+
+
+def test_el_reintento_del_checkout_no_cuenta_dos_veces_el_pedido(database):
+    primera = comprar(database, "c1", "clave-1")
+    CarritoManager(database).finalizar_compra(cliente(database, "c1"), idempotency_key="clave-1")
+
+    stats = stats_rollup.StatsRollup(database)
+    assert primera["success"]
+    assert stats.get_estados() == {"Enviado": 1}
+    assert stats.get_cliente(cliente(database, "c1")) == {"pedidos": 1, "urnas": 2}
+    assert stats.registrar_pedido(database.db.orders.find_one({})["_id"]) is False
+
+
+def test_un_checkout_interrumpido_se_suma_con_registrar_pendientes(database):
+    comprar(database, "c1", "clave-1")
+    database.db.orders.insert_one({"client_id": cliente(database, "c2"), "estado": "Enviado", "total_urnas": 3, "productos": [], "stats_aplicadas": False})
+
+    stats = stats_rollup.StatsRollup(database)
+    assert stats.get_estados() == {"Enviado": 1}
+    assert stats.registrar_pendientes() == 1
+    assert stats.registrar_pendientes() == 0
+    assert stats.get_estados() == {"Enviado": 2}
+    assert stats.get_cliente(cliente(database, "c2")) == {"pedidos": 1, "urnas": 3}
+
+
+def test_rebuild_activa_una_generacion_nueva_con_los_mismos_totales(database, monkeypatch):
+    monkeypatch.setattr(stats_rollup.time, "sleep", lambda segundos: None)
+    comprar(database, "c1", "clave-1")
+    comprar(database, "c2", "clave-2", cantidad="5")
+    pedidos = PedidosManager(database)
+    pedidos.toggle_estado_pedido(str(database.db.orders.find_one({"client_id": cliente(database, "c1")})["_id"]))
+    incremental = resumen(stats_rollup.StatsRollup(database))
+
+    resultado = pedidos.rebuild_estadisticas()
+
+    stats = stats_rollup.StatsRollup(database)
+    assert resultado["success"] and resultado["pedidos"] == 2
+    assert stats.generacion() == resultado["generacion"]
+    assert resumen(stats) == incremental
+    assert database.db.stats.count_documents({"generacion": {"$ne": stats.generacion()}}) == 0
+
+
+def test_las_escrituras_durante_rebuild_no_se_pierden_ni_se_duplican(database, monkeypatch):
+    comprar(database, "c1", "clave-1")
+    pedidos = PedidosManager(database)
+
+    # Una compra y un cambio de estado antes de leer los pedidos (la lectura ya los incluye y están anotados)
+    # y otra compra después de activar la generación nueva (va directamente a ella)
+    escrituras = [
+        lambda: (comprar(database, "c2", "clave-2"), pedidos.toggle_estado_pedido(str(database.db.orders.find_one({"client_id": cliente(database, "c1")})["_id"]))),
+        lambda: comprar(database, "c3", "clave-3"),
+    ]
+    monkeypatch.setattr(stats_rollup.time, "sleep", lambda segundos: escrituras and escrituras.pop(0)())
+
+    assert stats_rollup.StatsRollup(database).rebuild()["success"]
+
+    assert not escrituras
+    assert database.db.stats_pendientes.count_documents({}) == 0
+    assert resumen(stats_rollup.StatsRollup(database)) == recalculado(database)
+    assert stats_rollup.StatsRollup(database).get_estados() == {"Enviado": 2, "En Proceso": 1}
+
+
+def test_los_eventos_anotados_que_la_lectura_no_incluye_se_repiten(database):
+    comprar(database, "c1", "clave-1")
+    stats = stats_rollup.StatsRollup(database)
+    assert stats.rebuild(espera=0)["success"]
+    generacion = stats.generacion()
+
+    # Un pedido borrado después de la lectura: la generación nueva lo cuenta y el evento anotado lo resta
+    pedido = database.db.orders.find_one({}, stats_rollup.PROYECCION_PEDIDO)
+    database.db.cache_versions.update_one({"_id": "stats"}, {"$set": {"reconstruyendo": generacion + 1}})
+    database.db.stats.insert_many([
+        {**doc, "_id": doc["_id"].replace(f"{generacion}:", f"{generacion + 1}:", 1), "generacion": generacion + 1}
+        for doc in database.db.stats.find({"generacion": generacion})
+    ])
+    stats.eliminar_pedido(pedido)
+
+    leidos = {pedido["_id"]: {"contado": True, "estado": "Enviado"}}
+    assert stats.repetir_pendientes(generacion + 1, None, leidos) == 1
+
+    nueva = database.db.stats.find_one({"_id": f"{generacion + 1}:estado:Enviado"})
+    assert nueva["pedidos"] == 0
+    assert leidos[pedido["_id"]] == {"contado": False, "estado": None}
+
+
+def test_solo_una_reconstruccion_a_la_vez(database):
+    stats = stats_rollup.StatsRollup(database)
+    database.db.cache_versions.insert_one({"_id": "stats", "generacion": 0, "reconstruyendo": 1, "reconstruyendo_desde": stats_rollup.datetime.now()})
+
+    assert stats.rebuild(espera=0) == {"success": False, "error": "Ya hay otra reconstrucción de las estadísticas en curso."}
+    assert stats.generacion() == 0